@@ -0,0 +1,235 @@
+"""Headless HTTP API over chat_core.
+
+    uvicorn api:app --workers 4      (or: python api.py)
+
+Every piece of state lives in SQLite (WAL mode), so any worker can serve any request. Each worker keeps one
+pooled Groq client per API key; database work runs on the engine's connection pool in worker threads.
+"""
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
+
+from audio_pipeline import asave_upload, cleanup_uploads
+from chat_core import (
+    AUDIO_TYPES, DEFAULT_TRANSCRIPTION_MODEL, DEFAULT_USER_NAME, HISTORY_PAGE_SIZE, NEW_CONVERSATION_TITLE,
+    UPLOADS_DIR, add_assistant_message, add_user_message, build_history, clear_conversation,
+    create_async_groq_client, create_conversation, create_groq_client, get_conversation, get_groq_models,
+    get_or_create_user, initialize_db, list_conversations, load_chat_history_page, model_catalog_status,
+    resolve_api_key, save_feedback, search_conversation, transcribe
+)
+from database import flush_pending_writes
+from feedback_rollups import feedback_summary
+from history_archive import start_maintenance, stop_maintenance
+from metrics import EXPOSITION_CONTENT_TYPE, REGISTRY
+from metrics_store import latency_by_model
+from model_router import AUTO_MODEL, acomplete_chat, astream_chat_response, context_model
+
+API_HOST = os.getenv("LLAMABOT_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("LLAMABOT_API_PORT", "8000"))
+API_WORKERS = int(os.getenv("LLAMABOT_API_WORKERS", "1"))
+
+
+class ConversationCreate(BaseModel):
+    user: str = DEFAULT_USER_NAME
+    title: str = NEW_CONVERSATION_TITLE
+
+
+class ChatRequest(BaseModel):
+    content: str
+    model: str
+    stream: bool = True
+    use_cache: bool = True
+
+
+class FeedbackRequest(BaseModel):
+    is_positive: bool
+    comment: Optional[str] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(initialize_db)
+    api_key = resolve_api_key()
+    # The sync client serves summaries and transcription, which run in worker threads
+    app.state.groq = create_async_groq_client(api_key) if api_key else None
+    app.state.groq_sync = create_groq_client(api_key) if api_key else None
+    start_maintenance()
+    yield
+    stop_maintenance()
+    if app.state.groq is not None:
+        await app.state.groq.close()
+    await asyncio.to_thread(flush_pending_writes)
+
+
+app = FastAPI(title="LLAMABOT API", lifespan=lifespan)
+
+
+def _clients(request: Request):
+    if request.app.state.groq is None:
+        raise HTTPException(503, "No Groq API key configured; set GROQ_API_KEY or add it to config.json.")
+    return request.app.state.groq, request.app.state.groq_sync
+
+
+async def _require_conversation(conversation_id: int):
+    if await asyncio.to_thread(get_conversation, conversation_id) is None:
+        raise HTTPException(404, f"Conversation {conversation_id} not found.")
+
+
+def _sse(data: Dict, event: Optional[str] = None) -> str:
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def metrics():
+    # This worker's counters and histograms; scrape every worker, or use /metrics/latency for all of them
+    return Response(REGISTRY.exposition(), media_type=EXPOSITION_CONTENT_TYPE)
+
+
+@app.get("/metrics/latency")
+async def metrics_latency(hours: Optional[float] = None) -> List[Dict]:
+    since = time.time() - hours * 3600 if hours else None
+    return await asyncio.to_thread(latency_by_model, since)
+
+
+@app.get("/models")
+async def models():
+    # Served from the shared catalog, which keeps the last good list while the API is unreachable
+    available = await asyncio.to_thread(get_groq_models)
+    if not available:
+        raise HTTPException(502, f"No model list available: {model_catalog_status()['last_error']}")
+    # "auto" routes each request to one of the listed models
+    return available + [AUTO_MODEL]
+
+
+@app.get("/conversations")
+async def conversations(user: str = DEFAULT_USER_NAME) -> List[Dict]:
+    user_id = await asyncio.to_thread(get_or_create_user, user)
+    return await asyncio.to_thread(list_conversations, user_id)
+
+
+@app.post("/conversations", status_code=201)
+async def new_conversation(body: ConversationCreate):
+    user_id = await asyncio.to_thread(get_or_create_user, body.user)
+    return {"id": await asyncio.to_thread(create_conversation, user_id, body.title), "title": body.title}
+
+
+@app.get("/conversations/{conversation_id}/messages")
+async def messages(conversation_id: int, before_id: Optional[int] = None, limit: int = HISTORY_PAGE_SIZE):
+    await _require_conversation(conversation_id)
+    page, has_older = await asyncio.to_thread(load_chat_history_page, conversation_id, before_id, limit)
+    return {"messages": page, "has_older": has_older}
+
+
+@app.delete("/conversations/{conversation_id}/messages", status_code=204)
+async def clear_messages(conversation_id: int):
+    await _require_conversation(conversation_id)
+    await asyncio.to_thread(clear_conversation, conversation_id)
+    return Response(status_code=204)
+
+
+@app.get("/conversations/{conversation_id}/search")
+async def search(conversation_id: int, q: str, role: Optional[str] = None, model_id: Optional[str] = None,
+                 start_date: Optional[date] = None, end_date: Optional[date] = None, page: int = 0):
+    await _require_conversation(conversation_id)
+    results, has_more = await asyncio.to_thread(search_conversation, q, conversation_id, role, model_id,
+                                                start_date, end_date, page)
+    return {"results": results, "has_more": has_more}
+
+
+@app.post("/conversations/{conversation_id}/messages")
+async def chat(conversation_id: int, body: ChatRequest, request: Request):
+    """Sends a user turn and returns the reply, as JSON or (with `stream`) as Server-Sent Events.
+
+    The event stream carries `data: {"delta": ...}` chunks, then an `error` event if the model fails and a
+    `done` event with the stored assistant message.
+    """
+    client, sync_client = _clients(request)
+    await _require_conversation(conversation_id)
+    history, _ = await asyncio.to_thread(load_chat_history_page, conversation_id)
+    history.append(await asyncio.to_thread(add_user_message, conversation_id, body.content, body.model))
+    try:
+        prompt_model = await asyncio.to_thread(context_model, body.model, history)
+    except ValueError as e:
+        raise HTTPException(502, str(e))
+    prompt = await asyncio.to_thread(build_history, history, prompt_model, sync_client, conversation_id)
+
+    if not body.stream:
+        timings = {}
+        try:
+            reply = await acomplete_chat(client, prompt, body.model, timings, body.use_cache)
+        except Exception as e:
+            raise HTTPException(502, f"Error retrieving response from API: {e}")
+        return await asyncio.to_thread(add_assistant_message, conversation_id, reply,
+                                       timings.get("model_id", body.model), timings)
+
+    async def events() -> AsyncIterator[str]:
+        timings = {}
+        parts = []
+        try:
+            async for delta in astream_chat_response(client, prompt, body.model, timings, body.use_cache):
+                parts.append(delta)
+                yield _sse({"delta": delta})
+        except Exception as e:
+            yield _sse({"error": str(e)}, "error")
+            if not parts:
+                return
+        # Interrupted streams keep what arrived, like the Streamlit UI
+        message = await asyncio.to_thread(add_assistant_message, conversation_id, "".join(parts),
+                                          timings.get("model_id", body.model), timings)
+        yield _sse(message, "done")
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/messages/{chat_message_id}/feedback")
+async def feedback(chat_message_id: int, body: FeedbackRequest):
+    try:
+        updated = await asyncio.to_thread(save_feedback, chat_message_id, body.is_positive, body.comment)
+    except IntegrityError:
+        raise HTTPException(404, f"Message {chat_message_id} not found.")
+    return {"updated": updated}
+
+
+@app.get("/feedback/summary")
+async def feedback_stats(model: Optional[str] = None, start_date: Optional[date] = None,
+                         end_date: Optional[date] = None) -> List[Dict]:
+    return await asyncio.to_thread(feedback_summary, model, start_date, end_date)
+
+
+@app.post("/transcriptions")
+async def transcriptions(request: Request, filename: str, model: str = DEFAULT_TRANSCRIPTION_MODEL,
+                         language: Optional[str] = None):
+    """Transcribes the raw audio sent as the request body; `filename` supplies the format."""
+    _, sync_client = _clients(request)
+    if os.path.splitext(filename)[1].lstrip(".").lower() not in AUDIO_TYPES:
+        raise HTTPException(415, f"Unsupported audio type; expected one of {', '.join(AUDIO_TYPES)}.")
+    path, content_hash = await asave_upload(request.stream(), filename, UPLOADS_DIR)
+    await asyncio.to_thread(cleanup_uploads, UPLOADS_DIR)
+    try:
+        text = await asyncio.to_thread(transcribe, sync_client, path, model, language, content_hash)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    except Exception as e:
+        raise HTTPException(502, f"Error transcribing audio: {e}")
+    return {"text": text}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("api:app", host=API_HOST, port=API_PORT, workers=API_WORKERS)
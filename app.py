@@ -1,120 +1,72 @@
 import json
 import os
+import time
 from datetime import datetime
-from enum import Enum
-from typing import List, Dict
+from typing import List, Dict, Optional
 
-import requests
 import streamlit as st
 from PIL import Image
-from cachetools import cached, TTLCache
 from groq import Groq
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey
-from sqlalchemy.orm import sessionmaker, declarative_base
 from streamlit_lottie import st_lottie
 
-# Constants for the Streamlit app and database
-CONFIG_FILE_NAME = "config.json"
-API_KEY_ENV_VAR = "GROQ_API_KEY"
-DB_NAME = "chat_history.db"
+import chat_core
+from audio_pipeline import cleanup_uploads, save_upload
+# Re-exported so the UI module keeps its historical import surface
+from chat_core import (
+    API_KEY_ENV_VAR, AUDIO_TYPES, CONFIG_FILE_NAME, DEFAULT_USER_NAME, ERROR_REPLY, HISTORY_PAGE_SIZE,
+    MODELS_INFO_PATH, UPLOADS_DIR, Role, add_assistant_message, add_user_message, build_history,
+    create_conversation, create_groq_client, default_conversation, initialize_db, list_conversations,
+    load_chat_history, load_chat_history_page, load_chat_history_since, parse_models_info, save_message
+)
+from context_window import get_prompt_budget
+from feedback_rollups import feedback_summary
+from history_archive import start_maintenance
+from metrics import start_exporter
+from metrics_store import METRICS_WINDOW_HOURS, latency_by_model
+from model_compare import compare_models
+from model_router import AUTO_MODEL, complete_chat, context_model, stream_chat_response
+from response_cache import RESPONSE_CACHE_ENABLED
+from static_assets import cached_by_mtime, load_lottie
 
 # UI Settings
 THEME_COLOR = "#00bfae"
 
-# Lottie's animation URLs or file paths
-LOTTIE_WELCOME_URL = "https://lottie.host/6cc5c636-161e-4fe2-a29e-d0a010fb857d/oUxnN8jMLv.json"
-LOTTIE_LOADING_URL = "https://lottie.host/6db67e84-29ca-4df7-9aed-e918be35c04f/GUHZd8ZAiP.json"
-LOTTIE_SUCCESS_URL = "https://lottie.host/0d17b47d-7e01-4b7d-a8fb-f94b6c69dd48/jycOqQmo4J.json"
-LOTTIE_ERROR_URL = "https://lottie.host/caa8d9f2-7b02-4462-867d-4a5a1aa1a175/3HRdfJrk9m.json"
-LOTTIE_NO_DATA_URL = "https://lottie.host/aa234c54-eca8-4b61-a21c-83b5b1e82698/1EEUxyZ91a.json"
-
-
-# Enum for chat roles
-class Role(Enum):
-    USER = "user"
-    ASSISTANT = "assistant"
-    SYSTEM = "system"
-
-
-# Database setup
-Base = declarative_base()
-
-
-class ChatMessage(Base):
-    __tablename__ = 'chat_history'
-    id = Column(Integer, primary_key=True)
-    role = Column(String)
-    content = Column(String)
-    timestamp = Column(DateTime)
-    model_id = Column(String)
-
-
-class Feedback(Base):
-    __tablename__ = 'feedback'
-    id = Column(Integer, primary_key=True)
-    chat_message_id = Column(Integer, ForeignKey('chat_history.id'))
-    is_positive = Column(Boolean)
-    comment = Column(String)
-
-
-def initialize_db():
-    engine = create_engine(f'sqlite:///{DB_NAME}')
-    Base.metadata.create_all(engine)
-
-
-@cached(cache=TTLCache(maxsize=100, ttl=300))
-def get_groq_models():
-    api_key = os.getenv(API_KEY_ENV_VAR)
-    url = "https://api.groq.com/openai/v1/models"
-    headers = {
-        "Authorization": f"Bearer {api_key}"
-    }
-    for _ in range(3):  # Retry mechanism
-        response = requests.get(url, headers=headers)
-        if response.ok:
-            try:
-                models = response.json()["data"]
-                return [{"name": model["id"], "id": model["id"], "info": model.get("description", "")} for model in
-                        models]
-            except (KeyError, TypeError) as e:
-                st.error(f"Error parsing models from the API response: {e}")
-                return []
-        else:
-            st.error(f"Failed to fetch models from the API: {response.text}")
-    return []
-
-
-def save_message(role: str, content: str, timestamp: str, model: Dict[str, str]):
-    engine = create_engine(f'sqlite:///{DB_NAME}')
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    new_message = ChatMessage(
-        role=role,
-        content=content,
-        timestamp=datetime.fromisoformat(timestamp),
-        model_id=model["id"]  # Extract the model ID from the dictionary
-    )
-    session.add(new_message)
-    session.commit()
-    session.close()
+# Stream completions token by token; set LLAMABOT_STREAMING=0 to use the blocking request instead
+STREAMING_ENABLED = os.getenv("LLAMABOT_STREAMING", "1") == "1"
+# Minimum seconds between chat bubble redraws while streaming
+STREAM_RENDER_INTERVAL = 0.05
+
+LOGO_PATH = "assets/logo-removebg-preview.png"
+
+if not os.path.exists(UPLOADS_DIR):
+    os.makedirs(UPLOADS_DIR)
+
+
+def get_groq_models() -> List[Dict[str, str]]:
+    models = chat_core.get_groq_models()
+    status = chat_core.model_catalog_status()
+    if status["last_error"]:
+        st.warning(f"Could not refresh the model list ({status['last_error']}); showing the last known models.")
+    return models
+
+
+def initialize_conversation():
+    if "user_id" not in st.session_state or "conversation_id" not in st.session_state:
+        # No authentication: users are told apart by the ?user= query parameter
+        st.session_state.user_id, conversation_id = default_conversation(
+            st.query_params.get("user", DEFAULT_USER_NAME))
+        st.session_state.setdefault("conversation_id", conversation_id)
 
 
-def load_chat_history() -> List[Dict[str, str]]:
-    engine = create_engine(f'sqlite:///{DB_NAME}')
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    chat_history = session.query(ChatMessage).order_by(ChatMessage.id).all()
-    session.close()
-    return [{"role": msg.role, "content": msg.content, "timestamp": msg.timestamp.isoformat(), "model_id": msg.model_id}
-            for msg in chat_history]
+def switch_conversation(conversation_id: int):
+    st.session_state.conversation_id = conversation_id
+    # Reloaded for the new conversation by initialize_chat_history
+    st.session_state.pop("chat_history", None)
 
 
 def load_configuration() -> Dict[str, str]:
     try:
-        working_dir = os.path.dirname(os.path.abspath(__file__))
-        config_path = os.path.join(working_dir, CONFIG_FILE_NAME)
-        with open(config_path) as config_file:
-            return json.load(config_file)
+        return chat_core.read_configuration()
     except FileNotFoundError:
         st.error(f"Configuration file '{CONFIG_FILE_NAME}' not found. Please ensure it exists.")
         return {}
@@ -123,21 +75,29 @@ def load_configuration() -> Dict[str, str]:
         return {}
 
 
-def create_groq_client(api_key: str) -> Groq:
-    os.environ[API_KEY_ENV_VAR] = api_key
-    return Groq()
+@cached_by_mtime
+def load_image(path: str) -> Image.Image:
+    image = Image.open(path)
+    image.load()  # decode now so cached reruns never touch the file
+    return image
 
 
-def fetch_chat_response(client: Groq, history: List[Dict[str, str]], model: str) -> str:
+def show_animation(name: str, height: int, width: int, key: str):
+    """Renders a bundled Lottie animation; does nothing when animations are disabled."""
+    animation = load_lottie(name)
+    if animation is not None:
+        st_lottie(animation, height=height, width=width, key=key)
+
+
+def fetch_chat_response(client: Groq, history: List[Dict[str, str]], model: str,
+                        timings: Optional[Dict[str, float]] = None, use_cache: bool = True,
+                        params: Optional[Dict] = None) -> str:
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=history
-        )
-        return response.choices[0].message.content
+        # The auto model is routed to a concrete one, which is recorded in timings["model_id"]
+        return complete_chat(client, history, model, timings, use_cache, params)
     except Exception as e:
         st.error(f"Error retrieving response from API: {e}")
-        return "😅 Sorry, there was an error processing your request."
+        return ERROR_REPLY
 
 
 def format_timestamp(timestamp_iso: str) -> str:
@@ -147,44 +107,92 @@ def format_timestamp(timestamp_iso: str) -> str:
 
 def initialize_chat_history():
     if "chat_history" not in st.session_state:
-        st.session_state.chat_history = load_chat_history()
+        st.session_state.chat_history, st.session_state.has_older_history = load_chat_history_page(
+            st.session_state.conversation_id)
+        st.session_state.synced_through_id = max((msg["id"] for msg in st.session_state.chat_history), default=0)
+        st.session_state.render_limit = HISTORY_PAGE_SIZE
+    else:
+        sync_chat_history()
 
 
-def display_chat_history():
-    for i, chat_message in enumerate(st.session_state.chat_history):
+def sync_chat_history():
+    """Appends rows written since the last sync (e.g. by other sessions) without reloading the table."""
+    new_rows = load_chat_history_since(st.session_state.synced_through_id, st.session_state.conversation_id)
+    if not new_rows:
+        return
+    held_ids = {msg.get("id") for msg in st.session_state.chat_history[-HISTORY_PAGE_SIZE:]}
+    # Messages appended by this session before their row id was known
+    pending = {(msg["role"], msg["timestamp"]): msg for msg in st.session_state.chat_history if msg.get("id") is None}
+    for row in new_rows:
+        local = pending.pop((row["role"], row["timestamp"]), None)
+        if local is not None:
+            local["id"] = row["id"]
+        elif row["id"] not in held_ids:
+            st.session_state.chat_history.append(row)
+    st.session_state.synced_through_id = new_rows[-1]["id"]
+
+
+def load_older_chat_history():
+    hidden = len(st.session_state.chat_history) - st.session_state.render_limit
+    if hidden < HISTORY_PAGE_SIZE and st.session_state.has_older_history:
+        oldest_id = next((msg["id"] for msg in st.session_state.chat_history if msg.get("id") is not None), None)
+        older, st.session_state.has_older_history = load_chat_history_page(st.session_state.conversation_id,
+                                                                           before_id=oldest_id)
+        st.session_state.chat_history[:0] = older
+    st.session_state.render_limit += HISTORY_PAGE_SIZE
+
+
+def display_chat_history(chat_history: Optional[List[Dict]] = None):
+    if chat_history is None:
+        # Only the most recent window is rendered on each rerun
+        chat_history = st.session_state.chat_history[-st.session_state.render_limit:]
+    for i, chat_message in enumerate(chat_history):
         formatted_timestamp = format_timestamp(chat_message["timestamp"])
         with st.chat_message(chat_message["role"]):
-            st.markdown(f"{chat_message['content']}<br><small>{formatted_timestamp} ⏰</small>", unsafe_allow_html=True)
-        if i < len(st.session_state.chat_history) - 1:
+            st.markdown(f"{chat_message['content']}<br><small>{formatted_timestamp} ⏰{format_timings(chat_message)}"
+                        f"</small>", unsafe_allow_html=True)
+        if i < len(chat_history) - 1:
             st.markdown("---")  # Add separator
 
 
-def handle_user_input(groq_client_instance: Groq, selected_model: Dict[str, str]):
+def handle_user_input(groq_client_instance: Groq, selected_model: Dict[str, str], use_cache: bool = True,
+                      compare_with: Optional[List[Dict[str, str]]] = None):
     user_message = st.chat_input("Ask LLAMA... 🦙")
     if user_message:
         st.chat_message(Role.USER.value).markdown(f"👤 {user_message}")
-        timestamp = datetime.now().isoformat()
         if selected_model:
-            save_message(Role.USER.value, user_message, timestamp, selected_model)
-            st.session_state.chat_history.append({
-                "role": Role.USER.value,
-                "content": user_message,
-                "timestamp": timestamp,
-                "model_id": selected_model["id"]  # Add model_id to the chat history
-            })
+            st.session_state.chat_history.append(
+                add_user_message(st.session_state.conversation_id, user_message, selected_model["id"]))
 
             # Create a placeholder for the animation
             lottie_thinking_placeholder = st.empty()
+            compare_ids = [model["id"] for model in compare_with or []]
+            # A shared history must fit every compared model, so it is built for the tightest budget
+            context_model_id = min(compare_ids, key=get_prompt_budget) if compare_ids else \
+                context_model(selected_model["id"], st.session_state.chat_history)
+            history_for_api = prepare_history_for_api(groq_client_instance, context_model_id)
+            timings = {}
+
+            if compare_ids:
+                with lottie_thinking_placeholder.container():
+                    show_animation("loading", height=200, width=200, key="thinking")
+                display_model_comparison(history_for_api, compare_ids, lottie_thinking_placeholder)
+            elif STREAMING_ENABLED:
+                with lottie_thinking_placeholder.container():
+                    show_animation("loading", height=200, width=200, key="thinking")
+                assistant_reply = display_streaming_reply(groq_client_instance, history_for_api, selected_model["id"],
+                                                          timings, lottie_thinking_placeholder, use_cache)
+                add_assistant_reply(assistant_reply, selected_model, timings)
+            else:
+                # Display the thinking animation
+                with lottie_thinking_placeholder.container():
+                    show_animation("loading", height=200, width=200, key="thinking")
 
-            # Display the thinking animation
-            with lottie_thinking_placeholder.container():
-                st_lottie(LOTTIE_LOADING_URL, height=200, width=200, key="thinking")
-
-                history_for_api = prepare_history_for_api()
-                assistant_reply = fetch_chat_response(groq_client_instance, history_for_api, selected_model["id"])
+                    assistant_reply = fetch_chat_response(groq_client_instance, history_for_api,
+                                                          selected_model["id"], timings, use_cache)
 
-                add_assistant_reply(assistant_reply, selected_model)
-                display_assistant_reply(assistant_reply)
+                    add_assistant_reply(assistant_reply, selected_model, timings)
+                    display_assistant_reply(assistant_reply)
 
             # Clear the animation placeholder after the response
             lottie_thinking_placeholder.empty()
@@ -196,112 +204,136 @@ def handle_user_input(groq_client_instance: Groq, selected_model: Dict[str, str]
             st.error("No model selected. Please select a model from the sidebar.")
 
 
-def prepare_history_for_api() -> List[Dict[str, str]]:
-    return [
-        {"role": Role.SYSTEM.value, "content": "You are my helpful assistant 🦙"},
-        *[{"role": msg["role"], "content": msg["content"]} for msg in st.session_state.chat_history]
-    ]
+def prepare_history_for_api(client: Optional[Groq] = None, model_id: Optional[str] = None) -> List[Dict[str, str]]:
+    return build_history(st.session_state.chat_history, model_id, client, st.session_state.conversation_id)
+
+
+def add_assistant_reply(reply: str, model: Dict[str, str], timings: Optional[Dict[str, float]] = None):
+    # Replies of the auto model are stored under the model that served them
+    model_id = (timings or {}).get("model_id", model["id"])
+    st.session_state.chat_history.append(
+        add_assistant_message(st.session_state.conversation_id, reply, model_id, timings))
+
 
+def display_streaming_reply(client: Groq, history: List[Dict[str, str]], model: str,
+                            timings: Dict[str, float], thinking_placeholder, use_cache: bool = True) -> str:
+    """Renders the reply into a chat bubble as it streams and returns the assembled text.
 
-def add_assistant_reply(reply: str, model: Dict[str, str]):
-    timestamp = datetime.now().isoformat()
-    save_message(Role.ASSISTANT.value, reply, timestamp, model)
-    st.session_state.chat_history.append({
-        "role": Role.ASSISTANT.value,
-        "content": reply,
-        "timestamp": timestamp,
-        "model_id": model["id"],
-        "id": len(st.session_state.chat_history)  # Ensure each message has a unique id
-    })
+    Falls back to the blocking request when the stream fails before the first token.
+    """
+    st.markdown("---")  # Add separator
+    with st.chat_message(Role.ASSISTANT.value):
+        reply_placeholder = st.empty()
+        parts = []
+        last_render = 0.0
+        try:
+            for delta in stream_chat_response(client, history, model, timings, use_cache):
+                if not parts:
+                    thinking_placeholder.empty()
+                parts.append(delta)
+                now = time.perf_counter()
+                if now - last_render >= STREAM_RENDER_INTERVAL:
+                    reply_placeholder.markdown(f"🤖 {''.join(parts)}▌")
+                    last_render = now
+        except Exception as e:
+            if not parts:
+                timings.clear()
+                reply = fetch_chat_response(client, history, model, timings, use_cache)
+                reply_placeholder.markdown(f"🤖 {reply}")
+                return reply
+            st.error(f"The response stream was interrupted: {e}")
+        reply = "".join(parts)
+        reply_placeholder.markdown(f"🤖 {reply}")
+    return reply
+
+
+def display_model_comparison(history: List[Dict[str, str]], model_ids: List[str], thinking_placeholder):
+    """Queries every model concurrently and fills each model's bubble as soon as its reply arrives."""
+    st.markdown("---")  # Add separator
+    placeholders = {}
+    for model_id in model_ids:
+        with st.chat_message(Role.ASSISTANT.value):
+            placeholders[model_id] = st.empty()
+            placeholders[model_id].markdown(f"⏳ **{model_id}** is thinking...")
+
+    def on_result(result: Dict):
+        thinking_placeholder.empty()
+        model_id = result["model_id"]
+        if result["error"]:
+            placeholders[model_id].error(f"**{model_id}** failed: {result['error']}")
+            return
+        timings = {"ttft": result["total_time"], "total_time": result["total_time"]}
+        add_assistant_reply(result["content"], {"id": model_id}, timings)
+        placeholders[model_id].markdown(f"🤖 **{model_id}** · {result['total_time']:.2f}s\n\n{result['content']}")
+
+    compare_models(history, model_ids, on_result)
+
+
+def format_timings(chat_message: Dict) -> str:
+    if "total_time" not in chat_message:
+        return ""
+    cached = " · cached" if chat_message.get("cache_hit") else ""
+    return f" · first token {chat_message.get('ttft', chat_message['total_time']):.2f}s · " \
+           f"total {chat_message['total_time']:.2f}s{cached}"
 
 
 def display_assistant_reply(reply: str):
     st.markdown("---")  # Add separator
     with st.chat_message(Role.ASSISTANT.value):
-        st_lottie(LOTTIE_SUCCESS_URL, height=150, width=150, key="reply_success")
+        show_animation("success", height=150, width=150, key="reply_success")
         st.markdown(f"🤖 {reply}")
 
 
+def display_metrics_dashboard():
+    """Per-model latency percentiles, error and cache-hit rates over the recent metrics window."""
+    rows = latency_by_model()
+    if not rows:
+        st.caption("No chat turns recorded yet.")
+        return
+    st.caption(f"Last {METRICS_WINDOW_HOURS:g} hours · latency in seconds, excluding errors and cache hits")
+    st.dataframe([
+        {"Model": row["model"], "Turns": row["turns"], "p50": round(row["p50"], 2), "p95": round(row["p95"], 2),
+         "p99": round(row["p99"], 2), "TTFT p50": round(row["ttft_p50"], 2),
+         "Errors": f"{row['error_rate']:.0%}", "Cache hits": f"{row['cache_hit_rate']:.0%}",
+         "Tokens": row["prompt_tokens"] + row["completion_tokens"]}
+        for row in rows
+    ], hide_index=True)
+    feedback = feedback_summary()
+    if feedback:
+        st.caption("Feedback")
+        st.dataframe([
+            {"Model": row["model"], "👍": row["positive"], "👎": row["negative"],
+             "Approval": f"{row['approval']:.0%}" if row["approval"] is not None else "–"}
+            for row in feedback
+        ], hide_index=True)
+
+
 def save_feedback(chat_message_id, is_positive, comment):
-    engine = create_engine(f'sqlite:///{DB_NAME}')
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    # Check if feedback already exists for the given chat_message_id
-    existing_feedback = session.query(Feedback).filter_by(chat_message_id=chat_message_id).first()
-
-    if existing_feedback:
-        # Update the existing feedback
-        existing_feedback.is_positive = is_positive
-        existing_feedback.comment = comment
-        session.commit()
-        st.success("Feedback updated!")
-    else:
-        # Insert new feedback
-        new_feedback = Feedback(chat_message_id=chat_message_id, is_positive=is_positive, comment=comment)
-        session.add(new_feedback)
-        session.commit()
-        st.success("Feedback saved!")
-
-    session.close()
-
-
-def clear_chat_history():
-    engine = create_engine(f'sqlite:///{DB_NAME}')
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    session.query(ChatMessage).delete()
-    session.commit()
-    session.close()
+    updated = chat_core.save_feedback(chat_message_id, is_positive, comment)
+    st.success("Feedback updated!" if updated else "Feedback saved!")
+
+
+def clear_chat_history(conversation_id: Optional[int] = None):
+    """Deletes the messages, feedback and summary of one conversation (the current one by default)."""
+    if conversation_id is None:
+        conversation_id = st.session_state.get("conversation_id")
+    chat_core.clear_conversation(conversation_id)
     st.session_state.chat_history = []
+    st.session_state.has_older_history = False
+    st.session_state.synced_through_id = 0
+    st.session_state.render_limit = HISTORY_PAGE_SIZE
 
 
-def search_chat_history(query: str):
-    filtered_history = []
-    for chat_message in st.session_state.chat_history:
-        if query.lower() in chat_message["content"].lower():
-            filtered_history.append(chat_message)
-    return filtered_history
-
-
-# Function to parse models_info.md and return a dictionary of model descriptions
-def parse_models_info(file_path: str) -> Dict[str, str]:
-    models_info = {}
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-        current_model_id = None
-        current_model_description = []
-        for line in lines:
-            if line.startswith("**"):
-                if current_model_id:
-                    models_info[current_model_id] = "\n".join(current_model_description)
-                current_model_id = line.split("**")[1].strip()
-                current_model_description = []
-            elif line.startswith("- Model ID:"):
-                current_model_id = line.split(":")[1].strip()
-            elif line.startswith("- "):
-                current_model_description.append(line.strip())
-        if current_model_id:
-            models_info[current_model_id] = "\n".join(current_model_description)
-    return models_info
-
-
-# Directory to store uploaded audio files
-UPLOADS_DIR = "uploads"
-if not os.path.exists(UPLOADS_DIR):
-    os.makedirs(UPLOADS_DIR)
+def search_chat_history(query: str, role: Optional[str] = None, model_id: Optional[str] = None,
+                        start_date=None, end_date=None, page: int = 0):
+    return chat_core.search_conversation(query, st.session_state.get("conversation_id"), role, model_id,
+                                         start_date, end_date, page)
 
 
-def transcribe_audio(client: Groq, audio_file_path, model="whisper-large-v3", language=None):
-    """Transcribes audio using Groq's Whisper API."""
+def transcribe_audio(client: Groq, audio_file_path, model="whisper-large-v3", language=None, content_hash=None):
+    """Transcribes audio using Groq's Whisper API, splitting long recordings into concurrent segments."""
     try:
-        with open(audio_file_path, "rb") as file:
-            transcription = client.audio.transcriptions.create(
-                file=(audio_file_path, file.read()),
-                model=model,
-                language=language
-            )
-        return transcription.text
+        return chat_core.transcribe(client, audio_file_path, model, language, content_hash)
     except Exception as e:
         st.error(f"Error transcribing audio: {e}")
         return None
@@ -320,36 +352,52 @@ def main():
     api_key_value = config.get(API_KEY_ENV_VAR)
 
     if not api_key_value:
-        st_lottie(LOTTIE_ERROR_URL, height=150, width=150, key="api_error")
+        show_animation("error", height=150, width=150, key="api_error")
         st.error("API key is missing in the configuration.")
         return
 
     groq_client_instance = create_groq_client(api_key_value)
 
     initialize_db()  # Initialize the database
+    start_exporter()  # Serves /metrics when LLAMABOT_METRICS_PORT is set
+    start_maintenance()  # Retention, VACUUM and ANALYZE in the background
+    initialize_conversation()
     initialize_chat_history()
 
     # Main Title
-    logo_image = Image.open("assets/logo-removebg-preview.png")
-    st.image(logo_image)
-
-    # Load model descriptions
-    models_info = parse_models_info("assets/models_info.md")
+    st.image(load_image(LOGO_PATH))
 
     # Sidebar with settings and chat history
     with st.sidebar:
         st.header("LLAMABOT Settings ⚙️")
-        st_lottie(LOTTIE_WELCOME_URL, height=100, width=100, key="welcome")
+        show_animation("welcome", height=100, width=100, key="welcome")
         groq_models = get_groq_models()
-        selected_model = st.selectbox("Select a Model", groq_models, format_func=lambda model: model["name"])
-        # Display model description from models_info.md
+        # Auto routes each message to one of the listed models, so it is only offered when there are some
+        selected_model = st.selectbox("Select a Model", groq_models + [AUTO_MODEL] if groq_models else [],
+                                      format_func=lambda model: model["name"])
+        # The catalog carries the description from models_info.md
         if selected_model:
-            model_id = selected_model['id']
-            model_description = models_info.get(model_id, "No description available.")
+            model_description = selected_model.get("description") or "No description available."
             st.markdown(f"**Model Description:** {model_description}")
         else:
             st.warning("No model selected. Please select a model to start chatting.")
             st.markdown("---")
+        compare_with = st.multiselect("Compare models", groq_models, format_func=lambda model: model["name"],
+                                      help="Send each prompt to all of these models at once and compare replies")
+
+        # Conversations
+        conversations = list_conversations(st.session_state.user_id)
+        conversation_ids = [conversation["id"] for conversation in conversations]
+        conversation_titles = {conversation["id"]: conversation["title"] for conversation in conversations}
+        selected_conversation = st.selectbox(
+            "Conversation", conversation_ids,
+            index=conversation_ids.index(st.session_state.conversation_id)
+            if st.session_state.conversation_id in conversation_ids else 0,
+            format_func=lambda conversation_id: conversation_titles[conversation_id]
+        )
+        if selected_conversation is not None and selected_conversation != st.session_state.conversation_id:
+            switch_conversation(selected_conversation)
+            st.rerun()
 
         # Chat History
         st.subheader("Chat History 📜")
@@ -357,71 +405,113 @@ def main():
             if st.session_state.chat_history:
                 query = st.text_input("Search Chat History", placeholder="Enter your search term")
                 if query:
-                    filtered_history = search_chat_history(query)
+                    role_filter = st.selectbox("Role", ["", Role.USER.value, Role.ASSISTANT.value],
+                                               format_func=lambda role: role or "Any role")
+                    model_filter = st.selectbox("Model", [""] + [model["id"] for model in groq_models],
+                                                format_func=lambda model_id: model_id or "Any model")
+                    date_range = st.date_input("Date range", value=[])
+                    search_page = st.number_input("Results page", min_value=1, value=1, step=1) - 1
+                    filtered_history, has_more = search_chat_history(
+                        query, role=role_filter or None, model_id=model_filter or None,
+                        start_date=date_range[0] if len(date_range) > 0 else None,
+                        end_date=date_range[1] if len(date_range) > 1 else None,
+                        page=search_page
+                    )
+                    if not filtered_history:
+                        st.info("No matching messages.")
                     for chat_message in filtered_history:
                         formatted_timestamp = format_timestamp(chat_message["timestamp"])
                         with st.chat_message(chat_message["role"]):
-                            st.markdown(f"{chat_message['content']}<br><small>{formatted_timestamp} ⏰</small>",
+                            st.markdown(f"{chat_message['snippet']}<br><small>{formatted_timestamp} ⏰</small>",
                                         unsafe_allow_html=True)
                         st.markdown("---")
+                    if has_more:
+                        st.caption("More results available on the next page.")
                 else:
-                    display_chat_history()
+                    # The conversation itself is rendered once, in the main area
+                    st.caption(f"{len(st.session_state.chat_history)} messages loaded. "
+                               f"Enter a search term to filter them.")
             else:
-                st_lottie(LOTTIE_NO_DATA_URL, height=150, width=150, key="no_data")
+                show_animation("no_data", height=150, width=150, key="no_data")
                 st.info("No chat history available.")
 
+        bypass_cache = False
+        if RESPONSE_CACHE_ENABLED:
+            bypass_cache = st.checkbox("Bypass response cache", help="Always ask the model for a fresh reply")
+
         # Add a button to start a new chat
-        if st.button("🆕", help="Start a new chat session"):
-            clear_chat_history()
-            st.rerun()
+        new_chat_column, clear_chat_column = st.columns(2)
+        with new_chat_column:
+            if st.button("🆕", help="Start a new chat session"):
+                switch_conversation(create_conversation(st.session_state.user_id))
+                st.rerun()
+        with clear_chat_column:
+            if st.button("🗑️", help="Clear the messages of this conversation"):
+                clear_chat_history()
+                st.rerun()
+
+        with st.expander("Metrics 📊", expanded=False):
+            display_metrics_dashboard()
 
         # Speech-to-Text Section
         st.markdown("---")
         st.header("Speech-to-Text 🎙️")
         uploaded_audio = st.file_uploader("Upload an audio file",
-                                          type=["mp3", "mp4", "mpeg", "mpga", "m4a", "wav", "webm"])
+                                          type=AUDIO_TYPES)
         selected_language = st.selectbox("Select audio language (optional)", ["", "en", "fr", "es", "de"],
                                          help="Leave blank for auto-detect")
 
     # Display the chat history
     if st.session_state.chat_history:
+        hidden_messages = len(st.session_state.chat_history) - st.session_state.render_limit
+        if hidden_messages > 0 or st.session_state.has_older_history:
+            if st.button("⬆️ Load older messages", key="load_older"):
+                load_older_chat_history()
+                st.rerun()
         display_chat_history()
     else:
-        st_lottie(LOTTIE_NO_DATA_URL, height=200, width=200, key="no_chat_history")
+        show_animation("no_data", height=200, width=200, key="no_chat_history")
         st.info("No chat history to display.")
 
     # Main Chat Area
-    handle_user_input(groq_client_instance, selected_model)
+    handle_user_input(groq_client_instance, selected_model, use_cache=not bypass_cache, compare_with=compare_with)
 
     # Display feedback buttons (outside the if block)
     if st.session_state.chat_history:
-        chat_message_id = st.session_state.chat_history[-1].get("id")
+        # Feedback is keyed to the stored row, which may still be on the write-behind queue
+        chat_message_id = chat_core.resolve_message_id(st.session_state.conversation_id,
+                                                       st.session_state.chat_history[-1])
+        st.session_state.chat_history[-1]["id"] = chat_message_id
 
         # Use Unicode characters for thumbs up/down instead of emojis
         col1, col2 = st.columns(2)
         with col1:
             if st.button("👍", key=f"positive_feedback_{chat_message_id}"):
-                st_lottie(LOTTIE_SUCCESS_URL, height=100, width=100, key="positive_feedback")
+                show_animation("success", height=100, width=100, key="positive_feedback")
                 comment = st.text_input(f"Feedback for message {chat_message_id}")
                 save_feedback(chat_message_id, True, comment)
         with col2:
             if st.button("👎", key=f"negative_feedback_{chat_message_id}"):
-                st_lottie(LOTTIE_ERROR_URL, height=100, width=100, key="negative_feedback")
+                show_animation("error", height=100, width=100, key="negative_feedback")
                 comment = st.text_input(f"Feedback for message {chat_message_id}")
                 save_feedback(chat_message_id, False, comment)
 
     if uploaded_audio is not None:
-        # Save the uploaded file to the uploads directory
-        audio_file_path = os.path.join(UPLOADS_DIR, uploaded_audio.name)
-        with open(audio_file_path, "wb") as f:
-            f.write(uploaded_audio.read())
+        # Stream the upload to disk once per file rather than on every rerun
+        saved_upload = st.session_state.get("saved_upload")
+        if not saved_upload or saved_upload[0] != uploaded_audio.file_id or not os.path.exists(saved_upload[1]):
+            audio_file_path, content_hash = save_upload(uploaded_audio, uploaded_audio.name, UPLOADS_DIR)
+            st.session_state.saved_upload = (uploaded_audio.file_id, audio_file_path, content_hash)
+            cleanup_uploads(UPLOADS_DIR)
+        _, audio_file_path, content_hash = st.session_state.saved_upload
 
         # Display the uploaded audio
-        st.audio(uploaded_audio, format='audio/wav')
+        st.audio(audio_file_path, format='audio/wav')
 
         if st.button("Transcribe"):
             with st.spinner("Transcribing..."):
-                transcript = transcribe_audio(groq_client_instance, audio_file_path, language=selected_language)
+                transcript = transcribe_audio(groq_client_instance, audio_file_path, language=selected_language,
+                                              content_hash=content_hash)
             if transcript:
                 st.success("Transcription successful!")
                 st.text_area("Transcription:", value=transcript)
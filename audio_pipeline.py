@@ -0,0 +1,257 @@
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, List, Optional, Tuple
+
+from sqlalchemy import Column, String, DateTime
+
+from database import Base, session_scope
+from request_scheduler import get_scheduler
+from single_flight import credential_fingerprint, get_single_flight, request_key
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Stay below the transcription API's upload cap
+MAX_SEGMENT_BYTES = int(os.getenv("LLAMABOT_TRANSCRIBE_MAX_SEGMENT_BYTES", str(20 * 1024 * 1024)))
+SEGMENT_SECONDS = float(os.getenv("LLAMABOT_TRANSCRIBE_SEGMENT_SECONDS", "600"))
+SEGMENT_OVERLAP_SECONDS = 2.0
+TRANSCRIBE_CONCURRENCY = int(os.getenv("LLAMABOT_TRANSCRIBE_CONCURRENCY", "3"))
+UPLOAD_RETENTION_SECONDS = float(os.getenv("LLAMABOT_UPLOAD_RETENTION_SECONDS", str(24 * 3600)))
+MAX_OVERLAP_WORDS = 40
+# Followers of an identical in-flight transcription wait this long; long recordings take minutes
+TRANSCRIBE_SINGLE_FLIGHT_TIMEOUT = 900.0
+
+
+class Transcript(Base):
+    __tablename__ = 'transcripts'
+    key = Column(String, primary_key=True)  # content hash, model and language
+    text = Column(String)
+    created_at = Column(DateTime)
+
+
+def save_upload(uploaded_file: BinaryIO, name: str, directory: str) -> Tuple[str, str]:
+    """Streams an upload to `directory` in chunks and returns (path, sha256).
+
+    Files are stored under their content hash, so uploading the same audio twice keeps one copy.
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False, suffix=".part") as temp_file:
+        for chunk in iter(lambda: uploaded_file.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+            temp_file.write(chunk)
+    return _store_upload(temp_file.name, digest.hexdigest(), name, directory)
+
+
+async def asave_upload(chunks: AsyncIterator[bytes], name: str, directory: str) -> Tuple[str, str]:
+    """Like save_upload, for a request body that arrives as an async stream of chunks."""
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False, suffix=".part") as temp_file:
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                temp_file.write(chunk)
+        except BaseException:
+            os.remove(temp_file.name)
+            raise
+    return _store_upload(temp_file.name, digest.hexdigest(), name, directory)
+
+
+def _store_upload(temp_path: str, content_hash: str, name: str, directory: str) -> Tuple[str, str]:
+    path = os.path.join(directory, content_hash[:32] + os.path.splitext(name)[1].lower())
+    if os.path.exists(path):
+        os.remove(temp_path)
+        os.utime(path)  # keeps the file out of the next cleanup
+    else:
+        os.replace(temp_path, path)
+    return path, content_hash
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cleanup_uploads(directory: str, max_age_seconds: float = UPLOAD_RETENTION_SECONDS) -> int:
+    """Deletes uploads (and abandoned partial uploads) older than `max_age_seconds`."""
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _wav_segments(path: str, out_dir: str) -> List[str]:
+    with wave.open(path, "rb") as source:
+        params = source.getparams()
+        frame_rate = source.getframerate()
+        bytes_per_second = frame_rate * source.getsampwidth() * source.getnchannels()
+        total_frames = source.getnframes()
+        segment_seconds = min(SEGMENT_SECONDS, MAX_SEGMENT_BYTES / bytes_per_second - SEGMENT_OVERLAP_SECONDS)
+        segment_frames = int(segment_seconds * frame_rate)
+        overlap_frames = int(SEGMENT_OVERLAP_SECONDS * frame_rate)
+        segments = []
+        for index, start in enumerate(range(0, total_frames, segment_frames)):
+            source.setpos(max(0, start - overlap_frames) if index else 0)
+            remaining = min(total_frames, start + segment_frames) - source.tell()
+            segment_path = os.path.join(out_dir, f"segment_{index:04d}.wav")
+            with wave.open(segment_path, "wb") as target:
+                target.setparams(params)
+                while remaining > 0:
+                    frames = source.readframes(min(remaining, frame_rate))  # one second at a time
+                    if not frames:
+                        break
+                    target.writeframes(frames)
+                    remaining -= len(frames) // (params.sampwidth * params.nchannels)
+            segments.append(segment_path)
+        return segments
+
+
+def _ffmpeg_segments(path: str, out_dir: str) -> List[str]:
+    duration = float(subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+        check=True, capture_output=True, text=True
+    ).stdout.strip())
+    bytes_per_second = os.path.getsize(path) / max(duration, 1e-6)
+    segment_seconds = min(SEGMENT_SECONDS, MAX_SEGMENT_BYTES / bytes_per_second - SEGMENT_OVERLAP_SECONDS)
+    extension = os.path.splitext(path)[1]
+    segments = []
+    start = 0.0
+    while start < duration:
+        segment_start = max(0.0, start - SEGMENT_OVERLAP_SECONDS)
+        segment_path = os.path.join(out_dir, f"segment_{len(segments):04d}{extension}")
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-ss", f"{segment_start:.3f}", "-t",
+             f"{start + segment_seconds - segment_start:.3f}", "-i", path, "-c", "copy", segment_path],
+            check=True
+        )
+        segments.append(segment_path)
+        start += segment_seconds
+    return segments
+
+
+def _needs_split(path: str) -> bool:
+    if os.path.getsize(path) > MAX_SEGMENT_BYTES:
+        return True
+    if path.lower().endswith(".wav"):
+        try:
+            with wave.open(path, "rb") as source:
+                return source.getnframes() / source.getframerate() > SEGMENT_SECONDS
+        except wave.Error:
+            return False
+    return False
+
+
+def split_audio(path: str, out_dir: str) -> List[str]:
+    """Splits long audio into overlapping segments; returns [path] when no split is needed.
+
+    WAV files are split with the standard library; other formats need ffmpeg on the PATH.
+    """
+    if not _needs_split(path):
+        return [path]
+    if path.lower().endswith(".wav"):
+        return _wav_segments(path, out_dir)
+    if shutil.which("ffmpeg") and shutil.which("ffprobe"):
+        return _ffmpeg_segments(path, out_dir)
+    raise ValueError("This recording is too large to send in one request. Upload it as WAV, or install ffmpeg "
+                     "so it can be split into segments.")
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"\W+", "", word.lower())
+
+
+def stitch_transcripts(texts: List[str], max_overlap_words: int = MAX_OVERLAP_WORDS) -> str:
+    """Joins segment transcripts in order, dropping words repeated because of the segment overlap."""
+    words: List[str] = []
+    for text in texts:
+        segment_words = text.split()
+        overlap = 0
+        for size in range(min(max_overlap_words, len(words), len(segment_words)), 0, -1):
+            if [_normalize_word(w) for w in words[-size:]] == [_normalize_word(w) for w in segment_words[:size]]:
+                overlap = size
+                break
+        words.extend(segment_words[overlap:])
+    return " ".join(words)
+
+
+def _transcribe_segment(client, path: str, model: str, language: Optional[str]) -> str:
+    def request():
+        # Reopened on every attempt so retries resend the file from the start
+        with open(path, "rb") as file:
+            return client.audio.transcriptions.create(
+                file=(os.path.basename(path), file),
+                model=model,
+                language=language
+            )
+
+    return get_scheduler().call(request, model, operation="transcription").text
+
+
+def _cache_key(content_hash: str, model: str, language: Optional[str]) -> str:
+    return f"{content_hash}:{model}:{language or 'auto'}"
+
+
+def load_cached_transcript(content_hash: str, model: str, language: Optional[str]) -> Optional[str]:
+    with session_scope() as session:
+        transcript = session.get(Transcript, _cache_key(content_hash, model, language))
+        return transcript.text if transcript else None
+
+
+def store_transcript(content_hash: str, model: str, language: Optional[str], text: str):
+    with session_scope() as session:
+        session.merge(Transcript(key=_cache_key(content_hash, model, language), text=text,
+                                 created_at=datetime.now()))
+
+
+def transcribe_file(client, path: str, model: str, language: Optional[str] = None,
+                    content_hash: Optional[str] = None, max_workers: int = TRANSCRIBE_CONCURRENCY) -> str:
+    """Transcribes `path`, reusing the stored transcript when the same content was transcribed before.
+
+    Long recordings are split into overlapping segments that are transcribed concurrently and stitched in order.
+    """
+    content_hash = content_hash or hash_file(path)
+    cached = load_cached_transcript(content_hash, model, language)
+    if cached is not None:
+        return cached
+    # The same recording submitted twice at once (e.g. a rerun) is transcribed once
+    key = request_key("transcription", content=content_hash, model=model, language=language,
+                      credentials=credential_fingerprint(getattr(client, "api_key", None)))
+    text, _ = get_single_flight().do(
+        key, lambda: _transcribe_uncached(client, path, model, language, content_hash, max_workers),
+        operation="transcription", timeout=TRANSCRIBE_SINGLE_FLIGHT_TIMEOUT
+    )
+    return text
+
+
+def _transcribe_uncached(client, path: str, model: str, language: Optional[str], content_hash: str,
+                         max_workers: int) -> str:
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as segment_dir:
+        segments = split_audio(path, segment_dir)
+        if len(segments) == 1:
+            texts = [_transcribe_segment(client, segments[0], model, language)]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                texts = list(executor.map(lambda segment: _transcribe_segment(client, segment, model, language),
+                                          segments))
+    text = stitch_transcripts(texts)
+    store_transcript(content_hash, model, language, text)
+    return text
@@ -0,0 +1,151 @@
+"""Runs a JSONL file of chat requests through the same model path as the app.
+
+    python batch_runner.py prompts.jsonl results.jsonl --model llama3-8b-8192 --concurrency 4
+
+Each input line is an object with either `messages` (sent as-is) or `prompt` (wrapped with the system prompt),
+and optionally `id`, `model` and `params` (extra completion arguments such as temperature). Results are appended
+to the output file as they finish, one object per line. The output file doubles as the checkpoint: rerunning
+the same command skips requests that already succeeded and retries the ones that failed.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from chat_core import SYSTEM_PROMPT, complete_chat, create_groq_client, initialize_db, resolve_api_key
+from metrics import percentile
+
+BATCH_CONCURRENCY = int(os.getenv("LLAMABOT_BATCH_CONCURRENCY", "4"))
+
+
+def read_requests(path: str) -> Iterator[Tuple[str, Dict]]:
+    """Yields (request_id, request) lazily; requests without an `id` are keyed by line number."""
+    with open(path) as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            yield str(request.get("id", f"line-{line_number}")), request
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Returns the ids that already succeeded, dropping a partial last line left by a killed run."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as output_file:
+        data = output_file.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            output_file.truncate(len(complete))
+    done = set()
+    for line in complete.decode().splitlines():
+        if line.strip():
+            result = json.loads(line)
+            if result.get("error") is None:
+                done.add(result["id"])
+            else:
+                done.discard(result["id"])
+    return done
+
+
+def _history(request: Dict) -> List[Dict[str, str]]:
+    if "messages" in request:
+        return request["messages"]
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": request["prompt"]}]
+
+
+def run_request(client, request_id: str, request: Dict, default_model: Optional[str], use_cache: bool) -> Dict:
+    model = request.get("model", default_model)
+    result = {"id": request_id, "model": model, "reply": None, "error": None}
+    timings = {}
+    try:
+        if not model:
+            raise ValueError("No model given; set `model` on the request or pass --model.")
+        result["reply"] = complete_chat(client, _history(request), model, timings, use_cache, request.get("params"))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency"] = timings.get("total_time", 0.0)
+    result["cache_hit"] = bool(timings.get("cache_hit"))
+    return result
+
+
+def run_batch(client, input_path: str, output_path: str, model: Optional[str] = None,
+              concurrency: int = BATCH_CONCURRENCY, use_cache: bool = True) -> Dict:
+    """Runs every request not already in the checkpoint and returns the run's statistics."""
+    done = load_checkpoint(output_path)
+    latencies: List[float] = []
+    stats = {"completed": 0, "failed": 0, "skipped": 0}
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    with open(output_path, "a") as output_file, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def record(result: Dict):
+            with lock:
+                output_file.write(json.dumps(result) + "\n")
+                output_file.flush()  # a killed run loses at most the requests still in flight
+                stats["failed" if result["error"] else "completed"] += 1
+                if not result["error"]:
+                    latencies.append(result["latency"])
+
+        in_flight = set()
+        for request_id, request in read_requests(input_path):
+            if request_id in done:
+                stats["skipped"] += 1
+                continue
+            # Bounded read-ahead keeps memory flat for arbitrarily large input files
+            if len(in_flight) >= concurrency * 2:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(future.result())
+            in_flight.add(executor.submit(run_request, client, request_id, request, model, use_cache))
+        for future in wait(in_flight).done:
+            record(future.result())
+
+    elapsed = time.perf_counter() - start
+    processed = stats["completed"] + stats["failed"]
+    return {
+        **stats,
+        "elapsed": elapsed,
+        "throughput": processed / elapsed if elapsed > 0 else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies, default=0.0),
+    }
+
+
+def format_report(stats: Dict) -> str:
+    return (f"{stats['completed']} completed, {stats['failed']} failed, {stats['skipped']} skipped "
+            f"in {stats['elapsed']:.1f}s ({stats['throughput']:.2f} req/s)\n"
+            f"latency p50 {stats['latency_p50']:.2f}s · p90 {stats['latency_p90']:.2f}s · "
+            f"p95 {stats['latency_p95']:.2f}s · p99 {stats['latency_p99']:.2f}s · max {stats['latency_max']:.2f}s")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of chat requests")
+    parser.add_argument("output", help="JSONL file results are appended to (and resumed from)")
+    parser.add_argument("--model", help="model for requests that do not name one")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    api_key = resolve_api_key()
+    if not api_key:
+        print("No Groq API key configured; set GROQ_API_KEY or add it to config.json.", file=sys.stderr)
+        return 2
+    initialize_db()  # the response cache lives in the chat database
+    stats = run_batch(create_groq_client(api_key), args.input, args.output, args.model, args.concurrency,
+                      not args.no_cache)
+    print(json.dumps(stats, indent=2) if args.json else format_report(stats))
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
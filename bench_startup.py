@@ -0,0 +1,89 @@
+"""Measures what a Streamlit session pays before first paint (cold) and on every rerun (warm).
+
+    python bench_startup.py [--reruns 20] [--json]
+
+Each phase of main()'s setup is timed on its first call in a fresh process and then averaged over
+`--reruns` repeated calls, which is what every widget interaction costs.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _time_import() -> float:
+    # A separate interpreter so the module cache doesn't hide the cost
+    code = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def _measure(fn: Callable[[], object], reruns: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    fn()
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(reruns):
+        fn()
+    return {"cold_ms": cold * 1000, "rerun_ms": (time.perf_counter() - start) / reruns * 1000}
+
+
+def run(reruns: int) -> List[Dict]:
+    import_time = _time_import()
+    os.chdir(HERE)
+    sys.path.insert(0, HERE)
+    import app
+    import database
+    from static_assets import LOTTIE_SOURCES, load_lottie
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    database.DB_NAME = os.path.join(tmp_dir.name, "bench.db")
+    database.dispose_engine()
+    config = app.load_configuration()
+    api_key = config.get(app.API_KEY_ENV_VAR, "bench-key")
+
+    phases = [
+        ("load_configuration", app.load_configuration),
+        ("create_groq_client", lambda: app.create_groq_client(api_key)),
+        ("initialize_db", app.initialize_db),
+        ("load_logo", lambda: app.load_image(app.LOGO_PATH)),
+        ("parse_models_info", lambda: app.parse_models_info(app.MODELS_INFO_PATH)),
+        ("load_animations", lambda: [load_lottie(name) for name in LOTTIE_SOURCES]),
+    ]
+    results = [{"phase": "import_app", "cold_ms": import_time * 1000, "rerun_ms": 0.0}]
+    for name, fn in phases:
+        try:
+            results.append({"phase": name, **_measure(fn, reruns)})
+        except Exception as e:
+            results.append({"phase": name, "cold_ms": 0.0, "rerun_ms": 0.0, "error": str(e)})
+    results.append({"phase": "total",
+                    "cold_ms": sum(result["cold_ms"] for result in results),
+                    "rerun_ms": sum(result["rerun_ms"] for result in results)})
+    database.dispose_engine()
+    tmp_dir.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+    results = run(args.reruns)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'phase':<22}{'cold ms':>12}{'rerun ms':>12}")
+    for result in results:
+        error = f"  error: {result['error']}" if "error" in result else ""
+        print(f"{result['phase']:<22}{result['cold_ms']:>12.2f}{result['rerun_ms']:>12.3f}{error}")
+
+
+if __name__ == "__main__":
+    main()
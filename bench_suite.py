@@ -0,0 +1,251 @@
+"""Benchmarks the chat path, the chat database and history rendering against a local mock of the Groq API.
+
+    python bench_suite.py --output bench.json
+    python bench_suite.py --quick --compare bench.json
+
+Results are written as JSON (one record per measurement) so runs can be diffed between commits; `--compare`
+prints the change against an earlier results file. Nothing here touches the real API or the real database.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from groq import Groq
+
+import chat_core
+import database
+import request_scheduler
+import vector_memory
+from metrics import percentile
+from mock_groq_server import MockGroqConfig, MockGroqServer
+
+BENCH_MODEL = "llama3-8b-8192"
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORDS = ["llama", "groq", "sqlite", "stream", "token", "latency", "search", "cache", "model", "prompt"]
+
+
+def _result(name: str, samples: List[float], unit: str = "ms", **extra) -> Dict:
+    scale = 1000 if unit == "ms" else 1
+    return {"name": name, "unit": unit, "n": len(samples),
+            "p50": percentile(samples, 50) * scale, "p95": percentile(samples, 95) * scale,
+            "p99": percentile(samples, 99) * scale, **extra}
+
+
+def _time(fn: Callable[[], object], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_chat(config: MockGroqConfig, repeat: int) -> List[Dict]:
+    """Round trips through chat_core against the mock, next to a bare HTTP baseline, to isolate app overhead."""
+    # The scheduler's default per-model limits would otherwise dominate the measurement
+    request_scheduler.RATE_LIMITS[BENCH_MODEL] = {"rpm": 10 ** 9, "tpm": 10 ** 12}
+    request_scheduler._scheduler = None
+    history = [{"role": "system", "content": chat_core.SYSTEM_PROMPT},
+               {"role": "user", "content": "How fast is this round trip?"}]
+    expected = config.latency + (config.completion_tokens / config.tokens_per_second
+                                 if config.tokens_per_second else 0.0)
+    results = []
+    with MockGroqServer(config) as server, httpx.Client() as http:
+        client = Groq(base_url=server.base_url, api_key="mock", max_retries=0, http_client=httpx.Client())
+        url = f"{server.base_url}/openai/v1/chat/completions"
+        raw = _time(lambda: http.post(url, json={"model": BENCH_MODEL, "messages": history}).json(), repeat)
+        blocking = _time(lambda: chat_core.complete_chat(client, history, BENCH_MODEL, use_cache=False), repeat)
+
+        ttfts = []
+
+        def stream():
+            timings = {}
+            for _ in chat_core.stream_chat_response(client, history, BENCH_MODEL, timings, use_cache=False):
+                pass
+            ttfts.append(timings["ttft"])
+
+        streaming = _time(stream, repeat)
+
+        chat_core.MODELS_URL, models_url = f"{server.base_url}/openai/v1/models", chat_core.MODELS_URL
+        try:
+            models = _time(chat_core.fetch_groq_models, repeat)
+        finally:
+            chat_core.MODELS_URL = models_url
+        client.close()
+
+    results.append(_result("chat.http_baseline", raw, server_time_ms=expected * 1000))
+    results.append(_result("chat.complete", blocking, server_time_ms=expected * 1000,
+                           overhead_ms=(percentile(blocking, 50) - percentile(raw, 50)) * 1000))
+    results.append(_result("chat.stream_total", streaming,
+                           overhead_ms=(percentile(streaming, 50) - percentile(raw, 50)) * 1000))
+    results.append(_result("chat.stream_ttft", ttfts))
+    results.append(_result("models.fetch", models))
+    return results
+
+
+def bench_transcription(config: MockGroqConfig, repeat: int, tmp_dir: str) -> List[Dict]:
+    """One cold transcription per distinct file, then the content-hash cache hit for the same files."""
+    request_scheduler.RATE_LIMITS[chat_core.DEFAULT_TRANSCRIPTION_MODEL] = {"rpm": 10 ** 9, "tpm": 10 ** 12}
+    paths = []
+    for i in range(repeat):
+        path = os.path.join(tmp_dir, f"clip_{i}.wav")
+        with wave.open(path, "wb") as clip:
+            clip.setnchannels(1)
+            clip.setsampwidth(2)
+            clip.setframerate(16000)
+            clip.writeframes(i.to_bytes(2, "little") * 16000)  # one distinct second each
+        paths.append(path)
+    with MockGroqServer(config) as server:
+        client = Groq(base_url=server.base_url, api_key="mock", max_retries=0, http_client=httpx.Client())
+        pending = iter(paths)
+        cold = _time(lambda: chat_core.transcribe(client, next(pending)), repeat)
+        pending = iter(paths)
+        cached = _time(lambda: chat_core.transcribe(client, next(pending)), repeat)
+        client.close()
+    return [_result("transcribe.cold", cold), _result("transcribe.cached", cached)]
+
+
+def _populate(rows: int, conversation_id: int) -> float:
+    """Saves `rows` messages one save_message call at a time and returns the elapsed seconds."""
+    start_time = datetime(2024, 1, 1)
+    model = {"id": BENCH_MODEL}
+    start = time.perf_counter()
+    for i in range(rows):
+        content = " ".join(WORDS[(i * 7 + j) % len(WORDS)] for j in range(12)) + f" message {i}"
+        chat_core.save_message("user" if i % 2 == 0 else "assistant", content,
+                               (start_time + timedelta(seconds=i)).isoformat(), model, conversation_id)
+    return time.perf_counter() - start
+
+
+def bench_database(rows: int, repeat: int, tmp_dir: str) -> List[Dict]:
+    database.DB_NAME = os.path.join(tmp_dir, f"bench_{rows}.db")
+    database.dispose_engine()
+    chat_core._initialized_db = None
+    chat_core.initialize_db()
+    conversation_id = chat_core.default_conversation("bench")[1]
+
+    elapsed = _populate(rows, conversation_id)
+    results = [{"name": f"db.save_message.{rows}", "unit": "rows/s", "n": rows, "value": rows / elapsed}]
+
+    loads = _time(lambda: chat_core.load_chat_history(conversation_id), max(1, repeat // 5))
+    results.append(_result(f"db.load_chat_history.{rows}", loads,
+                           rows_per_second=rows / percentile(loads, 50)))
+    results.append(_result(f"db.load_chat_history_page.{rows}",
+                           _time(lambda: chat_core.load_chat_history_page(conversation_id), repeat)))
+
+    queries = iter([WORDS[i % len(WORDS)] if i % 2 else f"{WORDS[i % len(WORDS)]} mess" for i in range(repeat)])
+    searches = _time(lambda: chat_core.search_conversation(next(queries), conversation_id), repeat)
+    results.append(_result(f"db.search_chat_history.{rows}", searches))
+
+    recall_queries = iter([" ".join(WORDS[(i + j) % len(WORDS)] for j in range(4)) for i in range(repeat)])
+    recalls = _time(lambda: vector_memory.recall_messages(next(recall_queries), conversation_id), repeat)
+    results.append(_result(f"memory.recall.{rows}", recalls))
+    database.dispose_engine()
+    return results
+
+
+RENDER_SCRIPT = '''
+import streamlit as st
+import app
+
+if "chat_history" not in st.session_state:
+    st.session_state.chat_history = [
+        {{"id": i, "role": "user" if i % 2 == 0 else "assistant", "timestamp": "2024-08-12T21:54:44",
+          "content": "Message " + str(i) + " about llamas and latency. " * 6}}
+        for i in range({messages})
+    ]
+    st.session_state.render_limit = {render_limit}
+app.display_chat_history()
+'''
+
+
+def bench_render(messages: int, repeat: int) -> List[Dict]:
+    """Times Streamlit reruns that render the chat history, using Streamlit's script test harness."""
+    from streamlit.testing.v1 import AppTest
+
+    results = []
+    for render_limit, label in ((chat_core.HISTORY_PAGE_SIZE, "window"), (messages, "all")):
+        app_test = AppTest.from_string(RENDER_SCRIPT.format(messages=messages, render_limit=render_limit),
+                                       default_timeout=120)
+        app_test.run()  # the first run pays for imports
+        results.append(_result(f"render.chat_history.{label}", _time(app_test.run, repeat),
+                               messages=messages, rendered=render_limit))
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], previous_path: str) -> str:
+    with open(previous_path) as previous_file:
+        previous = {result["name"]: result for result in json.load(previous_file)["results"]}
+    lines = [f"{'benchmark':<40}{'before':>12}{'after':>12}{'change':>10}"]
+    for result in results:
+        key = "value" if "value" in result else "p50"
+        before = previous.get(result["name"], {}).get(key)
+        after = result[key]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "new"
+        lines.append(f"{result['name']:<40}{before if before is not None else '-':>12.6}{after:>12.6}{change:>10}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000", help="comma-separated table sizes for the DB benchmarks")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="mock API seconds before the first byte")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="mock API token rate (0: no pacing)")
+    parser.add_argument("--completion-tokens", type=int, default=64)
+    parser.add_argument("--render-messages", type=int, default=1000)
+    parser.add_argument("--quick", action="store_true", help="small sizes for a smoke run")
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--compare", help="earlier results JSON to diff against")
+    args = parser.parse_args()
+    if args.quick:
+        args.rows, args.repeat, args.render_messages = "1000", 10, 200
+
+    config = MockGroqConfig(args.latency, args.tokens_per_second, args.completion_tokens)
+    original_db_name = database.DB_NAME
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            for rows in (int(size) for size in args.rows.split(",")):
+                results += bench_database(rows, args.repeat, tmp_dir)
+            results += bench_chat(config, args.repeat)
+            results += bench_transcription(config, min(args.repeat, 20), tmp_dir)
+        finally:
+            database.dispose_engine()
+            database.DB_NAME = original_db_name
+    results += bench_render(args.render_messages, min(args.repeat, 20))
+
+    report = {
+        "meta": {"commit": git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "platform": platform.platform(), "args": vars(args)},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        print(compare(results, args.compare), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
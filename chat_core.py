@@ -0,0 +1,597 @@
+"""Chat, history, feedback, model-list and transcription logic shared by the Streamlit UI and the HTTP API.
+
+Nothing here touches Streamlit: failures are raised to the caller, which decides how to surface them.
+"""
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import requests
+from groq import AsyncGroq, Groq
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+
+import database
+from audio_pipeline import transcribe_file
+from context_window import build_context, clear_summary, estimate_prompt_tokens
+from feedback_rollups import ensure_feedback_rollups
+from history_archive import forget_conversation, load_archived_page
+from database import Base, ChatMessage, Conversation, Feedback, User, DEFAULT_USER_NAME, get_engine, \
+    session_scope, persist, execute_write, flush_pending_writes, migrate_schema
+from metrics_store import record_turn
+from model_catalog import ModelCatalog
+from request_scheduler import aobserve_response, get_scheduler, observe_response
+from response_cache import RESPONSE_CACHE_ENABLED, get_cached_response, store_response
+from search_index import ensure_search_index, search_messages
+from single_flight import credential_fingerprint, get_single_flight, request_key
+from static_assets import cached_by_mtime
+from vector_memory import remember
+
+CONFIG_FILE_NAME = "config.json"
+API_KEY_ENV_VAR = "GROQ_API_KEY"
+# Rate-limit key for the model list endpoint
+MODELS_ENDPOINT = "models"
+MODELS_URL = "https://api.groq.com/openai/v1/models"
+MODELS_INFO_PATH = "assets/models_info.md"
+SYSTEM_PROMPT = "You are my helpful assistant 🦙"
+NEW_CONVERSATION_TITLE = "New chat"
+# Messages fetched per page and rendered per "load older" step
+HISTORY_PAGE_SIZE = int(os.getenv("LLAMABOT_HISTORY_PAGE_SIZE", "50"))
+ERROR_REPLY = "😅 Sorry, there was an error processing your request."
+DEFAULT_TRANSCRIPTION_MODEL = "whisper-large-v3"
+AUDIO_TYPES = ["mp3", "mp4", "mpeg", "mpga", "m4a", "wav", "webm"]
+# Directory to store uploaded audio files
+UPLOADS_DIR = "uploads"
+# Keep-alive pool shared by every request a process sends to Groq
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLAMABOT_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_TIMEOUT = float(os.getenv("LLAMABOT_HTTP_TIMEOUT", "60"))
+MODELS_SINGLE_FLIGHT_TIMEOUT = 30.0
+
+
+# Enum for chat roles
+class Role(Enum):
+    USER = "user"
+    ASSISTANT = "assistant"
+    SYSTEM = "system"
+
+
+# Database file that initialize_db last ran against, as (path, inode)
+_initialized_db: Optional[Tuple[str, Optional[int]]] = None
+
+
+def _database_identity() -> Tuple[str, Optional[int]]:
+    try:
+        return database.DB_NAME, os.stat(database.DB_NAME).st_ino
+    except OSError:
+        return database.DB_NAME, None
+
+
+def initialize_db(attempts: int = 3):
+    """Creates and migrates the schema once per process, again only if the database file is replaced.
+
+    Several server workers may start at once; one that loses the race to create a table retries.
+    """
+    global _initialized_db
+    identity = _database_identity()
+    if identity[1] is not None and identity == _initialized_db:
+        return
+    for attempt in range(attempts):
+        try:
+            Base.metadata.create_all(get_engine())
+            migrate_schema(get_engine())
+            ensure_search_index(get_engine())
+            ensure_feedback_rollups(get_engine())
+            break
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+    _initialized_db = _database_identity()
+
+
+@cached_by_mtime
+def _read_configuration(config_path: str) -> Dict[str, str]:
+    with open(config_path) as config_file:
+        return json.load(config_file)
+
+
+def read_configuration() -> Dict[str, str]:
+    """Reads config.json next to this module; raises FileNotFoundError or json.JSONDecodeError."""
+    working_dir = os.path.dirname(os.path.abspath(__file__))
+    return _read_configuration(os.path.join(working_dir, CONFIG_FILE_NAME))
+
+
+def resolve_api_key() -> Optional[str]:
+    """The Groq key from the environment, falling back to config.json."""
+    api_key = os.getenv(API_KEY_ENV_VAR)
+    if api_key:
+        return api_key
+    try:
+        return read_configuration().get(API_KEY_ENV_VAR)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+
+
+@functools.lru_cache(maxsize=4)
+def _groq_client(api_key: str) -> Groq:
+    # Retries are handled by the shared request scheduler, which also reads every response's rate-limit headers
+    return Groq(api_key=api_key, max_retries=0,
+                http_client=httpx.Client(limits=_http_limits(), timeout=HTTP_TIMEOUT,
+                                         event_hooks={"response": [observe_response]}))
+
+
+def create_groq_client(api_key: str) -> Groq:
+    """Returns the process-wide client for `api_key`; a new key in config.json gets a new client."""
+    os.environ[API_KEY_ENV_VAR] = api_key
+    return _groq_client(api_key)
+
+
+def create_async_groq_client(api_key: str) -> AsyncGroq:
+    """A pooled async client; the caller owns it and should `await client.close()` on shutdown."""
+    return AsyncGroq(api_key=api_key, max_retries=0,
+                     http_client=httpx.AsyncClient(limits=_http_limits(), timeout=HTTP_TIMEOUT,
+                                                   event_hooks={"response": [aobserve_response]}))
+
+
+def fetch_groq_models() -> List[Dict[str, str]]:
+    """Asks the API for the models available to the configured key; raises on request or parse errors."""
+    headers = {
+        "Authorization": f"Bearer {os.getenv(API_KEY_ENV_VAR)}"
+    }
+
+    def request_models():
+        response = requests.get(MODELS_URL, headers=headers, timeout=10)
+        response.raise_for_status()  # 429 and 5xx are retried by the scheduler, other errors are not
+        return response
+
+    # Concurrent refreshes in this process share one request
+    key = request_key("models", url=MODELS_URL, credentials=credential_fingerprint(os.getenv(API_KEY_ENV_VAR)))
+    response, _ = get_single_flight().do(
+        key, lambda: get_scheduler().call(request_models, MODELS_ENDPOINT, operation="models"),
+        operation="models", timeout=MODELS_SINGLE_FLIGHT_TIMEOUT
+    )
+    models = response.json()["data"]
+    return [{"name": model["id"], "id": model["id"], "info": model.get("description", "")} for model in models]
+
+
+# Function to parse models_info.md and return a dictionary of model descriptions
+@cached_by_mtime
+def parse_models_info(file_path: str) -> Dict[str, str]:
+    models_info = {}
+    with open(file_path, 'r') as file:
+        lines = file.readlines()
+        current_model_id = None
+        current_model_description = []
+        for line in lines:
+            if line.startswith("**"):
+                if current_model_id:
+                    models_info[current_model_id] = "\n".join(current_model_description)
+                current_model_id = line.split("**")[1].strip()
+                current_model_description = []
+            elif line.startswith("- Model ID:"):
+                current_model_id = line.split(":")[1].strip()
+            elif line.startswith("- "):
+                current_model_description.append(line.strip())
+        if current_model_id:
+            models_info[current_model_id] = "\n".join(current_model_description)
+    return models_info
+
+
+def _model_descriptions() -> Dict[str, str]:
+    try:
+        return parse_models_info(MODELS_INFO_PATH)
+    except OSError:
+        return {}
+
+
+_model_catalog = ModelCatalog(fetch_groq_models, _model_descriptions)
+
+
+def get_groq_models() -> List[Dict[str, str]]:
+    """The shared model catalog with models_info.md descriptions; served from disk and refreshed in the background.
+
+    Never blocks on the API once any process on the host has fetched the list, and keeps serving the last good
+    copy while the API is unreachable.
+    """
+    return _model_catalog.models()
+
+
+def model_catalog_status() -> Dict:
+    return _model_catalog.status()
+
+
+def save_message(role: str, content: str, timestamp: str, model: Dict[str, str],
+                 conversation_id: Optional[int] = None) -> Optional[int]:
+    new_message = ChatMessage(
+        conversation_id=conversation_id,
+        role=role,
+        content=content,
+        timestamp=datetime.fromisoformat(timestamp),
+        model_id=model["id"]  # Extract the model ID from the dictionary
+    )
+    # Goes through the write-behind queue when it is enabled
+    message_id = persist(new_message)
+    if message_id is not None:
+        # Enqueued rows are picked up by the next save or recall instead
+        remember(message_id, conversation_id, content)
+    return message_id
+
+
+def _message_to_dict(msg: ChatMessage) -> Dict:
+    return {"id": msg.id, "role": msg.role, "content": msg.content, "timestamp": msg.timestamp.isoformat(),
+            "model_id": msg.model_id}
+
+
+def load_chat_history(conversation_id: Optional[int] = None) -> List[Dict[str, str]]:
+    with session_scope() as session:
+        query = session.query(ChatMessage)
+        if conversation_id is not None:
+            query = query.filter(ChatMessage.conversation_id == conversation_id)
+        chat_history = query.order_by(ChatMessage.id).all()
+    return [_message_to_dict(msg) for msg in chat_history]
+
+
+def load_chat_history_page(conversation_id: Optional[int] = None, before_id: Optional[int] = None,
+                           limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[Dict], bool]:
+    """Keyset-paginated load of the `limit` messages preceding `before_id` (the newest ones when None).
+
+    Returns the page in chronological order and whether older messages exist. Once a conversation's live
+    rows run out, the page continues from its archived history.
+    """
+    with session_scope() as session:
+        query = session.query(ChatMessage)
+        if conversation_id is not None:
+            query = query.filter(ChatMessage.conversation_id == conversation_id)
+        if before_id is not None:
+            query = query.filter(ChatMessage.id < before_id)
+        rows = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+    page = [_message_to_dict(msg) for msg in reversed(rows[:limit])]
+    if len(rows) > limit or conversation_id is None:
+        return page, len(rows) > limit
+    archived, has_more = load_archived_page(conversation_id, page[0]["id"] if page else before_id,
+                                            limit - len(page))
+    return archived + page, has_more
+
+
+def load_chat_history_since(after_id: int, conversation_id: Optional[int] = None) -> List[Dict]:
+    with session_scope() as session:
+        query = session.query(ChatMessage).filter(ChatMessage.id > after_id)
+        if conversation_id is not None:
+            query = query.filter(ChatMessage.conversation_id == conversation_id)
+        rows = query.order_by(ChatMessage.id).all()
+    return [_message_to_dict(msg) for msg in rows]
+
+
+def get_or_create_user(name: str) -> int:
+    with session_scope() as session:
+        user = session.query(User).filter_by(name=name).first()
+        if user is None:
+            user = User(name=name)
+            session.add(user)
+            session.flush()
+        return user.id
+
+
+def create_conversation(user_id: int, title: str = NEW_CONVERSATION_TITLE) -> int:
+    with session_scope() as session:
+        conversation = Conversation(user_id=user_id, title=title, created_at=datetime.now())
+        session.add(conversation)
+        session.flush()
+        return conversation.id
+
+
+def list_conversations(user_id: int) -> List[Dict]:
+    with session_scope() as session:
+        conversations = session.query(Conversation).filter_by(user_id=user_id).order_by(Conversation.id.desc()).all()
+    return [{"id": conversation.id, "title": conversation.title} for conversation in conversations]
+
+
+def get_conversation(conversation_id: int) -> Optional[Dict]:
+    with session_scope() as session:
+        conversation = session.get(Conversation, conversation_id)
+        return {"id": conversation.id, "title": conversation.title} if conversation else None
+
+
+def rename_conversation(conversation_id: int, title: str):
+    with session_scope() as session:
+        session.query(Conversation).filter_by(id=conversation_id).update({"title": title})
+
+
+def default_conversation(user_name: str = DEFAULT_USER_NAME) -> Tuple[int, int]:
+    """Returns (user_id, conversation_id) of the user's latest conversation, creating either if needed."""
+    user_id = get_or_create_user(user_name)
+    conversations = list_conversations(user_id)
+    return user_id, conversations[0]["id"] if conversations else create_conversation(user_id)
+
+
+def add_user_message(conversation_id: int, content: str, model_id: str) -> Dict:
+    """Saves a user turn and returns it as a history entry; the first turn also titles a new conversation."""
+    timestamp = datetime.now().isoformat()
+    with session_scope() as session:
+        session.query(Conversation).filter_by(id=conversation_id, title=NEW_CONVERSATION_TITLE).update(
+            {"title": content[:60]})
+    message_id = save_message(Role.USER.value, content, timestamp, {"id": model_id}, conversation_id)
+    return {"id": message_id, "role": Role.USER.value, "content": content, "timestamp": timestamp,
+            "model_id": model_id}
+
+
+def add_assistant_message(conversation_id: int, reply: str, model_id: str,
+                          timings: Optional[Dict[str, float]] = None) -> Dict:
+    timestamp = datetime.now().isoformat()
+    message_id = save_message(Role.ASSISTANT.value, reply, timestamp, {"id": model_id}, conversation_id)
+    return {
+        "role": Role.ASSISTANT.value,
+        "content": reply,
+        "timestamp": timestamp,
+        "model_id": model_id,
+        "id": message_id,  # Row id, or None until the write-behind queue flushes it
+        **(timings or {})
+    }
+
+
+def build_history(chat_history: List[Dict], model_id: Optional[str] = None, client: Optional[Groq] = None,
+                  conversation_id: Optional[int] = None) -> List[Dict[str, str]]:
+    # Recent turns verbatim, older ones folded into a rolling summary to stay within the model's context window
+    return build_context(chat_history, SYSTEM_PROMPT, model_id, client, conversation_id)
+
+
+def _chat_key(operation: str, client, history: List[Dict[str, str]], model: str, params: Optional[Dict]) -> str:
+    return request_key(operation, model=model, messages=[[message["role"], message["content"]] for message in history],
+                       params=params or {}, credentials=credential_fingerprint(getattr(client, "api_key", None)))
+
+
+def _use_response_cache(use_cache: bool) -> bool:
+    return RESPONSE_CACHE_ENABLED and use_cache
+
+
+def _chunk_usage(chunk):
+    # Groq reports a stream's token usage in the x_groq field of its last chunk
+    return getattr(getattr(chunk, "x_groq", None), "usage", None)
+
+
+def complete_chat(client: Groq, history: List[Dict[str, str]], model: str,
+                  timings: Optional[Dict[str, float]] = None, use_cache: bool = True,
+                  params: Optional[Dict] = None) -> str:
+    """Returns the whole reply at once; raises on API errors."""
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    usage = error = None
+    try:
+        if _use_response_cache(use_cache):
+            cached_reply = get_cached_response(model, history, params)
+            if cached_reply is not None:
+                timings["cache_hit"] = True
+                return cached_reply
+        # Identical requests already in flight (duplicate submits, reruns) share one call
+        response, leader = get_single_flight().do(
+            _chat_key("chat", client, history, model, params),
+            lambda: get_scheduler().call(
+                lambda: client.chat.completions.create(
+                    model=model,
+                    messages=history,
+                    **(params or {})
+                ),
+                model, estimate_prompt_tokens(history)
+            ),
+            operation="chat"
+        )
+        # A shared reply's tokens are counted once, by the caller that made the request
+        usage = getattr(response, "usage", None) if leader else None
+        if not leader:
+            timings["coalesced"] = True
+        reply = response.choices[0].message.content
+        if _use_response_cache(use_cache) and reply and leader:
+            store_response(model, history, reply, params)
+        return reply
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        # Without streaming the first token arrives with the whole reply
+        timings["total_time"] = time.perf_counter() - start
+        timings["ttft"] = timings["total_time"]
+        record_turn(model, timings, usage, error)
+
+
+def stream_chat_response(client: Groq, history: List[Dict[str, str]], model: str,
+                         timings: Optional[Dict[str, float]] = None, use_cache: bool = True,
+                         params: Optional[Dict] = None) -> Iterator[str]:
+    """Yields reply deltas as they arrive, recording time-to-first-token and total time in `timings`."""
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    usage = error = None
+    try:
+        if _use_response_cache(use_cache):
+            cached_reply = get_cached_response(model, history, params)
+            if cached_reply is not None:
+                timings["cache_hit"] = True
+                timings["ttft"] = time.perf_counter() - start
+                yield cached_reply
+                return
+        chunks, leader = get_single_flight().stream(
+            _chat_key("chat.stream", client, history, model, params),
+            lambda: get_scheduler().call(
+                lambda: client.chat.completions.create(
+                    model=model,
+                    messages=history,
+                    stream=True,
+                    **(params or {})
+                ),
+                model, estimate_prompt_tokens(history)
+            ),
+            operation="chat.stream"
+        )
+        if not leader:
+            timings["coalesced"] = True
+        parts = []
+        with contextlib.closing(chunks):
+            for chunk in chunks:
+                usage = (_chunk_usage(chunk) or usage) if leader else None
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if "ttft" not in timings:
+                        timings["ttft"] = time.perf_counter() - start
+                    parts.append(delta)
+                    yield delta
+        # Only complete streams are cached; interrupted ones raise before reaching this point
+        if _use_response_cache(use_cache) and parts and leader:
+            store_response(model, history, "".join(parts), params)
+    except BaseException as e:
+        error = e  # includes GeneratorExit when the reader stops early
+        raise
+    finally:
+        timings["total_time"] = time.perf_counter() - start
+        record_turn(model, timings, usage, error, streamed=True)
+
+
+async def acomplete_chat(client: AsyncGroq, history: List[Dict[str, str]], model: str,
+                         timings: Optional[Dict[str, float]] = None, use_cache: bool = True,
+                         params: Optional[Dict] = None) -> str:
+    """Async counterpart of complete_chat; database work runs on worker threads."""
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    usage = error = None
+    try:
+        if _use_response_cache(use_cache):
+            cached_reply = await asyncio.to_thread(get_cached_response, model, history, params)
+            if cached_reply is not None:
+                timings["cache_hit"] = True
+                return cached_reply
+        response, leader = await get_single_flight().ado(
+            _chat_key("chat", client, history, model, params),
+            lambda: get_scheduler().acall(
+                lambda: client.chat.completions.create(model=model, messages=history, **(params or {})),
+                model, estimate_prompt_tokens(history)
+            ),
+            operation="chat"
+        )
+        usage = getattr(response, "usage", None) if leader else None
+        if not leader:
+            timings["coalesced"] = True
+        reply = response.choices[0].message.content
+        if _use_response_cache(use_cache) and reply and leader:
+            await asyncio.to_thread(store_response, model, history, reply, params)
+        return reply
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        timings["total_time"] = time.perf_counter() - start
+        timings["ttft"] = timings["total_time"]
+        await asyncio.to_thread(record_turn, model, timings, usage, error)
+
+
+async def astream_chat_response(client: AsyncGroq, history: List[Dict[str, str]], model: str,
+                                timings: Optional[Dict[str, float]] = None, use_cache: bool = True,
+                                params: Optional[Dict] = None) -> AsyncIterator[str]:
+    """Async counterpart of stream_chat_response."""
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    usage = error = None
+    try:
+        if _use_response_cache(use_cache):
+            cached_reply = await asyncio.to_thread(get_cached_response, model, history, params)
+            if cached_reply is not None:
+                timings["cache_hit"] = True
+                timings["ttft"] = time.perf_counter() - start
+                yield cached_reply
+                return
+        chunks, leader = get_single_flight().astream(
+            _chat_key("chat.stream", client, history, model, params),
+            lambda: get_scheduler().acall(
+                lambda: client.chat.completions.create(model=model, messages=history, stream=True,
+                                                       **(params or {})),
+                model, estimate_prompt_tokens(history)
+            ),
+            operation="chat.stream"
+        )
+        if not leader:
+            timings["coalesced"] = True
+        parts = []
+        async with contextlib.aclosing(chunks):
+            async for chunk in chunks:
+                usage = (_chunk_usage(chunk) or usage) if leader else None
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if "ttft" not in timings:
+                        timings["ttft"] = time.perf_counter() - start
+                    parts.append(delta)
+                    yield delta
+        if _use_response_cache(use_cache) and parts and leader:
+            await asyncio.to_thread(store_response, model, history, "".join(parts), params)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        timings["total_time"] = time.perf_counter() - start
+        # Synchronous: a discarded async generator may be finalized outside the event loop
+        record_turn(model, timings, usage, error, streamed=True)
+
+
+def save_feedback(chat_message_id: int, is_positive: bool, comment: Optional[str]) -> bool:
+    """Stores feedback for a message; returns True when it replaced earlier feedback.
+
+    A single upsert on the unique chat_message_id, so concurrent sessions cannot create duplicates.
+    Raises IntegrityError when the message does not exist. With write-behind on, the upsert joins the next batch
+    and waits for its commit.
+    """
+    statement = sqlite_insert(Feedback).values(chat_message_id=chat_message_id, is_positive=is_positive,
+                                               comment=comment, revision=0)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Feedback.chat_message_id],
+        set_={"is_positive": statement.excluded.is_positive, "comment": statement.excluded.comment,
+              "revision": Feedback.revision + 1}
+    ).returning(Feedback.revision)
+    return execute_write(statement) > 0
+
+
+def resolve_message_id(conversation_id: int, message: Dict) -> Optional[int]:
+    """The row id of a history entry saved without one (write-behind in `enqueue` mode)."""
+    if message.get("id") is not None:
+        return message["id"]
+    flush_pending_writes()
+    with session_scope() as session:
+        return session.query(ChatMessage.id).filter_by(
+            conversation_id=conversation_id, role=message["role"],
+            timestamp=datetime.fromisoformat(message["timestamp"])
+        ).order_by(ChatMessage.id.desc()).limit(1).scalar()
+
+
+def clear_conversation(conversation_id: int):
+    """Deletes the messages, feedback and summary of one conversation, and hides its archived history."""
+    flush_pending_writes()
+    with session_scope() as session:
+        message_ids = session.query(ChatMessage.id).filter(ChatMessage.conversation_id == conversation_id)
+        session.query(Feedback).filter(Feedback.chat_message_id.in_(message_ids.scalar_subquery())).delete(
+            synchronize_session=False)
+        session.query(ChatMessage).filter(ChatMessage.conversation_id == conversation_id).delete(
+            synchronize_session=False)
+    clear_summary(conversation_id)
+    forget_conversation(conversation_id)
+
+
+def search_conversation(query: str, conversation_id: Optional[int] = None, role: Optional[str] = None,
+                        model_id: Optional[str] = None, start_date=None, end_date=None,
+                        page: int = 0) -> Tuple[List[Dict], bool]:
+    # Ranked FTS5 search over the whole conversation, with inclusive calendar-day bounds
+    start = datetime.combine(start_date, datetime.min.time()) if start_date else None
+    end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1) if end_date else None
+    return search_messages(query, conversation_id=conversation_id, role=role, model_id=model_id, start=start,
+                           end=end, page=page)
+
+
+def transcribe(client: Groq, audio_file_path: str, model: str = DEFAULT_TRANSCRIPTION_MODEL,
+               language: Optional[str] = None, content_hash: Optional[str] = None) -> str:
+    """Transcribes audio, splitting long recordings into concurrent segments; raises on failure."""
+    return transcribe_file(client, audio_file_path, model, language or None, content_hash=content_hash)
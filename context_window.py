@@ -0,0 +1,219 @@
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
+
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+
+from database import Base, session_scope
+from request_scheduler import get_scheduler, PRIORITY_BACKGROUND
+from vector_memory import MEMORY_MAX_TOKENS, MEMORY_TOP_K, recall_messages
+
+MODELS_INFO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "models_info.md")
+DEFAULT_CONTEXT_WINDOW = 8192
+# Hard cap on the prompt size regardless of how large the model's window is
+MAX_PROMPT_TOKENS = int(os.getenv("LLAMABOT_MAX_PROMPT_TOKENS", "8192"))
+# Tokens kept free for the completion
+COMPLETION_RESERVE_TOKENS = int(os.getenv("LLAMABOT_COMPLETION_RESERVE_TOKENS", "1024"))
+SUMMARY_MAX_TOKENS = int(os.getenv("LLAMABOT_SUMMARY_MAX_TOKENS", "512"))
+# After the window overflows, older turns are folded until it is back under this fraction of its budget,
+# so the summary is recomputed every few turns rather than on every turn
+WINDOW_LOW_WATERMARK = 0.6
+SUMMARY_MODEL = os.getenv("LLAMABOT_SUMMARY_MODEL", "llama-3.1-8b-instant")
+
+# Introduces the messages recalled from long-term memory
+RECALL_HEADER = "Possibly relevant earlier messages:\n"
+MIN_RECALL_TOKENS = 16
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4  # role and separators added by the chat template
+
+
+class ChatSummary(Base):
+    __tablename__ = 'chat_summary'
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey('conversations.id'), index=True)
+    content = Column(String)
+    summarized_through = Column(DateTime)  # timestamp of the newest message folded into the summary
+    token_count = Column(Integer)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) that avoids loading a tokenizer."""
+    return -(-len(text) // CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+
+def message_tokens(message: Dict) -> int:
+    """Returns the token estimate of a history entry, caching it on the entry."""
+    if "tokens" not in message:
+        message["tokens"] = estimate_tokens(message["content"])
+    return message["tokens"]
+
+
+@lru_cache(maxsize=1)
+def _context_windows(file_path: str = MODELS_INFO_PATH) -> Dict[str, int]:
+    windows = {}
+    current_model_id = None
+    try:
+        with open(file_path, 'r') as file:
+            for line in file:
+                if line.startswith("- Model ID:"):
+                    current_model_id = line.split(":", 1)[1].strip()
+                elif line.startswith("- Context Window:") and current_model_id:
+                    digits = re.sub(r"[^0-9]", "", line.split(":", 1)[1])
+                    if digits:
+                        windows[current_model_id] = int(digits)
+    except FileNotFoundError:
+        pass
+    return windows
+
+
+def get_context_limit(model_id: Optional[str]) -> int:
+    return _context_windows().get(model_id, DEFAULT_CONTEXT_WINDOW)
+
+
+def get_prompt_budget(model_id: Optional[str]) -> int:
+    return min(get_context_limit(model_id), MAX_PROMPT_TOKENS) - COMPLETION_RESERVE_TOKENS
+
+
+def load_summary(conversation_id: Optional[int] = None) -> Optional[ChatSummary]:
+    with session_scope() as session:
+        return session.query(ChatSummary).filter_by(conversation_id=conversation_id).first()
+
+
+def store_summary(content: str, summarized_through: datetime, conversation_id: Optional[int] = None):
+    with session_scope() as session:
+        summary = session.query(ChatSummary).filter_by(conversation_id=conversation_id).first()
+        if summary is None:
+            summary = ChatSummary(conversation_id=conversation_id)
+            session.add(summary)
+        summary.content = content
+        summary.summarized_through = summarized_through
+        summary.token_count = estimate_tokens(content)
+
+
+def clear_summary(conversation_id: Optional[int] = None):
+    with session_scope() as session:
+        session.query(ChatSummary).filter_by(conversation_id=conversation_id).delete()
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max(0, (max_tokens - MESSAGE_OVERHEAD_TOKENS) * CHARS_PER_TOKEN)
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+
+def _extractive_summary(previous_summary: str, messages: List[Dict]) -> str:
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        first_sentence = re.split(r"(?<=[.!?])\s", message["content"].strip(), maxsplit=1)[0]
+        lines.append(f"{message['role']}: {first_sentence[:200]}")
+    # Drop the oldest lines first when the summary is over budget
+    max_chars = (SUMMARY_MAX_TOKENS - MESSAGE_OVERHEAD_TOKENS) * CHARS_PER_TOKEN
+    while len(lines) > 1 and sum(len(line) + 1 for line in lines) > max_chars:
+        lines.pop(0)
+    return _truncate_to_tokens("\n".join(lines), SUMMARY_MAX_TOKENS)
+
+
+def summarize_messages(client, previous_summary: str, messages: List[Dict]) -> str:
+    """Folds `messages` into the running summary with a small model, or extractively without a client."""
+    if client is None:
+        return _extractive_summary(previous_summary, messages)
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    try:
+        messages = [
+            {"role": "system", "content": "Update the running summary of a conversation with the new turns. "
+                                          "Keep facts, names, decisions and open questions. Be concise."},
+            {"role": "user", "content": f"Current summary:\n{previous_summary or '(empty)'}\n\n"
+                                        f"New turns:\n{transcript}"}
+        ]
+        response = get_scheduler().call(
+            lambda: client.chat.completions.create(
+                model=SUMMARY_MODEL,
+                messages=messages,
+                max_tokens=SUMMARY_MAX_TOKENS
+            ),
+            SUMMARY_MODEL, estimate_prompt_tokens(messages) + SUMMARY_MAX_TOKENS, PRIORITY_BACKGROUND,
+            operation="summary"
+        )
+        return _truncate_to_tokens(response.choices[0].message.content.strip(), SUMMARY_MAX_TOKENS)
+    except Exception:
+        return _extractive_summary(previous_summary, messages)
+
+
+def _split_window(messages: List[Dict], window_budget: int) -> Tuple[List[Dict], List[Dict]]:
+    """Splits unsummarized messages into (to_fold, window) so the window fits the budget."""
+    total = sum(message_tokens(message) for message in messages)
+    if total <= window_budget:
+        return [], messages
+    target = int(window_budget * WINDOW_LOW_WATERMARK)
+    fold_count = 0
+    # Always keep the latest message in the window
+    while fold_count < len(messages) - 1 and total > target:
+        total -= message_tokens(messages[fold_count])
+        fold_count += 1
+    return messages[:fold_count], messages[fold_count:]
+
+
+def _recalled_block(window: List[Dict], conversation_id: Optional[int], budget: int) -> Optional[str]:
+    """Earlier messages most similar to the latest turn, best first, cut to `budget` tokens."""
+    if MEMORY_TOP_K <= 0 or budget <= 2 * MESSAGE_OVERHEAD_TOKENS:
+        return None
+    in_window = {message["id"] for message in window if message.get("id") is not None}
+    memories = recall_messages(window[-1]["content"], conversation_id, exclude_ids=in_window, k=MEMORY_TOP_K)
+    # Turns saved without an id yet (write-behind) are recognized by their content
+    in_window_text = {message["content"] for message in window}
+    lines = []
+    remaining = budget - estimate_tokens(RECALL_HEADER)
+    for memory in (memory for memory in memories if memory["content"] not in in_window_text):
+        line = f"[{memory['timestamp'][:10]}] {memory['role']}: {memory['content']}"
+        tokens = estimate_tokens(line) - MESSAGE_OVERHEAD_TOKENS
+        if tokens > remaining:
+            # Part of a long message is still worth sending, a few words are not
+            if remaining >= MIN_RECALL_TOKENS:
+                lines.append(_truncate_to_tokens(line, remaining + MESSAGE_OVERHEAD_TOKENS))
+            break
+        lines.append(line)
+        remaining -= tokens
+    return RECALL_HEADER + "\n".join(lines) if lines else None
+
+
+def build_context(history: List[Dict], system_prompt: str, model_id: Optional[str],
+                  client=None, conversation_id: Optional[int] = None) -> List[Dict[str, str]]:
+    """Returns the API messages for `history`, bounded by the model's prompt budget.
+
+    Recent turns are sent verbatim; turns that no longer fit are folded into a rolling summary that is
+    persisted so each fold only processes the newly dropped turns. Room left in the budget, up to
+    MEMORY_MAX_TOKENS, goes to the stored messages most relevant to the latest turn.
+    """
+    budget = get_prompt_budget(model_id)
+    summary = load_summary(conversation_id)
+    summary_text = summary.content if summary else ""
+    summarized_through = summary.summarized_through if summary else None
+
+    unsummarized = [
+        message for message in history
+        if summarized_through is None or datetime.fromisoformat(message["timestamp"]) > summarized_through
+    ]
+    window_budget = budget - estimate_tokens(system_prompt) - SUMMARY_MAX_TOKENS - MESSAGE_OVERHEAD_TOKENS
+    to_fold, window = _split_window(unsummarized, window_budget)
+    if to_fold:
+        summary_text = summarize_messages(client, summary_text, to_fold)
+        store_summary(summary_text, datetime.fromisoformat(to_fold[-1]["timestamp"]), conversation_id)
+
+    api_messages = [{"role": "system", "content": system_prompt}]
+    if summary_text:
+        api_messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary_text}"})
+    if window:
+        memory_budget = min(MEMORY_MAX_TOKENS, window_budget - sum(message_tokens(message) for message in window))
+        recalled = _recalled_block(window, conversation_id, memory_budget)
+        if recalled:
+            api_messages.append({"role": "system", "content": recalled})
+    api_messages.extend({"role": message["role"], "content": message["content"]} for message in window)
+    if window and message_tokens(window[-1]) > window_budget:
+        api_messages[-1]["content"] = _truncate_to_tokens(window[-1]["content"], window_budget)
+    return api_messages
@@ -0,0 +1,465 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional
+
+from sqlalchemy import create_engine, event, inspect, Column, Integer, String, DateTime, Boolean, ForeignKey, Index
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql.expression import Executable
+
+from metrics import DB_ERRORS, DB_STATEMENT_SECONDS, DB_TRANSACTION_SECONDS, WRITE_BEHIND_DROPPED, span, \
+    statement_kind
+
+# Database settings (overridable through environment variables)
+DB_NAME = os.getenv("LLAMABOT_DB", "chat_history.db")
+DB_POOL_SIZE = int(os.getenv("LLAMABOT_DB_POOL_SIZE", "5"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("LLAMABOT_DB_BUSY_TIMEOUT_MS", "5000"))
+# PRAGMA synchronous level: NORMAL is safe with WAL (no corruption, may lose the last commits on power loss),
+# FULL fsyncs on every commit.
+DB_SYNCHRONOUS = os.getenv("LLAMABOT_DB_SYNCHRONOUS", "NORMAL").upper()
+
+# Write-behind queue settings
+WRITE_BEHIND_ENABLED = os.getenv("LLAMABOT_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("LLAMABOT_WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("LLAMABOT_WRITE_BEHIND_MAX_BATCH", "500"))
+# "commit": callers block until the batch holding their row is committed (group commit).
+# "enqueue": callers return immediately; rows are committed on the next flush or at shutdown.
+WRITE_BEHIND_DURABILITY = os.getenv("LLAMABOT_WRITE_BEHIND_DURABILITY", "commit")
+
+Base = declarative_base()
+
+
+class User(Base):
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
+
+class Conversation(Base):
+    __tablename__ = 'conversations'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+    title = Column(String)
+    created_at = Column(DateTime)
+
+
+class ChatMessage(Base):
+    __tablename__ = 'chat_history'
+    __table_args__ = (
+        Index('ix_chat_history_conversation_id_id', 'conversation_id', 'id'),
+        Index('ix_chat_history_model_id_timestamp', 'model_id', 'timestamp'),
+        # Ids of archived and cleared messages are never handed out again
+        {'sqlite_autoincrement': True},
+    )
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey('conversations.id'))
+    role = Column(String)
+    content = Column(String)
+    timestamp = Column(DateTime)
+    model_id = Column(String)
+
+
+class Feedback(Base):
+    __tablename__ = 'feedback'
+    # One row per message, so feedback is upserted rather than looked up first
+    __table_args__ = (Index('ix_feedback_chat_message_id', 'chat_message_id', unique=True),)
+    id = Column(Integer, primary_key=True)
+    chat_message_id = Column(Integer, ForeignKey('chat_history.id'))
+    is_positive = Column(Boolean)
+    comment = Column(String)
+    revision = Column(Integer, default=0, server_default="0")  # times the feedback was changed since it was given
+
+
+_engine: Optional[Engine] = None
+_session_factory: Optional[sessionmaker] = None
+_engine_lock = threading.RLock()
+
+
+def _apply_sqlite_pragmas(dbapi_connection, _connection_record):
+    cursor = dbapi_connection.cursor()
+    # Only takes effect on a new database; `python history_archive.py compact` converts an existing one
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")  # ~16 MB page cache per connection
+    cursor.close()
+
+
+def _start_statement_timer(conn, _cursor, _statement, _parameters, _context, _executemany):
+    conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+
+def _stop_statement_timer(conn, _cursor, statement, _parameters, _context, _executemany):
+    started = conn.info["statement_start"].pop()
+    DB_STATEMENT_SECONDS.observe(time.perf_counter() - started, statement=statement_kind(statement))
+
+
+def _discard_statement_timer(context):
+    # A failed statement never reaches after_cursor_execute
+    starts = context.connection.info.get("statement_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def get_engine() -> Engine:
+    """Returns the process-wide engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(
+                    f'sqlite:///{DB_NAME}',
+                    pool_size=DB_POOL_SIZE,
+                    pool_pre_ping=True,
+                    connect_args={"check_same_thread": False},
+                )
+                event.listen(engine, "connect", _apply_sqlite_pragmas)
+                event.listen(engine, "before_cursor_execute", _start_statement_timer)
+                event.listen(engine, "after_cursor_execute", _stop_statement_timer)
+                event.listen(engine, "handle_error", _discard_statement_timer)
+                _engine = engine
+    return _engine
+
+
+def get_session_factory() -> sessionmaker:
+    global _session_factory
+    if _session_factory is None:
+        with _engine_lock:
+            if _session_factory is None:
+                _session_factory = sessionmaker(bind=get_engine(), expire_on_commit=False)
+    return _session_factory
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """Provides a transactional scope: commits on success, rolls back on error."""
+    with span(DB_TRANSACTION_SECONDS, DB_ERRORS):
+        session = get_session_factory()()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+def dispose_engine():
+    """Drops the cached engine and session factory (used by tests and after forking)."""
+    global _engine, _session_factory
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+        _session_factory = None
+
+
+DEFAULT_USER_NAME = "local"
+DEFAULT_CONVERSATION_TITLE = "Imported chat"
+
+
+def _add_missing_column(connection, table: str, column_ddl: str):
+    column_name = column_ddl.split()[0]
+    columns = {column["name"] for column in inspect(connection).get_columns(table)}
+    if column_name not in columns:
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column_ddl}")
+
+
+def _rebuild_with_autoincrement(engine: Engine):
+    """Recreates a chat_history table made without AUTOINCREMENT, which could reuse ids of archived messages.
+
+    The id sequence resumes after the newest live or archived id. Triggers on the table are dropped with it and
+    recreated by ensure_search_index.
+    """
+    with engine.connect() as connection:
+        ddl = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'chat_history'"
+        ).scalar()
+        if ddl is None or "AUTOINCREMENT" in ddl.upper():
+            return
+        # Dropping the old table must not cascade to feedback, and renaming the new one must not re-check
+        # feedback triggers that refer to chat_history; both pragmas only apply outside a transaction
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        connection.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+        try:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            ddl = connection.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'chat_history'"
+            ).scalar()
+            if "AUTOINCREMENT" not in ddl.upper():
+                _copy_to_autoincrement_table(connection)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+
+
+def _copy_to_autoincrement_table(connection):
+    columns = ", ".join(column.name for column in ChatMessage.__table__.columns)
+    create = str(CreateTable(ChatMessage.__table__).compile(dialect=connection.dialect))
+    connection.exec_driver_sql(create.replace("CREATE TABLE chat_history", "CREATE TABLE chat_history_new", 1))
+    connection.exec_driver_sql(f"INSERT INTO chat_history_new ({columns}) SELECT {columns} FROM chat_history")
+    newest_ids = ["SELECT MAX(id) FROM chat_history"]
+    if "archive_partitions" in inspect(connection).get_table_names():
+        newest_ids.append("SELECT MAX(newest_id) FROM archive_partitions")
+    newest_id = max(connection.exec_driver_sql(query).scalar() or 0 for query in newest_ids)
+    connection.exec_driver_sql("DROP TABLE chat_history")
+    connection.exec_driver_sql("ALTER TABLE chat_history_new RENAME TO chat_history")
+    for index in ChatMessage.__table__.indexes:
+        index.create(connection)
+    connection.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'chat_history'")
+    connection.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('chat_history', ?)", (newest_id,))
+
+
+def migrate_schema(engine: Optional[Engine] = None):
+    """Brings databases created before conversations existed up to date.
+
+    Adds the conversation columns, files every unscoped message under a default conversation, drops
+    duplicate feedback, creates indexes that `create_all` skips on existing tables and switches chat_history
+    to AUTOINCREMENT ids.
+    """
+    engine = engine or get_engine()
+    with engine.begin() as connection:
+        table_names = set(inspect(connection).get_table_names())
+        if "chat_history" in table_names:
+            _add_missing_column(connection, "chat_history", "conversation_id INTEGER REFERENCES conversations(id)")
+        if "chat_summary" in table_names:
+            _add_missing_column(connection, "chat_summary", "conversation_id INTEGER REFERENCES conversations(id)")
+        for index in ChatMessage.__table__.indexes:
+            index.create(connection, checkfirst=True)
+        if "feedback" in table_names:
+            _add_missing_column(connection, "feedback", "revision INTEGER DEFAULT 0")
+            unique_index = connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ix_feedback_chat_message_id'"
+            ).first()
+            if not unique_index:
+                # Earlier versions could store several rows per message; the latest one wins
+                connection.exec_driver_sql(
+                    "DELETE FROM feedback WHERE id NOT IN (SELECT MAX(id) FROM feedback GROUP BY chat_message_id)"
+                )
+                for index in Feedback.__table__.indexes:
+                    index.create(connection, checkfirst=True)
+
+        orphaned = connection.exec_driver_sql(
+            "SELECT 1 FROM chat_history WHERE conversation_id IS NULL LIMIT 1"
+        ).first()
+        if orphaned:
+            connection.exec_driver_sql("INSERT OR IGNORE INTO users (name) VALUES (?)", (DEFAULT_USER_NAME,))
+            user_id = connection.exec_driver_sql(
+                "SELECT id FROM users WHERE name = ?", (DEFAULT_USER_NAME,)
+            ).scalar()
+            conversation_id = connection.exec_driver_sql(
+                "INSERT INTO conversations (user_id, title, created_at) "
+                "VALUES (?, ?, (SELECT MIN(timestamp) FROM chat_history WHERE conversation_id IS NULL))",
+                (user_id, DEFAULT_CONVERSATION_TITLE)
+            ).lastrowid
+            connection.exec_driver_sql(
+                "UPDATE chat_history SET conversation_id = ? WHERE conversation_id IS NULL", (conversation_id,)
+            )
+            if "chat_summary" in table_names:
+                connection.exec_driver_sql(
+                    "UPDATE chat_summary SET conversation_id = ? WHERE conversation_id IS NULL", (conversation_id,)
+                )
+    _rebuild_with_autoincrement(engine)
+
+
+class PendingWrite:
+    """Handle for a row (or an insert/upsert statement) queued on the write-behind queue."""
+
+    def __init__(self, row):
+        self.row = row
+        self._done = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._preset_id = getattr(row, "id", None)
+        self.id: Optional[int] = None
+        self.value: Any = None  # first column returned by a statement
+
+    def _write(self, session: Session):
+        if isinstance(self.row, Executable):
+            self.value = session.execute(self.row).scalar()
+        elif self.row is not None:
+            session.add(self.row)
+
+    def _reset(self):
+        # A rolled-back flush leaves the generated key on the object; the retry must not reuse it
+        if self.row is not None and not isinstance(self.row, Executable):
+            self.row.id = self._preset_id
+
+    def _resolve(self, error: Optional[BaseException] = None):
+        self._error = error
+        if error is None and not isinstance(self.row, Executable):
+            self.id = getattr(self.row, "id", None)
+        self._done.set()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def result(self, timeout: Optional[float] = None) -> Optional[int]:
+        """Blocks until the row is committed and returns its primary key (a statement's first column)."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("Timed out waiting for the write-behind flush.")
+        if self._error is not None:
+            raise self._error
+        return self.value if isinstance(self.row, Executable) else self.id
+
+
+class WriteBehindQueue:
+    """Background writer that batches ORM inserts into one transaction per flush interval."""
+
+    def __init__(self, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_batch: int = WRITE_BEHIND_MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[PendingWrite]]" = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="llamabot-write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, row) -> PendingWrite:
+        if self._stopped.is_set():
+            raise RuntimeError("Write-behind queue has been stopped.")
+        pending = PendingWrite(row)
+        self._queue.put(pending)
+        return pending
+
+    def _drain(self, first: PendingWrite) -> List[PendingWrite]:
+        batch = [first]
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped.set()
+                break
+            batch.append(item)
+        return batch
+
+    def flush(self, timeout: Optional[float] = None):
+        """Blocks until everything queued before this call has been committed."""
+        self.submit(None).result(timeout)
+
+    @staticmethod
+    def _write(batch: List[PendingWrite]):
+        if any(pending.row is not None for pending in batch):
+            with session_scope() as session:
+                for pending in batch:
+                    pending._write(session)
+                session.flush()
+
+    def _commit(self, batch: List[PendingWrite]):
+        try:
+            self._write(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                self._drop(batch[0], e)
+                return
+            # One bad row must not take the rest of the batch down with it
+            for pending in batch:
+                pending._reset()
+                try:
+                    self._write([pending])
+                except Exception as e:
+                    self._drop(pending, e)
+                else:
+                    pending._resolve()
+        else:
+            for pending in batch:
+                pending._resolve()
+
+    @staticmethod
+    def _drop(pending: PendingWrite, error: Exception):
+        """Fails a write that cannot be committed; in `enqueue` mode nobody waits, so it is also counted."""
+        table = getattr(pending.row, "__tablename__", None) or getattr(getattr(pending.row, "table", None),
+                                                                        "name", "statement")
+        WRITE_BEHIND_DROPPED.inc(table=table, error=type(error).__name__)
+        pending._resolve(error)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._stopped.set()
+            else:
+                # Give concurrent writers one interval to join this transaction
+                if self.flush_interval > 0 and not self._stopped.is_set():
+                    self._stopped.wait(self.flush_interval)
+                self._commit(self._drain(item))
+            if self._stopped.is_set():
+                # Flush whatever is still queued before exiting
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        return
+                    if item is not None:
+                        self._commit(self._drain(item))
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """Flushes queued rows and stops the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+_write_queue: Optional[WriteBehindQueue] = None
+
+
+def get_write_queue() -> Optional[WriteBehindQueue]:
+    """Returns the shared write-behind queue, or None when write-behind is disabled."""
+    global _write_queue
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    if _write_queue is None:
+        with _engine_lock:
+            if _write_queue is None:
+                _write_queue = WriteBehindQueue()
+                atexit.register(_write_queue.stop)
+    return _write_queue
+
+
+def flush_pending_writes():
+    """Waits for queued writes to land, e.g. before a bulk delete."""
+    if _write_queue is not None:
+        _write_queue.flush()
+
+
+def execute_write(statement: Executable) -> Any:
+    """Runs an insert or upsert directly or in the next write-behind batch and returns its first column.
+
+    Always waits for the commit, whatever the durability setting, since the caller uses the result.
+    """
+    write_queue = get_write_queue()
+    if write_queue is None:
+        with session_scope() as session:
+            return session.execute(statement).scalar()
+    return write_queue.submit(statement).result()
+
+
+def persist(row) -> Optional[int]:
+    """Inserts a row directly or through the write-behind queue, honouring the durability setting.
+
+    Returns the new primary key, or None when the row was only enqueued.
+    """
+    write_queue = get_write_queue()
+    if write_queue is None:
+        with session_scope() as session:
+            session.add(row)
+            session.flush()
+            return row.id
+    pending = write_queue.submit(row)
+    if WRITE_BEHIND_DURABILITY == "enqueue":
+        return None
+    return pending.result()
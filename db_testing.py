@@ -0,0 +1,33 @@
+"""Shared fixture for tests that need a database of their own."""
+import os
+import tempfile
+import unittest
+
+import chat_core
+import database
+from database import Base, get_engine
+
+
+class TemporaryDatabaseTestCase(unittest.TestCase):
+    """Points the engine at a fresh SQLite file in a temporary directory for each test.
+
+    Set `app_schema` to create the schema through chat_core.initialize_db (migrations, search index, feedback
+    rollups) instead of only the ORM tables.
+    """
+    app_schema = False
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_db_name = database.DB_NAME
+        database.DB_NAME = os.path.join(self.tmp_dir.name, "test.db")
+        database.dispose_engine()
+        chat_core._initialized_db = None
+        if self.app_schema:
+            chat_core.initialize_db()
+        else:
+            Base.metadata.create_all(get_engine())
+
+    def tearDown(self):
+        database.dispose_engine()
+        database.DB_NAME = self.original_db_name
+        self.tmp_dir.cleanup()
@@ -0,0 +1,141 @@
+import argparse
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, Integer, String, func
+from sqlalchemy.engine import Engine
+
+from database import Base, get_engine, session_scope
+from history_archive import archived_records
+
+ROLLUP_TABLE = "feedback_daily"
+
+
+class FeedbackDaily(Base):
+    """Positive and negative feedback per model and day of the rated reply, maintained by triggers."""
+    __tablename__ = ROLLUP_TABLE
+    model_id = Column(String, primary_key=True)
+    day = Column(String, primary_key=True)  # YYYY-MM-DD
+    positive = Column(Integer, default=0)
+    negative = Column(Integer, default=0)
+
+
+# Feedback removed by clearing or archiving keeps its place in the rollups, so there is no delete trigger
+_SCHEMA = [
+    f"""CREATE TRIGGER IF NOT EXISTS feedback_rollup_ai AFTER INSERT ON feedback BEGIN
+        INSERT INTO {ROLLUP_TABLE} (model_id, day, positive, negative)
+        SELECT COALESCE(m.model_id, ''), date(m.timestamp), NEW.is_positive = 1, NEW.is_positive = 0
+        FROM chat_history m WHERE m.id = NEW.chat_message_id
+        ON CONFLICT (model_id, day) DO UPDATE SET positive = positive + excluded.positive,
+                                                  negative = negative + excluded.negative;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS feedback_rollup_au AFTER UPDATE OF is_positive ON feedback
+    WHEN OLD.is_positive IS NOT NEW.is_positive BEGIN
+        UPDATE {ROLLUP_TABLE}
+        SET positive = positive + (NEW.is_positive = 1) - (OLD.is_positive = 1),
+            negative = negative + (NEW.is_positive = 0) - (OLD.is_positive = 0)
+        WHERE (model_id, day) = (SELECT COALESCE(m.model_id, ''), date(m.timestamp)
+                                 FROM chat_history m WHERE m.id = NEW.chat_message_id);
+    END""",
+]
+
+_REBUILD = f"""INSERT INTO {ROLLUP_TABLE} (model_id, day, positive, negative)
+    SELECT COALESCE(m.model_id, ''), date(m.timestamp), SUM(f.is_positive = 1), SUM(f.is_positive = 0)
+    FROM feedback f JOIN chat_history m ON m.id = f.chat_message_id
+    GROUP BY 1, 2"""
+
+_ADD = f"""INSERT INTO {ROLLUP_TABLE} (model_id, day, positive, negative) VALUES (?, ?, ?, ?)
+    ON CONFLICT (model_id, day) DO UPDATE SET positive = positive + excluded.positive,
+                                              negative = negative + excluded.negative"""
+
+
+def ensure_feedback_rollups(engine: Optional[Engine] = None):
+    """Creates the rollup triggers, backfilling the rollups from existing feedback the first time."""
+    engine = engine or get_engine()
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'feedback_rollup_ai'"
+        ).first()
+        for statement in _SCHEMA:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            _rebuild(connection)
+
+
+def _rebuild(connection):
+    """Replaces the rollups with the live feedback plus the feedback kept in the history archives."""
+    archived = [record for record in archived_records() if record["feedback"]]
+    live = set()
+    if archived:
+        # A retention batch whose commit failed is archived again later, so its rows may still be live. Databases
+        # from before ids were AUTOINCREMENT may also hold a different message under an archived id, so a live row
+        # only stands in for an archived one when the message itself matches.
+        newest_id = max(record["id"] for record in archived)
+        live = {tuple(row) for row in connection.exec_driver_sql(
+            "SELECT id, conversation_id, content FROM chat_history WHERE id <= ?", (newest_id,))}
+    counts = defaultdict(lambda: [0, 0])
+    for record in archived:
+        if (record["id"], record["conversation_id"], record["content"]) not in live:
+            key = (record["model_id"] or "", record["timestamp"][:10] if record["timestamp"] else None)
+            for item in record["feedback"]:
+                counts[key][0 if item["is_positive"] else 1] += 1
+
+    connection.exec_driver_sql(f"DELETE FROM {ROLLUP_TABLE}")
+    connection.exec_driver_sql(_REBUILD)
+    if counts:
+        connection.exec_driver_sql(_ADD, [key + tuple(totals) for key, totals in counts.items()])
+
+
+def rebuild_feedback_rollups(engine: Optional[Engine] = None):
+    """Recomputes the rollups from the live feedback table and the feedback in the history archives.
+
+    Feedback on cleared conversations drops out. Raises FileNotFoundError, leaving the rollups untouched, when an
+    archive file recorded in `archive_partitions` is missing.
+    """
+    with (engine or get_engine()).begin() as connection:
+        _rebuild(connection)
+
+
+def feedback_summary(model_id: Optional[str] = None, start: Optional[date] = None,
+                     end: Optional[date] = None) -> List[Dict]:
+    """Per-model positive/negative totals and approval rate, read from the daily rollups only."""
+    with session_scope() as session:
+        query = session.query(FeedbackDaily.model_id, func.sum(FeedbackDaily.positive).label("positive"),
+                              func.sum(FeedbackDaily.negative).label("negative"))
+        if model_id is not None:
+            query = query.filter(FeedbackDaily.model_id == model_id)
+        if start is not None:
+            query = query.filter(FeedbackDaily.day >= start.isoformat())
+        if end is not None:
+            query = query.filter(FeedbackDaily.day <= end.isoformat())
+        rows = query.group_by(FeedbackDaily.model_id).order_by(FeedbackDaily.model_id).all()
+    return [{"model": row.model_id, "positive": row.positive, "negative": row.negative,
+             "approval": row.positive / (row.positive + row.negative) if row.positive + row.negative else None}
+            for row in rows]
+
+
+def feedback_by_day(model_id: str, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict]:
+    with session_scope() as session:
+        query = session.query(FeedbackDaily).filter(FeedbackDaily.model_id == model_id)
+        if start is not None:
+            query = query.filter(FeedbackDaily.day >= start.isoformat())
+        if end is not None:
+            query = query.filter(FeedbackDaily.day <= end.isoformat())
+        rows = query.order_by(FeedbackDaily.day).all()
+    return [{"day": row.day, "positive": row.positive, "negative": row.negative} for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the per-model feedback rollups.")
+    parser.add_argument("command", choices=["rebuild"],
+                        help="rebuild: recompute the rollups from stored and archived feedback")
+    parser.parse_args()
+    Base.metadata.create_all(get_engine())
+    ensure_feedback_rollups()
+    rebuild_feedback_rollups()
+    print("Feedback rollups rebuilt.")
+
+
+if __name__ == "__main__":
+    main()
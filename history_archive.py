@@ -0,0 +1,370 @@
+"""Retention for chat history: old messages and their feedback move to compressed monthly archives.
+
+    python history_archive.py run        # one retention + VACUUM/ANALYZE pass now
+    python history_archive.py compact    # one-off full VACUUM, enabling incremental vacuum on older files
+    python history_archive.py stats
+
+Archives are append-only gzip JSONL files, one per month (`archive/chat_history-2024-08.jsonl.gz`); each
+retention batch appends a gzip member. The `archive_partitions` table records which conversations each file
+holds, so scrolling past the live window reads back only the months it needs.
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, Integer, String, Float, Index, func
+
+from database import Base, ChatMessage, Feedback, get_engine, session_scope
+
+ARCHIVE_DIR = os.getenv("LLAMABOT_ARCHIVE_DIR", "archive")
+# Messages older than this many days are archived (0: no age limit)
+RETENTION_DAYS = float(os.getenv("LLAMABOT_RETENTION_DAYS", "0"))
+# Keep at most this many messages in the database (0: no limit)
+RETENTION_MAX_MESSAGES = int(os.getenv("LLAMABOT_RETENTION_MAX_MESSAGES", "0"))
+# Archive the oldest messages while the database holds more than this many bytes of live pages (0: no limit)
+RETENTION_MAX_BYTES = int(os.getenv("LLAMABOT_RETENTION_MAX_BYTES", "0"))
+ARCHIVE_BATCH_SIZE = 1000
+# Seconds between maintenance runs across all processes (0: never run in the background)
+MAINTENANCE_INTERVAL = float(os.getenv("LLAMABOT_MAINTENANCE_INTERVAL", "3600"))
+# Free pages handed back to the filesystem per run by incremental vacuum
+VACUUM_PAGES = int(os.getenv("LLAMABOT_VACUUM_PAGES", "2000"))
+# Rows sampled per index by ANALYZE, which keeps it cheap on large tables
+ANALYSIS_LIMIT = 1000
+# Parsed monthly archive files kept in memory for scrolling back, least recently used evicted first
+ARCHIVE_CACHE_FILES = int(os.getenv("LLAMABOT_ARCHIVE_CACHE_FILES", "4"))
+
+
+class ArchivePartition(Base):
+    __tablename__ = 'archive_partitions'
+    __table_args__ = (Index('ix_archive_partitions_conversation_newest', 'conversation_id', 'newest_id'),)
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer)
+    month = Column(String)  # YYYY-MM, names the archive file
+    messages = Column(Integer)
+    oldest_id = Column(Integer)
+    newest_id = Column(Integer)
+
+
+class MaintenanceRun(Base):
+    __tablename__ = 'maintenance_runs'
+    id = Column(Integer, primary_key=True)
+    started_at = Column(Float, index=True)
+    finished_at = Column(Float)
+    archived = Column(Integer, default=0)
+    freed_pages = Column(Integer, default=0)
+
+
+def archive_path(month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"chat_history-{month}.jsonl.gz")
+
+
+def _offset_id(session, offset: int) -> Optional[int]:
+    return session.query(ChatMessage.id).order_by(ChatMessage.id).offset(offset).limit(1).scalar()
+
+
+def _live_bytes(session) -> int:
+    page_size, page_count, free_pages = (session.connection().exec_driver_sql(f"PRAGMA {name}").scalar()
+                                         for name in ("page_size", "page_count", "freelist_count"))
+    return (page_count - free_pages) * page_size
+
+
+def archive_cutoff(session, now: Optional[datetime] = None) -> Optional[int]:
+    """Returns the id below which messages are due for archiving under the configured policies, or None."""
+    newest_id = session.query(func.max(ChatMessage.id)).scalar()
+    if newest_id is None:
+        return None
+    cutoffs = []
+    if RETENTION_DAYS > 0:
+        expiry = (now or datetime.now()) - timedelta(days=RETENTION_DAYS)
+        expired = session.query(func.max(ChatMessage.id)).filter(ChatMessage.timestamp < expiry).scalar()
+        if expired is not None:
+            cutoffs.append(expired + 1)
+    if RETENTION_MAX_MESSAGES > 0 or RETENTION_MAX_BYTES > 0:
+        count = session.query(func.count(ChatMessage.id)).scalar()
+        if 0 < RETENTION_MAX_MESSAGES < count:
+            cutoffs.append(_offset_id(session, count - RETENTION_MAX_MESSAGES))
+        live_bytes = _live_bytes(session) if RETENTION_MAX_BYTES > 0 else 0
+        if live_bytes > RETENTION_MAX_BYTES > 0:
+            # Pages are only reclaimed by vacuum, so aim for the share of rows that brings the size under the cap
+            cutoffs.append(_offset_id(session, math.ceil(count * (1 - RETENTION_MAX_BYTES / live_bytes))))
+    cutoffs = [cutoff for cutoff in cutoffs if cutoff is not None]
+    # The newest message always stays live. Ids are never reused in any case: chat_history uses AUTOINCREMENT, so
+    # clearing every live message does not restart them below archived ones
+    return min(max(cutoffs), newest_id) if cutoffs else None
+
+
+def _archive_record(message: ChatMessage, feedback: List[Feedback]) -> Dict:
+    return {"id": message.id, "conversation_id": message.conversation_id, "role": message.role,
+            "content": message.content, "timestamp": message.timestamp.isoformat() if message.timestamp else None,
+            "model_id": message.model_id,
+            "feedback": [{"is_positive": item.is_positive, "comment": item.comment} for item in feedback]}
+
+
+def _append_archive(month: str, records: List[Dict]):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+    with open(archive_path(month), "ab") as archive_file:
+        archive_file.write(gzip.compress(payload))  # a new gzip member; readers see one continuous stream
+        archive_file.flush()
+        os.fsync(archive_file.fileno())
+
+
+def archive_batch(run_id: int, cutoff: int, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Moves up to `batch_size` messages with ids below `cutoff`, and their feedback, into the archive.
+
+    The archive is written before the rows are deleted; if the commit then fails the rows are archived
+    again on the next run and readers drop the duplicates.
+    """
+    with session_scope() as session:
+        # Taking the write lock first keeps concurrent workers from archiving the same rows
+        session.query(MaintenanceRun).filter_by(id=run_id).update({"finished_at": None})
+        messages = session.query(ChatMessage).filter(ChatMessage.id < cutoff).order_by(ChatMessage.id) \
+            .limit(batch_size).all()
+        if not messages:
+            return 0
+        message_ids = [message.id for message in messages]
+        feedback = defaultdict(list)
+        for item in session.query(Feedback).filter(Feedback.chat_message_id.in_(message_ids)):
+            feedback[item.chat_message_id].append(item)
+
+        by_month = defaultdict(list)
+        for message in messages:
+            month = message.timestamp.strftime("%Y-%m") if message.timestamp else "undated"
+            by_month[month].append(message)
+        for month, month_messages in sorted(by_month.items()):
+            _append_archive(month, [_archive_record(message, feedback[message.id]) for message in month_messages])
+            by_conversation = defaultdict(list)
+            for message in month_messages:
+                by_conversation[message.conversation_id].append(message.id)
+            for conversation_id, ids in by_conversation.items():
+                partition = session.query(ArchivePartition).filter_by(conversation_id=conversation_id,
+                                                                      month=month).first()
+                if partition is None:
+                    session.add(ArchivePartition(conversation_id=conversation_id, month=month, messages=len(ids),
+                                                 oldest_id=min(ids), newest_id=max(ids)))
+                else:
+                    partition.messages += len(ids)
+                    partition.oldest_id = min(partition.oldest_id, min(ids))
+                    partition.newest_id = max(partition.newest_id, max(ids))
+
+        session.query(Feedback).filter(Feedback.chat_message_id.in_(message_ids)).delete(synchronize_session=False)
+        session.query(ChatMessage).filter(ChatMessage.id.in_(message_ids)).delete(synchronize_session=False)
+        session.query(MaintenanceRun).filter_by(id=run_id).update(
+            {"archived": MaintenanceRun.archived + len(messages)})
+        return len(messages)
+
+
+def apply_retention(run_id: int, now: Optional[datetime] = None) -> int:
+    """Archives every message due under the retention policies, one batch per transaction."""
+    with session_scope() as session:
+        cutoff = archive_cutoff(session, now)
+    archived = 0
+    while cutoff is not None:
+        moved = archive_batch(run_id, cutoff)
+        if not moved:
+            break
+        archived += moved
+    return archived
+
+
+def vacuum_and_analyze(pages: int = VACUUM_PAGES) -> int:
+    """Returns free pages to the filesystem (incremental vacuum only) and refreshes planner statistics."""
+    with get_engine().connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        freed = 0
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:  # INCREMENTAL
+            before = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+            # The pragma frees one page per step; executescript runs it to completion, execute() would not
+            connection.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            freed = before - connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        connection.exec_driver_sql(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        connection.exec_driver_sql("ANALYZE")
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return freed
+
+
+def run_maintenance(force: bool = False, now: Optional[datetime] = None) -> Optional[Dict]:
+    """Applies retention, then vacuums and analyzes; skipped when any process ran it within the interval."""
+    started = time.time()
+    with session_scope() as session:
+        last_run = session.query(func.max(MaintenanceRun.started_at)).scalar()
+        if not force and last_run is not None and started - last_run < MAINTENANCE_INTERVAL:
+            return None
+        run = MaintenanceRun(started_at=started, archived=0, freed_pages=0)
+        session.add(run)
+        session.flush()
+        run_id = run.id
+    archived = apply_retention(run_id, now)
+    freed_pages = vacuum_and_analyze()
+    with session_scope() as session:
+        session.query(MaintenanceRun).filter_by(id=run_id).update(
+            {"finished_at": time.time(), "freed_pages": freed_pages})
+    return {"archived": archived, "freed_pages": freed_pages, "seconds": time.time() - started}
+
+
+def enable_incremental_vacuum():
+    """Switches an existing database to incremental auto-vacuum; rewrites the whole file once (full VACUUM)."""
+    with get_engine().connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+
+
+_maintenance_thread: Optional[threading.Thread] = None
+_maintenance_stop = threading.Event()
+_maintenance_lock = threading.Lock()
+
+
+def _maintenance_loop(interval: float):
+    # The first run waits one interval too, so startup never pays for it
+    while not _maintenance_stop.wait(interval):
+        try:
+            run_maintenance()
+        except Exception:
+            pass  # a busy or locked database is retried on the next tick
+
+
+def start_maintenance(interval: float = MAINTENANCE_INTERVAL):
+    """Runs maintenance on a daemon thread, once per process; does nothing when `interval` is 0."""
+    global _maintenance_thread
+    if interval <= 0:
+        return
+    with _maintenance_lock:
+        if _maintenance_thread is None or not _maintenance_thread.is_alive():
+            _maintenance_stop.clear()
+            _maintenance_thread = threading.Thread(target=_maintenance_loop, args=(interval,), daemon=True)
+            _maintenance_thread.start()
+
+
+def stop_maintenance():
+    _maintenance_stop.set()
+
+
+_archive_cache: "OrderedDict[str, Tuple[int, Dict[int, List[Dict]]]]" = OrderedDict()
+_archive_cache_lock = threading.Lock()
+
+
+def _parse_archive(path: str) -> Dict[int, List[Dict]]:
+    """A monthly file's messages by conversation, each in id order and without duplicates."""
+    conversations: Dict[int, Dict[int, Dict]] = defaultdict(dict)
+    with gzip.open(path, "rt", encoding="utf-8") as archive_file:
+        for line in archive_file:
+            record = json.loads(line)
+            conversations[record["conversation_id"]][record["id"]] = record
+    return {conversation_id: [messages[message_id] for message_id in sorted(messages)]
+            for conversation_id, messages in conversations.items()}
+
+
+def _read_archive(path: str, conversation_id: int) -> List[Dict]:
+    """One conversation's archived messages from a monthly file.
+
+    Each file is parsed once per mtime and kept in a least-recently-used cache of ARCHIVE_CACHE_FILES files.
+    """
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+    with _archive_cache_lock:
+        entry = _archive_cache.get(path)
+        if entry is not None and entry[0] == mtime:
+            _archive_cache.move_to_end(path)
+            return entry[1].get(conversation_id, [])
+    conversations = _parse_archive(path)
+    with _archive_cache_lock:
+        _archive_cache[path] = (mtime, conversations)
+        _archive_cache.move_to_end(path)
+        while len(_archive_cache) > max(ARCHIVE_CACHE_FILES, 0):
+            _archive_cache.popitem(last=False)
+    return conversations.get(conversation_id, [])
+
+
+def _history_entry(record: Dict) -> Dict:
+    return {"id": record["id"], "role": record["role"], "content": record["content"],
+            "timestamp": record["timestamp"], "model_id": record["model_id"], "archived": True}
+
+
+def load_archived_page(conversation_id: int, before_id: Optional[int] = None,
+                       limit: int = ARCHIVE_BATCH_SIZE) -> Tuple[List[Dict], bool]:
+    """The archived messages of a conversation preceding `before_id`, like load_chat_history_page.
+
+    Only the monthly files that hold this conversation are opened, newest first, until the page is full.
+    """
+    with session_scope() as session:
+        query = session.query(ArchivePartition.month).filter(ArchivePartition.conversation_id == conversation_id)
+        if before_id is not None:
+            query = query.filter(ArchivePartition.oldest_id < before_id)
+        months = [row.month for row in query.order_by(ArchivePartition.newest_id.desc())]
+    if limit <= 0:
+        return [], bool(months)
+
+    collected: List[Dict] = []
+    for read, month in enumerate(months, 1):
+        path = archive_path(month)
+        if not os.path.exists(path):
+            continue
+        records = [record for record in _read_archive(path, conversation_id)
+                   if before_id is None or record["id"] < before_id]
+        collected[:0] = records
+        if len(collected) >= limit:
+            return [_history_entry(record) for record in collected[-limit:]], \
+                len(collected) > limit or read < len(months)
+    return [_history_entry(record) for record in collected], False
+
+
+def archived_records() -> Iterator[Dict]:
+    """Every archived message of the conversations that have not been cleared, once per month file.
+
+    Raises FileNotFoundError when a file recorded in `archive_partitions` is missing.
+    """
+    by_month = defaultdict(set)
+    with session_scope() as session:
+        for row in session.query(ArchivePartition.month, ArchivePartition.conversation_id):
+            by_month[row.month].add(row.conversation_id)
+    for month, conversation_ids in sorted(by_month.items()):
+        conversations = _parse_archive(archive_path(month))
+        for conversation_id in sorted(conversation_ids):
+            yield from conversations.get(conversation_id, [])
+
+
+def forget_conversation(conversation_id: int):
+    """Hides a cleared conversation's archived messages; the append-only files themselves are kept."""
+    with session_scope() as session:
+        session.query(ArchivePartition).filter_by(conversation_id=conversation_id).delete(synchronize_session=False)
+
+
+def archive_stats() -> Dict:
+    with session_scope() as session:
+        archived = session.query(func.coalesce(func.sum(ArchivePartition.messages), 0)).scalar()
+        live = session.query(func.count(ChatMessage.id)).scalar()
+        live_bytes = _live_bytes(session)
+        last_run = session.query(MaintenanceRun).order_by(MaintenanceRun.id.desc()).first()
+        last = {"started_at": last_run.started_at, "archived": last_run.archived,
+                "freed_pages": last_run.freed_pages} if last_run else None
+    files = sorted(name for name in os.listdir(ARCHIVE_DIR)) if os.path.isdir(ARCHIVE_DIR) else []
+    return {"live_messages": live, "live_bytes": live_bytes, "archived_messages": archived,
+            "archive_files": len(files),
+            "archive_bytes": sum(os.path.getsize(os.path.join(ARCHIVE_DIR, name)) for name in files),
+            "last_run": last}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["run", "compact", "stats"])
+    args = parser.parse_args()
+    Base.metadata.create_all(get_engine())
+    if args.command == "run":
+        print(json.dumps(run_maintenance(force=True)))
+    elif args.command == "compact":
+        enable_incremental_vacuum()
+        print(json.dumps(archive_stats()))
+    else:
+        print(json.dumps(archive_stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
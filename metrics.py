@@ -0,0 +1,221 @@
+"""In-process counters and histograms with a Prometheus text exposition.
+
+Every Groq call is timed by the request scheduler and every SQL statement by a database engine hook. Each
+process (Streamlit, or each API worker) exports its own series; the per-turn `request_metrics` table in
+metrics_store.py is the cross-process record used by the dashboard.
+"""
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Serve /metrics from the Streamlit process on this port (unset: no exporter)
+METRICS_PORT = int(os.getenv("LLAMABOT_METRICS_PORT", "0"))
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+EXPOSITION_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_label_text(self.labels, key)} {value:g}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return int(series[-1]) if series else 0
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = self._header()
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = _label_text(self.labels, key, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative:g}")
+            lines.append(f"{self.name}_bucket{_label_text(self.labels, key, INF_LABEL)} {values[-1]:g}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {values[-1]:g}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def exposition(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.expose()) + "\n"
+
+
+REGISTRY = Registry()
+
+GROQ_REQUEST_SECONDS = REGISTRY.histogram("llamabot_groq_request_duration_seconds",
+                                          "Duration of each Groq API attempt.", ("model", "operation"))
+GROQ_ERRORS = REGISTRY.counter("llamabot_groq_errors_total", "Failed Groq API attempts by exception class.",
+                               ("model", "operation", "error"))
+GROQ_TOKENS = REGISTRY.counter("llamabot_groq_tokens_total", "Tokens reported by the Groq API.",
+                               ("model", "kind"))
+CHAT_TURN_SECONDS = REGISTRY.histogram("llamabot_chat_turn_duration_seconds",
+                                       "End-to-end time to produce a chat reply.", ("model", "cache_hit"))
+CHAT_TURNS = REGISTRY.counter("llamabot_chat_turns_total", "Chat replies by outcome.", ("model", "outcome"))
+DB_STATEMENT_SECONDS = REGISTRY.histogram("llamabot_db_statement_duration_seconds",
+                                          "Duration of each SQL statement.", ("statement",))
+DB_TRANSACTION_SECONDS = REGISTRY.histogram("llamabot_db_transaction_duration_seconds",
+                                            "Duration of each database session, commit included.")
+SINGLE_FLIGHT_CALLS = REGISTRY.counter("llamabot_single_flight_calls_total",
+                                      "Groq requests that made the call (leader), shared an identical in-flight "
+                                      "call (coalesced) or gave up waiting for it (timed_out).",
+                                      ("operation", "role"))
+ROUTER_ATTEMPTS = REGISTRY.counter("llamabot_router_attempts_total",
+                                  "Requests the auto model sent, by model and why: first choice (primary), after "
+                                  "a failure (failover) or racing a slow request (hedge).", ("model", "reason"))
+WRITE_BEHIND_DROPPED = REGISTRY.counter("llamabot_write_behind_dropped_total",
+                                       "Queued writes that failed on their own and were not committed.",
+                                       ("table", "error"))
+DB_ERRORS = REGISTRY.counter("llamabot_db_errors_total", "Failed database sessions by exception class.",
+                             ("error",))
+
+
+@contextmanager
+def span(histogram: Histogram, errors: Optional[Counter] = None, **labels) -> Iterator[None]:
+    """Times the block into `histogram`; a failure is also counted in `errors`, labelled with its class."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if errors is not None:
+            errors.inc(error=type(e).__name__, **labels)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def statement_kind(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+class _ExporterHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", EXPOSITION_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_exporter: Optional[ThreadingHTTPServer] = None
+_exporter_lock = threading.Lock()
+
+
+def start_exporter(port: int = METRICS_PORT, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """Serves /metrics on a daemon thread, once per process; does nothing when `port` is 0."""
+    global _exporter
+    if not port:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = ThreadingHTTPServer((host, port), _ExporterHandler)
+            _exporter.daemon_threads = True
+            threading.Thread(target=_exporter.serve_forever, daemon=True).start()
+    return _exporter
@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, Integer, String, Float, Boolean, Index
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import Base, session_scope, persist
+from metrics import CHAT_TURN_SECONDS, CHAT_TURNS, GROQ_TOKENS, percentile
+
+# Set LLAMABOT_REQUEST_METRICS=0 to stop writing one row per chat turn
+REQUEST_METRICS_ENABLED = os.getenv("LLAMABOT_REQUEST_METRICS", "1") == "1"
+# The dashboard summarizes this many hours of turns
+METRICS_WINDOW_HOURS = float(os.getenv("LLAMABOT_METRICS_WINDOW_HOURS", "24"))
+# model_health() weighs recent turns more: a turn counts half as much after this many seconds
+HEALTH_HALF_LIFE = float(os.getenv("LLAMABOT_HEALTH_HALF_LIFE", "600"))
+# Turns older than this many half-lives weigh under 0.1% and are not loaded
+HEALTH_HALF_LIVES_LOADED = 10
+# Turns the reader ended (a closed stream, a cancelled request) say nothing about the model
+READER_STOPS = {"GeneratorExit", "CancelledError", "KeyboardInterrupt", "SystemExit"}
+
+
+class RequestMetric(Base):
+    __tablename__ = 'request_metrics'
+    id = Column(Integer, primary_key=True)
+    created_at = Column(Float, index=True)  # epoch seconds
+    model_id = Column(String)
+    streamed = Column(Boolean)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    latency = Column(Float)  # seconds until the whole reply was received
+    ttft = Column(Float)
+    cache_hit = Column(Boolean)
+    error_class = Column(String)  # None for successful turns
+
+    __table_args__ = (Index('ix_request_metrics_model_created', 'model_id', 'created_at'),)
+
+
+def _token_count(usage, name: str) -> Optional[int]:
+    count = getattr(usage, name, None)
+    return count if isinstance(count, int) else None
+
+
+class _DecayedHealth:
+    """Exponentially decayed turn count, error count and latency sum of one model."""
+
+    def __init__(self, now: float):
+        self.updated = now
+        self.turns = self.errors = self.latency_turns = self.latency_sum = 0.0
+
+    def decay(self, now: float):
+        if now > self.updated:
+            factor = 0.5 ** ((now - self.updated) / HEALTH_HALF_LIFE)
+            self.turns *= factor
+            self.errors *= factor
+            self.latency_turns *= factor
+            self.latency_sum *= factor
+            self.updated = now
+
+    def add(self, at: float, latency: float, failed: bool):
+        self.decay(at)
+        weight = 0.5 ** ((self.updated - at) / HEALTH_HALF_LIFE)  # below 1 only for turns loaded out of order
+        self.turns += weight
+        if failed:
+            self.errors += weight
+        else:
+            self.latency_turns += weight
+            self.latency_sum += weight * latency
+
+
+_health: Dict[str, _DecayedHealth] = {}
+_health_lock = threading.Lock()
+_health_loaded = False
+
+
+def _add_health(model: str, at: float, latency: float, error_class: Optional[str]):
+    if error_class in READER_STOPS:
+        return
+    if model not in _health:
+        _health[model] = _DecayedHealth(at)
+    _health[model].add(at, latency, error_class is not None)
+
+
+def _load_health():
+    """Seeds the in-process health from the stored turns, once, so a restart does not forget slow models."""
+    global _health_loaded
+    if _health_loaded:
+        return
+    _health_loaded = True
+    if not REQUEST_METRICS_ENABLED:
+        return
+    since = time.time() - HEALTH_HALF_LIFE * HEALTH_HALF_LIVES_LOADED
+    try:
+        with session_scope() as session:
+            rows = session.query(RequestMetric.created_at, RequestMetric.model_id, RequestMetric.latency,
+                                 RequestMetric.error_class).filter(RequestMetric.created_at >= since,
+                                                                   RequestMetric.cache_hit.is_(False)
+                                                                   ).order_by(RequestMetric.created_at).all()
+    except SQLAlchemyError:
+        return
+    for row in rows:
+        _add_health(row.model_id, row.created_at, row.latency or 0.0, row.error_class)
+
+
+def model_health() -> Dict[str, Dict]:
+    """Per-model decayed `turns`, `error_rate` and mean `latency` in seconds (None without a successful turn).
+
+    Every turn counts, weighted by 0.5 ** (age / HEALTH_HALF_LIFE); cache hits, shared replies and turns the
+    reader stopped are left out.
+    """
+    now = time.time()
+    with _health_lock:
+        _load_health()
+        health = {}
+        for model, stats in _health.items():
+            stats.decay(now)
+            health[model] = {
+                "turns": stats.turns,
+                "error_rate": stats.errors / stats.turns if stats.turns else 0.0,
+                "latency": stats.latency_sum / stats.latency_turns if stats.latency_turns else None,
+                "latency_turns": stats.latency_turns,
+            }
+        return health
+
+
+def record_turn(model: str, timings: Dict, usage=None, error: Optional[BaseException] = None,
+                streamed: bool = False):
+    """Counts one chat turn in the process metrics and stores it in `request_metrics`.
+
+    `usage` is the API's usage object (absent for cache hits and failures). A failed metrics write never
+    fails the turn itself.
+    """
+    cache_hit = bool(timings.get("cache_hit"))
+    latency = timings.get("total_time", 0.0)
+    error_class = type(error).__name__ if error is not None else None
+    CHAT_TURN_SECONDS.observe(latency, model=model, cache_hit=str(cache_hit).lower())
+    CHAT_TURNS.inc(model=model, outcome="error" if error_class else "cache_hit" if cache_hit else "ok")
+    if not cache_hit and not timings.get("coalesced"):
+        with _health_lock:
+            _load_health()
+            _add_health(model, time.time(), latency, error_class)
+    if streamed:
+        # The scheduler counts tokens of whole responses; streams report usage on their last chunk
+        for kind in ("prompt", "completion"):
+            count = _token_count(usage, f"{kind}_tokens")
+            if count is not None:
+                GROQ_TOKENS.inc(count, model=model, kind=kind)
+    if not REQUEST_METRICS_ENABLED:
+        return
+    try:
+        persist(RequestMetric(created_at=time.time(), model_id=model, streamed=streamed,
+                              prompt_tokens=_token_count(usage, "prompt_tokens"),
+                              completion_tokens=_token_count(usage, "completion_tokens"), latency=latency,
+                              ttft=timings.get("ttft"), cache_hit=cache_hit, error_class=error_class))
+    except SQLAlchemyError:
+        pass  # already counted in llamabot_db_errors_total
+
+
+def latency_by_model(since: Optional[float] = None) -> List[Dict]:
+    """Per-model turn counts, error and cache-hit rates, token totals and p50/p95/p99 latency.
+
+    `since` is an epoch timestamp; it defaults to the last METRICS_WINDOW_HOURS hours.
+    """
+    since = time.time() - METRICS_WINDOW_HOURS * 3600 if since is None else since
+    with session_scope() as session:
+        rows = session.query(RequestMetric.model_id, RequestMetric.latency, RequestMetric.ttft,
+                             RequestMetric.cache_hit, RequestMetric.error_class, RequestMetric.prompt_tokens,
+                             RequestMetric.completion_tokens).filter(RequestMetric.created_at >= since).all()
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row.model_id].append(row)
+
+    summary = []
+    for model, turns in sorted(grouped.items()):
+        # Errors and cache hits would skew the latency of real completions
+        latencies = [turn.latency for turn in turns if not turn.error_class and not turn.cache_hit]
+        ttfts = [turn.ttft for turn in turns if turn.ttft is not None and not turn.error_class and not turn.cache_hit]
+        summary.append({
+            "model": model,
+            "turns": len(turns),
+            "error_rate": sum(1 for turn in turns if turn.error_class) / len(turns),
+            "cache_hit_rate": sum(1 for turn in turns if turn.cache_hit) / len(turns),
+            "prompt_tokens": sum(turn.prompt_tokens or 0 for turn in turns),
+            "completion_tokens": sum(turn.completion_tokens or 0 for turn in turns),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "ttft_p50": percentile(ttfts, 50),
+        })
+    return summary
@@ -0,0 +1,174 @@
+"""Local stand-in for Groq's OpenAI-compatible endpoints, for benchmarks and offline development.
+
+    python mock_groq_server.py --port 8099 --latency 0.2 --tokens-per-second 400
+
+Point a client at it with `Groq(base_url="http://127.0.0.1:8099", api_key="mock")`. Replies echo the last user
+message padded to `--completion-tokens` tokens; `latency` delays the first byte and `tokens_per_second` paces
+the rest, for both streaming and non-streaming completions.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+MOCK_MODELS = ["llama3-8b-8192", "llama3-70b-8192", "llama-3.1-8b-instant", "whisper-large-v3"]
+
+
+class MockGroqConfig:
+    def __init__(self, latency: float = 0.0, tokens_per_second: float = 0.0, completion_tokens: int = 32,
+                 models: Optional[List[str]] = None):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second  # 0 sends every token at once
+        self.completion_tokens = completion_tokens
+        self.models = models or MOCK_MODELS
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    config: MockGroqConfig
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("x-ratelimit-remaining-requests", "1000")
+        self.send_header("x-ratelimit-remaining-tokens", "1000000")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        self.config.count()
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json({"object": "list", "data": [{"id": model, "object": "model", "owned_by": "mock"}
+                                                        for model in self.config.models]})
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def do_POST(self):
+        self.config.count()
+        body = self._read_body()
+        if self.path.endswith("/chat/completions"):
+            self._chat(json.loads(body))
+        elif self.path.endswith("/audio/transcriptions"):
+            time.sleep(self.config.latency)
+            self._send_json({"text": f"Transcribed {len(body)} bytes."})
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def _tokens(self, messages: List[Dict]) -> List[str]:
+        last = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        words = (last.split() or ["ok"]) * self.config.completion_tokens
+        return [word + " " for word in words[:self.config.completion_tokens]]
+
+    def _pace(self):
+        if self.config.tokens_per_second > 0:
+            time.sleep(1 / self.config.tokens_per_second)
+
+    def _chat(self, request: Dict):
+        model = request.get("model", self.config.models[0])
+        tokens = self._tokens(request.get("messages", []))
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 4 for m in request.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        time.sleep(self.config.latency)
+
+        if not request.get("stream"):
+            for _ in tokens:
+                self._pace()
+            self._send_json({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(payload):
+            data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for token in tokens:
+            send_event({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+            self._pace()
+        send_event({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}})
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class MockGroqServer:
+    """Runs the mock on a background thread; use as a context manager or call start()/stop()."""
+
+    def __init__(self, config: Optional[MockGroqConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockGroqConfig()
+        handler = type("Handler", (_Handler,), {"config": self.config})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockGroqServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockGroqServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first byte")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 for no pacing")
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    args = parser.parse_args()
+    config = MockGroqConfig(args.latency, args.tokens_per_second, args.completion_tokens)
+    with MockGroqServer(config, args.host, args.port) as server:
+        print(f"Mock Groq API on {server.base_url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
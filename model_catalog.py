@@ -0,0 +1,158 @@
+"""Stale-while-revalidate catalog of the Groq models, shared by every process on the host.
+
+The catalog lives in a JSON file. Readers always get the stored copy at once. When it is older than the TTL
+one background thread per host (serialized by an exclusive lock on a sidecar file) fetches a new list, and a
+failed fetch keeps the last good copy. Only a process that finds no catalog at all waits for the API, and it
+falls back to the models listed in models_info.md if the API is unreachable.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: refreshes are only serialized within a process
+    fcntl = None
+
+CATALOG_PATH = os.getenv("LLAMABOT_MODEL_CATALOG", "model_catalog.json")
+CATALOG_TTL = float(os.getenv("LLAMABOT_MODEL_CATALOG_TTL", "300"))
+# After a failed refresh, wait this long before trying again rather than a full TTL
+CATALOG_RETRY_SECONDS = 30.0
+
+
+def _read_catalog(path: str) -> Optional[Dict]:
+    # Not cached by mtime: two refreshes can land within one filesystem timestamp tick
+    try:
+        with open(path) as catalog_file:
+            return json.load(catalog_file)
+    except (FileNotFoundError, ValueError):
+        return None  # a corrupt file is replaced by the next refresh
+
+
+def _write_catalog(path: str, entry: Dict):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Written to a temporary file and renamed, so readers never see a partial catalog
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix=".model_catalog.")
+    try:
+        with os.fdopen(handle, "w") as temp_file:
+            json.dump(entry, temp_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def merge_descriptions(models: List[Dict], descriptions: Dict[str, str]) -> List[Dict]:
+    return [{**model, "description": descriptions.get(model["id"], "")} for model in models]
+
+
+class ModelCatalog:
+    def __init__(self, fetch: Callable[[], List[Dict]], descriptions: Callable[[], Dict[str, str]],
+                 path: Optional[str] = None, ttl: Optional[float] = None):
+        self._fetch = fetch
+        self._descriptions = descriptions
+        self._path = path
+        self._ttl = ttl
+        self._refreshing = threading.Lock()
+        # (time, error) of a failed first fetch, while there is nothing stored to fall back on
+        self._cold_failure: Optional[tuple] = None
+
+    @property
+    def path(self) -> str:
+        return self._path or CATALOG_PATH
+
+    @property
+    def ttl(self) -> float:
+        return CATALOG_TTL if self._ttl is None else self._ttl
+
+    def _read(self) -> Optional[Dict]:
+        entry = _read_catalog(self.path)
+        return entry if entry and entry.get("models") else None
+
+    def _is_stale(self, entry: Dict) -> bool:
+        return time.time() - entry["checked_at"] > self.ttl
+
+    @contextmanager
+    def _host_lock(self, blocking: bool) -> Iterator[bool]:
+        """Yields whether this process now holds the refresh lock shared by every process on the host."""
+        if not self._refreshing.acquire(blocking=blocking):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            with open(self.path + ".lock", "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            self._refreshing.release()
+
+    def refresh(self, blocking: bool = True) -> Optional[Dict]:
+        """Fetches the model list unless another process refreshed it meanwhile; returns the stored entry.
+
+        Returns None when the lock is busy (non-blocking) or when the fetch failed and nothing is stored.
+        """
+        with self._host_lock(blocking) as locked:
+            if not locked:
+                return None
+            entry = self._read()
+            if entry is not None and not self._is_stale(entry):
+                return entry
+            now = time.time()
+            try:
+                models = merge_descriptions(self._fetch(), self._descriptions())
+            except Exception as e:
+                if entry is None:
+                    self._cold_failure = (now, f"{type(e).__name__}: {e}")
+                    return None
+                # Keep serving the last good copy and try again a little later
+                entry = {**entry, "checked_at": now - self.ttl + CATALOG_RETRY_SECONDS,
+                         "last_error": f"{type(e).__name__}: {e}"}
+            else:
+                entry = {"models": models, "fetched_at": now, "checked_at": now, "last_error": None}
+            _write_catalog(self.path, entry)
+            return entry
+
+    def _refresh_in_background(self):
+        if self._refreshing.locked():
+            return
+        threading.Thread(target=self.refresh, kwargs={"blocking": False}, daemon=True).start()
+
+    def _bundled_models(self) -> List[Dict]:
+        descriptions = self._descriptions()
+        return [{"name": model_id, "id": model_id, "info": "", "description": description}
+                for model_id, description in descriptions.items()]
+
+    def models(self) -> List[Dict]:
+        """The stored catalog, refreshed in the background once stale; never raises for network errors."""
+        entry = self._read()
+        if entry is None:
+            if self._cold_failure and time.time() - self._cold_failure[0] < CATALOG_RETRY_SECONDS:
+                return self._bundled_models()
+            entry = self.refresh()
+            if entry is None:
+                return self._bundled_models()
+        elif self._is_stale(entry):
+            self._refresh_in_background()
+        return entry["models"]
+
+    def status(self) -> Dict:
+        """When the stored catalog was fetched, whether it is stale and the last refresh error, if any."""
+        entry = self._read()
+        if entry is None:
+            error = self._cold_failure[1] if self._cold_failure else "No model list has been fetched yet."
+            return {"fetched_at": None, "stale": True, "last_error": error}
+        return {"fetched_at": entry["fetched_at"], "stale": self._is_stale(entry), "last_error": entry["last_error"]}
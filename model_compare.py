@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Callable, List, Dict
+
+from groq import AsyncGroq
+
+from chat_core import create_async_groq_client, resolve_api_key
+from context_window import estimate_prompt_tokens
+from metrics_store import record_turn
+from request_scheduler import get_scheduler
+
+COMPARE_MAX_CONCURRENCY = int(os.getenv("LLAMABOT_COMPARE_MAX_CONCURRENCY", "4"))
+COMPARE_TIMEOUT = float(os.getenv("LLAMABOT_COMPARE_TIMEOUT", "60"))
+
+
+async def _fetch_one(client: AsyncGroq, history: List[Dict[str, str]], model_id: str,
+                     semaphore: asyncio.Semaphore, timeout: float) -> Dict:
+    queued_at = time.perf_counter()
+    async with semaphore:
+        start = time.perf_counter()
+        result = {"model_id": model_id, "content": None, "error": None, "queue_time": start - queued_at}
+        usage = error = None
+        try:
+            response = await asyncio.wait_for(
+                get_scheduler().acall(
+                    lambda: client.chat.completions.create(model=model_id, messages=history),
+                    model_id, estimate_prompt_tokens(history), max_wait=timeout
+                ),
+                timeout
+            )
+            result["content"] = response.choices[0].message.content
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                result["prompt_tokens"] = usage.prompt_tokens
+                result["completion_tokens"] = usage.completion_tokens
+        except asyncio.TimeoutError as e:
+            error = e
+            result["error"] = f"Timed out after {timeout:.0f}s"
+        except Exception as e:
+            error = e
+            result["error"] = str(e)
+        except BaseException as e:
+            error = e  # cancelled when the comparison is abandoned
+            raise
+        finally:
+            result["total_time"] = time.perf_counter() - start
+            # Each compared model is a real chat turn for the metrics and the router's model health
+            await asyncio.to_thread(record_turn, model_id, {"total_time": result["total_time"],
+                                                            "ttft": result["total_time"]}, usage, error)
+        return result
+
+
+async def fan_out(client: AsyncGroq, history: List[Dict[str, str]], model_ids: List[str],
+                  max_concurrency: int = COMPARE_MAX_CONCURRENCY,
+                  timeout: float = COMPARE_TIMEOUT) -> AsyncIterator[Dict]:
+    """Sends the same history to every model concurrently and yields each result as soon as it finishes.
+
+    Each result holds `model_id`, `content` (None on failure), `error`, `total_time` (request latency) and
+    `queue_time` (time spent waiting for a concurrency slot).
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = [asyncio.ensure_future(_fetch_one(client, history, model_id, semaphore, timeout))
+             for model_id in model_ids]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _default_client() -> AsyncGroq:
+    return create_async_groq_client(resolve_api_key())
+
+
+def compare_models(history: List[Dict[str, str]], model_ids: List[str], on_result: Callable[[Dict], None],
+                   client_factory: Callable[[], AsyncGroq] = _default_client,
+                   max_concurrency: int = COMPARE_MAX_CONCURRENCY,
+                   timeout: float = COMPARE_TIMEOUT) -> List[Dict]:
+    """Synchronous entry point: runs the fan-out on a fresh event loop, calling `on_result` per finished model."""
+
+    async def run() -> List[Dict]:
+        client = client_factory()
+        results = []
+        try:
+            async for result in fan_out(client, history, model_ids, max_concurrency, timeout):
+                on_result(result)
+                results.append(result)
+        finally:
+            await client.close()
+        return results
+
+    return asyncio.run(run())
+
@@ -0,0 +1,313 @@
+"""The "auto" model: each chat turn is routed to a concrete model, with fail-over and hedging.
+
+Candidates are ordered by the operator's policy, LLAMABOT_ROUTER_POLICY: `fastest` (lowest expected latency,
+counting retries after errors), `cheapest` (fewest parameters) or a comma-separated list of model ids in order of
+preference. Latency and error rates come from metrics_store.model_health(), so they follow recent turns and
+recover as old failures decay. Models the prompt does not fit and models failing more than ROUTER_MAX_ERROR_RATE
+of the time are tried last.
+
+A request that fails is retried on the next candidate. One with no reply (or, streaming, no first token)
+ROUTER_HEDGE_AFTER seconds after the last start is raced against the next candidate, and the first to answer is
+used. The model that served the reply is stored in `timings["model_id"]`.
+"""
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from groq import AsyncGroq, Groq
+
+import chat_core
+from chat_core import get_groq_models
+from context_window import estimate_prompt_tokens, get_prompt_budget, message_tokens
+from metrics import ROUTER_ATTEMPTS
+from metrics_store import model_health
+
+AUTO_MODEL_ID = "auto"
+# `fastest`, `cheapest`, or model ids in order of preference, e.g. "llama-3.1-70b-versatile,llama3-70b-8192"
+ROUTER_POLICY = os.getenv("LLAMABOT_ROUTER_POLICY", "fastest")
+# Seconds without a reply (or first token) before the next candidate is raced against it; 0 only fails over
+ROUTER_HEDGE_AFTER = float(os.getenv("LLAMABOT_ROUTER_HEDGE_AFTER", "5"))
+# Most models one turn is sent to
+ROUTER_MAX_ATTEMPTS = int(os.getenv("LLAMABOT_ROUTER_MAX_ATTEMPTS", "3"))
+ROUTER_MAX_ERROR_RATE = 0.5
+
+# Models without recent turns are assumed this fast, as if seen once, so new and recovered models get tried
+PRIOR_LATENCY = 2.0
+PRIOR_TURNS = 1.0
+# Catalog entries that do not chat
+NON_CHAT_MODELS = re.compile(r"whisper|guard", re.IGNORECASE)
+# "8b", "70b", "8x7b": billions of parameters in a model id
+MODEL_SIZE = re.compile(r"(?:(\d+)x)?(\d+(?:\.\d+)?)b(?![a-z])", re.IGNORECASE)
+
+AUTO_MODEL = {
+    "name": "Auto",
+    "id": AUTO_MODEL_ID,
+    "description": f"Sends each message to the best available model by the `{ROUTER_POLICY}` policy and falls "
+                   f"back to the next one when it is slow or fails."
+}
+
+_END = object()
+
+
+def model_size(model_id: str) -> float:
+    """Billions of parameters named in the model id, the router's stand-in for price; inf when it names none."""
+    match = MODEL_SIZE.search(model_id)
+    if match is None:
+        return float("inf")
+    return float(match.group(2)) * int(match.group(1) or 1)
+
+
+def _expected_latency(health: Optional[Dict]) -> float:
+    if not health:
+        return PRIOR_LATENCY
+    latency = (health["latency"] or 0.0) * health["latency_turns"]
+    latency = (latency + PRIOR_LATENCY * PRIOR_TURNS) / (health["latency_turns"] + PRIOR_TURNS)
+    # A failed request costs another one
+    return latency / (1 - min(_error_rate(health), 0.9))
+
+
+def _error_rate(health: Optional[Dict]) -> float:
+    return health["error_rate"] * health["turns"] / (health["turns"] + PRIOR_TURNS) if health else 0.0
+
+
+def rank_models(model_ids: List[str], prompt_tokens: int = 0, policy: Optional[str] = None,
+                health: Optional[Dict[str, Dict]] = None) -> List[str]:
+    """Orders `model_ids` by `policy` (ROUTER_POLICY by default), then moves models that the prompt does not fit
+    or that fail too often to the end."""
+    policy = (policy or ROUTER_POLICY).strip()
+    health = model_health() if health is None else health
+    if policy == "cheapest":
+        ranked = sorted(model_ids, key=lambda model_id: (model_size(model_id),
+                                                         _expected_latency(health.get(model_id))))
+    elif policy == "fastest":
+        ranked = sorted(model_ids, key=lambda model_id: _expected_latency(health.get(model_id)))
+    else:
+        preferred = [model_id.strip() for model_id in policy.split(",")]
+        ranked = [model_id for model_id in preferred if model_id in model_ids]
+        if not ranked:
+            # None of the preferred models is available
+            return rank_models(model_ids, prompt_tokens, "fastest", health)
+    return sorted(ranked, key=lambda model_id: (prompt_tokens > get_prompt_budget(model_id),
+                                                _error_rate(health.get(model_id)) > ROUTER_MAX_ERROR_RATE))
+
+
+def route(prompt_tokens: int = 0) -> List[str]:
+    """The models to try for a prompt of `prompt_tokens`, best first; raises ValueError when none is known."""
+    model_ids = [model["id"] for model in get_groq_models() if not NON_CHAT_MODELS.search(model["id"])]
+    if not model_ids:
+        raise ValueError("No chat model is available to route the request to.")
+    return rank_models(model_ids, prompt_tokens)[:max(1, ROUTER_MAX_ATTEMPTS)]
+
+
+def context_model(model_id: str, history: List[Dict]) -> str:
+    """The model whose prompt budget a request for `model_id` is built for.
+
+    For the auto model this is the tightest budget among the candidates, so whichever serves the turn fits it.
+    """
+    if model_id != AUTO_MODEL_ID:
+        return model_id
+    candidates = route(sum(message_tokens(message) for message in history))
+    return min(candidates, key=get_prompt_budget)
+
+
+def _served(timings: Dict, model_id: str, attempt_timings: Dict, attempts: int):
+    for name in ("cache_hit", "coalesced"):
+        if name in attempt_timings:
+            timings[name] = attempt_timings[name]
+    timings["model_id"] = model_id
+    timings["attempts"] = attempts
+
+
+def _race(model_ids: List[str], attempt: Callable[[str, Dict], Callable[[], Any]], hedge_after: float,
+          abandon: Optional[Callable[[str], None]] = None) -> Tuple[str, Any, Dict, int]:
+    """Returns (model_id, result, timings, attempts) of the first of the models to succeed.
+
+    `attempt(model_id, timings)` returns the blocking call, which runs on a worker thread. The next model is
+    started when a call fails, or when none has finished `hedge_after` seconds after the last start. Calls still
+    running when one succeeds cannot be interrupted: they finish in the background and `abandon(model_id)` runs
+    once each is done. Raises the last error when every model fails.
+    """
+    remaining = list(model_ids)
+    running = {}
+    executor = ThreadPoolExecutor(len(model_ids), thread_name_prefix="router")
+    error: Optional[Exception] = None
+
+    def start(reason: str):
+        model_id = remaining.pop(0)
+        ROUTER_ATTEMPTS.inc(model=model_id, reason=reason)
+        attempt_timings = {}
+        running[executor.submit(attempt(model_id, attempt_timings))] = model_id, attempt_timings
+
+    try:
+        start("primary")
+        while running:
+            done, _ = wait(running, hedge_after if remaining and hedge_after > 0 else None, FIRST_COMPLETED)
+            if not done:
+                start("hedge")
+            for future in done:
+                model_id, attempt_timings = running.pop(future)
+                try:
+                    return model_id, future.result(), attempt_timings, len(model_ids) - len(remaining)
+                except Exception as e:
+                    error = e
+                    if remaining:
+                        start("failover")
+        raise error
+    finally:
+        if abandon is not None:
+            for future, (model_id, _) in running.items():
+                future.add_done_callback(lambda _, model_id=model_id: abandon(model_id))
+        executor.shutdown(wait=False)
+
+
+async def _arace(model_ids: List[str], attempt: Callable[[str, Dict], Awaitable[Any]],
+                 hedge_after: float) -> Tuple[str, Any, Dict, int]:
+    """Async counterpart of _race; the calls that lose are cancelled."""
+    remaining = list(model_ids)
+    running = {}
+    error: Optional[Exception] = None
+
+    def start(reason: str):
+        model_id = remaining.pop(0)
+        ROUTER_ATTEMPTS.inc(model=model_id, reason=reason)
+        attempt_timings = {}
+        running[asyncio.ensure_future(attempt(model_id, attempt_timings))] = model_id, attempt_timings
+
+    try:
+        start("primary")
+        while running:
+            done, _ = await asyncio.wait(running, timeout=hedge_after if remaining and hedge_after > 0 else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                start("hedge")
+            for task in done:
+                model_id, attempt_timings = running.pop(task)
+                try:
+                    return model_id, task.result(), attempt_timings, len(model_ids) - len(remaining)
+                except Exception as e:
+                    error = e
+                    if remaining:
+                        start("failover")
+        raise error
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+def complete_chat(client: Groq, history: List[Dict[str, str]], model: str,
+                  timings: Optional[Dict[str, float]] = None, use_cache: bool = True,
+                  params: Optional[Dict] = None, hedge_after: float = ROUTER_HEDGE_AFTER) -> str:
+    """chat_core.complete_chat that also accepts the auto model; raises the last error when every model fails."""
+    if model != AUTO_MODEL_ID:
+        return chat_core.complete_chat(client, history, model, timings, use_cache, params)
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    model_id, reply, attempt_timings, attempts = _race(
+        route(estimate_prompt_tokens(history)),
+        lambda model_id, attempt_timings: lambda: chat_core.complete_chat(client, history, model_id, attempt_timings,
+                                                                          use_cache, params),
+        hedge_after
+    )
+    _served(timings, model_id, attempt_timings, attempts)
+    timings["total_time"] = time.perf_counter() - start
+    timings["ttft"] = timings["total_time"]
+    return reply
+
+
+def stream_chat_response(client: Groq, history: List[Dict[str, str]], model: str,
+                         timings: Optional[Dict[str, float]] = None, use_cache: bool = True,
+                         params: Optional[Dict] = None, hedge_after: float = ROUTER_HEDGE_AFTER) -> Iterator[str]:
+    """chat_core.stream_chat_response that also accepts the auto model.
+
+    Models are raced for the first token; a stream that fails after it is not retried elsewhere.
+    """
+    if model != AUTO_MODEL_ID:
+        yield from chat_core.stream_chat_response(client, history, model, timings, use_cache, params)
+        return
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    streams = {}
+
+    def attempt(model_id: str, attempt_timings: Dict) -> Callable[[], Any]:
+        chunks = streams[model_id] = chat_core.stream_chat_response(client, history, model_id, attempt_timings,
+                                                                    use_cache, params)
+        return lambda: next(chunks, _END)
+
+    model_id, first, attempt_timings, attempts = _race(route(estimate_prompt_tokens(history)), attempt,
+                                                       hedge_after, lambda model_id: streams[model_id].close())
+    _served(timings, model_id, attempt_timings, attempts)
+    timings["ttft"] = time.perf_counter() - start
+    chunks = streams[model_id]
+    try:
+        if first is not _END:
+            yield first
+            yield from chunks
+    finally:
+        chunks.close()
+        timings["total_time"] = time.perf_counter() - start
+
+
+async def acomplete_chat(client: AsyncGroq, history: List[Dict[str, str]], model: str,
+                         timings: Optional[Dict[str, float]] = None, use_cache: bool = True,
+                         params: Optional[Dict] = None, hedge_after: float = ROUTER_HEDGE_AFTER) -> str:
+    """Async counterpart of complete_chat."""
+    if model != AUTO_MODEL_ID:
+        return await chat_core.acomplete_chat(client, history, model, timings, use_cache, params)
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    candidates = await asyncio.to_thread(route, estimate_prompt_tokens(history))
+    model_id, reply, attempt_timings, attempts = await _arace(
+        candidates,
+        lambda model_id, attempt_timings: chat_core.acomplete_chat(client, history, model_id, attempt_timings,
+                                                                   use_cache, params),
+        hedge_after
+    )
+    _served(timings, model_id, attempt_timings, attempts)
+    timings["total_time"] = time.perf_counter() - start
+    timings["ttft"] = timings["total_time"]
+    return reply
+
+
+async def astream_chat_response(client: AsyncGroq, history: List[Dict[str, str]], model: str,
+                                timings: Optional[Dict[str, float]] = None, use_cache: bool = True,
+                                params: Optional[Dict] = None,
+                                hedge_after: float = ROUTER_HEDGE_AFTER) -> AsyncIterator[str]:
+    """Async counterpart of stream_chat_response."""
+    if model != AUTO_MODEL_ID:
+        async for delta in chat_core.astream_chat_response(client, history, model, timings, use_cache, params):
+            yield delta
+        return
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    streams = {}
+
+    def attempt(model_id: str, attempt_timings: Dict) -> Awaitable[Any]:
+        chunks = streams[model_id] = chat_core.astream_chat_response(client, history, model_id, attempt_timings,
+                                                                     use_cache, params)
+        return anext(chunks, _END)
+
+    candidates = await asyncio.to_thread(route, estimate_prompt_tokens(history))
+    winner = None
+    try:
+        winner = await _arace(candidates, attempt, hedge_after)
+    finally:
+        # The losers were cancelled; closing their generators records their turns now
+        for model_id, chunks in streams.items():
+            if winner is None or model_id != winner[0]:
+                await chunks.aclose()
+    model_id, first, attempt_timings, attempts = winner
+    _served(timings, model_id, attempt_timings, attempts)
+    timings["ttft"] = time.perf_counter() - start
+    chunks = streams[model_id]
+    try:
+        if first is not _END:
+            yield first
+            async for delta in chunks:
+                yield delta
+    finally:
+        await chunks.aclose()
+        timings["total_time"] = time.perf_counter() - start
@@ -0,0 +1,307 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+import groq
+import httpx
+import requests
+
+from metrics import GROQ_ERRORS, GROQ_REQUEST_SECONDS, GROQ_TOKENS, span
+
+# Per-model limits; override with LLAMABOT_RATE_LIMITS='{"llama3-8b-8192": {"rpm": 30, "tpm": 30000}}'
+DEFAULT_REQUESTS_PER_MINUTE = int(os.getenv("LLAMABOT_DEFAULT_RPM", "30"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.getenv("LLAMABOT_DEFAULT_TPM", "15000"))
+RATE_LIMITS: Dict[str, Dict[str, int]] = json.loads(os.getenv("LLAMABOT_RATE_LIMITS", "{}"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("LLAMABOT_SCHEDULER_MAX_QUEUE", "100"))
+MAX_RETRIES = int(os.getenv("LLAMABOT_MAX_RETRIES", "4"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class SchedulerQueueFull(Exception):
+    """Raised when the wait queue is at capacity; callers should surface this as 'busy, try again'."""
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a request waited longer than its `max_wait` for rate-limit capacity."""
+
+
+class TokenBucket:
+    """Refills `capacity` units per minute; not thread-safe on its own (guarded by the scheduler lock)."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(max(per_minute, 1))
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        blocked = max(0.0, self.blocked_until - now)
+        shortfall = max(0.0, amount - self.tokens)
+        return max(blocked, shortfall / self.rate)
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def block_for(self, seconds: float, now: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parses Groq reset headers ('7.66s', '2m59.56s', '120ms') and Retry-After values (seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if parts:
+        scale = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+        return sum(float(number) * scale[unit] for number, unit in parts)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_details(error: BaseException) -> Tuple[bool, Optional[int], Optional[float], Mapping[str, str]]:
+    """Returns (retryable, status, retry_after_seconds, headers) for an exception from a Groq or HTTP call."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    status = status if isinstance(status, int) else None
+    retry_after = parse_duration(headers.get("retry-after"))
+    if isinstance(error, (groq.APIConnectionError, requests.ConnectionError, requests.Timeout)):
+        return True, status, retry_after, headers
+    if status is not None and (status == 429 or status >= 500):
+        return True, status, retry_after, headers
+    return False, status, None, headers
+
+
+def _response_headers(result: Any) -> Optional[Mapping[str, str]]:
+    """Headers of a successful result that carries them (an HTTP or raw API response), else None."""
+    headers = getattr(result, "headers", None)
+    return headers if isinstance(headers, Mapping) else None
+
+
+class _Model:
+    def __init__(self, name: str):
+        limits = RATE_LIMITS.get(name, {})
+        self.requests = TokenBucket(limits.get("rpm", DEFAULT_REQUESTS_PER_MINUTE))
+        self.tokens = TokenBucket(limits.get("tpm", DEFAULT_TOKENS_PER_MINUTE))
+
+
+class RequestScheduler:
+    """Shared gate for every Groq call.
+
+    Requests wait in a bounded priority queue until the model's request and token buckets have capacity,
+    then run on the caller's thread. Retryable failures (429, 5xx, connection errors) are retried with
+    exponential backoff and full jitter, honouring Retry-After and Groq's x-ratelimit-* headers.
+    """
+
+    def __init__(self, max_queue: int = SCHEDULER_MAX_QUEUE, max_retries: int = MAX_RETRIES,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self._sleep = sleep
+        self._lock = threading.Condition()
+        self._models: Dict[str, _Model] = {}
+        self._waiting: list = []  # heap of (priority, sequence, model)
+        self._sequence = itertools.count()
+        self._metrics = {"requests": 0, "retries": 0, "rate_limited": 0, "rejected": 0, "timeouts": 0,
+                         "queue_depth": 0, "max_queue_depth": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+
+    def _model(self, name: str) -> _Model:
+        if name not in self._models:
+            self._models[name] = _Model(name)
+        return self._models[name]
+
+    def _is_next(self, ticket: Tuple[int, int, str]) -> bool:
+        # FIFO within a priority, and only against requests for the same model
+        return not any(other < ticket and other[2] == ticket[2] for other in self._waiting)
+
+    def acquire(self, model: str, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE,
+                max_wait: Optional[float] = None):
+        """Blocks until `model` has capacity for one request of `tokens` tokens."""
+        start = time.monotonic()
+        with self._lock:
+            if len(self._waiting) >= self.max_queue:
+                self._metrics["rejected"] += 1
+                raise SchedulerQueueFull(f"Too many requests waiting ({self.max_queue}). Please try again shortly.")
+            ticket = (priority, next(self._sequence), model)
+            heapq.heappush(self._waiting, ticket)
+            self._update_depth()
+            try:
+                while True:
+                    now = time.monotonic()
+                    buckets = self._model(model)
+                    wait = max(buckets.requests.wait_time(1, now), buckets.tokens.wait_time(tokens, now))
+                    if wait <= 0 and self._is_next(ticket):
+                        buckets.requests.consume(1)
+                        buckets.tokens.consume(tokens)
+                        break
+                    if max_wait is not None and now - start >= max_wait:
+                        self._metrics["timeouts"] += 1
+                        raise SchedulerTimeout(f"Waited more than {max_wait:.0f}s for capacity on {model}.")
+                    timeout = wait if wait > 0 else None
+                    if max_wait is not None:
+                        remaining = max_wait - (now - start)
+                        timeout = remaining if timeout is None else min(timeout, remaining)
+                    self._lock.wait(timeout)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._update_depth()
+                self._lock.notify_all()
+            waited = time.monotonic() - start
+            self._metrics["requests"] += 1
+            self._metrics["wait_time_total"] += waited
+            self._metrics["wait_time_max"] = max(self._metrics["wait_time_max"], waited)
+
+    def _update_depth(self):
+        self._metrics["queue_depth"] = len(self._waiting)
+        self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], len(self._waiting))
+
+    def observe_headers(self, model: str, headers: Mapping[str, str]):
+        """Applies Groq's x-ratelimit-* headers so the buckets follow the server's view of the limits."""
+        if not headers:
+            return
+        with self._lock:
+            now = time.monotonic()
+            buckets = self._model(model)
+            for kind, bucket in (("requests", buckets.requests), ("tokens", buckets.tokens)):
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if remaining is None:
+                    continue
+                try:
+                    remaining = float(remaining)
+                except ValueError:
+                    continue
+                bucket.tokens = min(bucket.tokens, remaining)
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if remaining <= 0 and reset:
+                    bucket.block_for(reset, now)
+            self._lock.notify_all()
+
+    def _backoff(self, model: str, attempt: int, error: BaseException) -> float:
+        retryable, status, retry_after, headers = _error_details(error)
+        if not retryable or attempt >= self.max_retries:
+            raise error
+        self.observe_headers(model, headers)
+        with self._lock:
+            self._metrics["retries"] += 1
+            if status == 429:
+                self._metrics["rate_limited"] += 1
+                if retry_after:
+                    # Hold back every caller of this model, not just the one that was rejected
+                    self._model(model).requests.block_for(retry_after, time.monotonic())
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))  # full jitter
+
+    def _record_usage(self, model: str, tokens: int, result: Any):
+        usage = getattr(result, "usage", None)
+        for kind in ("prompt", "completion"):
+            count = getattr(usage, f"{kind}_tokens", None)
+            if isinstance(count, (int, float)):
+                GROQ_TOKENS.inc(count, model=model, kind=kind)
+        total = getattr(usage, "total_tokens", None)
+        if isinstance(total, (int, float)) and total != tokens:
+            with self._lock:
+                # Correct the estimate charged at admission with the real count
+                self._model(model).tokens.consume(total - tokens)
+
+    def call(self, fn: Callable[[], Any], model: str, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE,
+             max_wait: Optional[float] = None, operation: str = "chat") -> Any:
+        attempt = 0
+        while True:
+            self.acquire(model, tokens, priority, max_wait)
+            try:
+                with span(GROQ_REQUEST_SECONDS, GROQ_ERRORS, model=model, operation=operation):
+                    result = fn()
+            except Exception as e:
+                self._sleep(self._backoff(model, attempt, e))
+                attempt += 1
+                continue
+            self.observe_headers(model, _response_headers(result))
+            self._record_usage(model, tokens, result)
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], model: str, tokens: int = 0,
+                    priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None,
+                    operation: str = "chat") -> Any:
+        attempt = 0
+        while True:
+            await asyncio.to_thread(self.acquire, model, tokens, priority, max_wait)
+            try:
+                with span(GROQ_REQUEST_SECONDS, GROQ_ERRORS, model=model, operation=operation):
+                    result = await fn()
+            except Exception as e:
+                await asyncio.sleep(self._backoff(model, attempt, e))
+                attempt += 1
+                continue
+            self.observe_headers(model, _response_headers(result))
+            self._record_usage(model, tokens, result)
+            return result
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["wait_time_avg"] = metrics["wait_time_total"] / metrics["requests"] if metrics["requests"] else 0.0
+        return metrics
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler()
+    return _scheduler
+
+
+def observe_response(response: httpx.Response):
+    """httpx response hook: feeds the rate-limit headers of every Groq response, successful ones included, to the
+    scheduler under the model named in the request body."""
+    if not any(name.startswith("x-ratelimit-") for name in response.headers):
+        return
+    try:
+        model = json.loads(response.request.content).get("model")
+    except (httpx.RequestNotRead, ValueError, AttributeError):
+        return  # multipart uploads (transcriptions) are streamed and not JSON
+    if isinstance(model, str):
+        get_scheduler().observe_headers(model, response.headers)
+
+
+async def aobserve_response(response: httpx.Response):
+    """Async counterpart of observe_response, for httpx.AsyncClient."""
+    observe_response(response)
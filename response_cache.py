@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import List, Dict, Optional
+
+from sqlalchemy import Column, Integer, String, Float, func
+
+from database import Base, session_scope
+
+# Opt-in: set LLAMABOT_RESPONSE_CACHE=1 to reuse replies for identical requests
+RESPONSE_CACHE_ENABLED = os.getenv("LLAMABOT_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_TTL = float(os.getenv("LLAMABOT_RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("LLAMABOT_RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("LLAMABOT_RESPONSE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+class CachedResponse(Base):
+    __tablename__ = 'response_cache'
+    key = Column(String, primary_key=True)
+    model_id = Column(String)
+    response = Column(String)
+    size = Column(Integer)
+    created_at = Column(Float)
+    last_accessed = Column(Float, index=True)
+    hits = Column(Integer, default=0)
+
+
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str, amount: int = 1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def cache_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _normalize(content: str) -> str:
+    return re.sub(r"\s+", " ", content).strip()
+
+
+def make_cache_key(model: str, history: List[Dict[str, str]], params: Optional[Dict] = None) -> str:
+    """Hashes the model, the whitespace-normalized messages and the sampling parameters."""
+    payload = {
+        "model": model,
+        "messages": [[message["role"], _normalize(message["content"])] for message in history],
+        "params": params or {},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def get_cached_response(model: str, history: List[Dict[str, str]], params: Optional[Dict] = None) -> Optional[str]:
+    key = make_cache_key(model, history, params)
+    now = time.time()
+    with session_scope() as session:
+        entry = session.get(CachedResponse, key)
+        if entry is None or now - entry.created_at > RESPONSE_CACHE_TTL:
+            if entry is not None:
+                session.delete(entry)
+            _count("misses")
+            return None
+        entry.last_accessed = now
+        entry.hits = (entry.hits or 0) + 1
+        _count("hits")
+        return entry.response
+
+
+def store_response(model: str, history: List[Dict[str, str]], response: str, params: Optional[Dict] = None):
+    key = make_cache_key(model, history, params)
+    now = time.time()
+    with session_scope() as session:
+        session.merge(CachedResponse(key=key, model_id=model, response=response, size=len(response.encode("utf-8")),
+                                     created_at=now, last_accessed=now, hits=0))
+    _count("stores")
+    evict()
+
+
+def evict():
+    """Drops expired entries, then least recently used ones until the entry and size caps are met."""
+    with session_scope() as session:
+        expired = session.query(CachedResponse).filter(
+            CachedResponse.created_at < time.time() - RESPONSE_CACHE_TTL
+        ).delete(synchronize_session=False)
+        count, total_size = session.query(func.count(CachedResponse.key), func.sum(CachedResponse.size)).one()
+        total_size = total_size or 0
+        victims = []
+        if count > RESPONSE_CACHE_MAX_ENTRIES or total_size > RESPONSE_CACHE_MAX_BYTES:
+            for key, size in session.query(CachedResponse.key, CachedResponse.size).order_by(
+                    CachedResponse.last_accessed).all():
+                if count <= RESPONSE_CACHE_MAX_ENTRIES and total_size <= RESPONSE_CACHE_MAX_BYTES:
+                    break
+                victims.append(key)
+                count -= 1
+                total_size -= size or 0
+            session.query(CachedResponse).filter(CachedResponse.key.in_(victims)).delete(synchronize_session=False)
+        evicted = len(victims)
+    if expired or evicted:
+        _count("evictions", expired + evicted)
+
+
+def clear_response_cache():
+    with session_scope() as session:
+        session.query(CachedResponse).delete()
@@ -0,0 +1,167 @@
+import argparse
+import re
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from database import Base, get_engine
+
+FTS_TABLE = "chat_history_fts"
+SEARCH_PAGE_SIZE = 20
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+SNIPPET_TOKENS = 16
+
+# External-content FTS5 table over chat_history.content, kept in sync by triggers
+_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        content, content='chat_history', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_history_fts_ai AFTER INSERT ON chat_history BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_history_fts_ad AFTER DELETE ON chat_history BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_history_fts_au AFTER UPDATE OF content ON chat_history BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+_fts_available: Optional[bool] = None
+
+
+def fts_available(engine: Optional[Engine] = None) -> bool:
+    global _fts_available
+    if _fts_available is None:
+        with (engine or get_engine()).connect() as connection:
+            options = {row[0] for row in connection.exec_driver_sql("PRAGMA compile_options")}
+        _fts_available = "ENABLE_FTS5" in options
+    return _fts_available
+
+
+def ensure_search_index(engine: Optional[Engine] = None):
+    """Creates the FTS table and triggers, backfilling the index the first time it is created."""
+    engine = engine or get_engine()
+    if not fts_available(engine):
+        return
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+        ).first()
+        for statement in _SCHEMA:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def rebuild_search_index(engine: Optional[Engine] = None):
+    """Re-indexes every stored message, e.g. for databases created before the index existed."""
+    engine = engine or get_engine()
+    ensure_search_index(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def to_fts_query(query: str) -> str:
+    """Turns free text into a safe FTS5 query: every term must match, the last one as a prefix."""
+    terms = re.findall(r"\w+", query, flags=re.UNICODE)
+    if not terms:
+        return ""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"  # match as the user types
+    return " ".join(quoted)
+
+
+def _filters(conversation_id: Optional[int], role: Optional[str], model_id: Optional[str],
+             start: Optional[datetime], end: Optional[datetime]) -> Tuple[str, Dict]:
+    clauses, params = [], {}
+    if conversation_id is not None:
+        clauses.append("m.conversation_id = :conversation_id")
+        params["conversation_id"] = conversation_id
+    if role:
+        clauses.append("m.role = :role")
+        params["role"] = role
+    if model_id:
+        clauses.append("m.model_id = :model_id")
+        params["model_id"] = model_id
+    if start:
+        clauses.append("m.timestamp >= :start")
+        params["start"] = start.isoformat(sep=" ")
+    if end:
+        clauses.append("m.timestamp < :end")
+        params["end"] = end.isoformat(sep=" ")
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+
+def search_messages(query: str, conversation_id: Optional[int] = None, role: Optional[str] = None,
+                    model_id: Optional[str] = None, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, page: int = 0,
+                    page_size: int = SEARCH_PAGE_SIZE) -> Tuple[List[Dict], bool]:
+    """Ranked full-text search over all stored messages.
+
+    Returns one page of results (best match first) and whether more pages exist. Each result carries a
+    `snippet` and a fully `highlighted` copy of the content with matches wrapped in <mark> tags.
+    """
+    engine = get_engine()
+    where, params = _filters(conversation_id, role, model_id, start, end)
+    params.update(limit=page_size + 1, offset=page * page_size)
+    if fts_available(engine):
+        match = to_fts_query(query)
+        if not match:
+            return [], False
+        params.update(match=match, hl_start=HIGHLIGHT_START, hl_end=HIGHLIGHT_END)
+        sql = f"""
+            SELECT m.id, m.conversation_id, m.role, m.content, m.timestamp, m.model_id,
+                   snippet({FTS_TABLE}, 0, :hl_start, :hl_end, '…', {SNIPPET_TOKENS}) AS snippet,
+                   highlight({FTS_TABLE}, 0, :hl_start, :hl_end) AS highlighted
+            FROM {FTS_TABLE} JOIN chat_history AS m ON m.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH :match{where}
+            ORDER BY bm25({FTS_TABLE}), m.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    else:
+        # Fallback for SQLite builds without FTS5; typed % and _ match themselves
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params["pattern"] = f"%{escaped}%"
+        sql = f"""
+            SELECT m.id, m.conversation_id, m.role, m.content, m.timestamp, m.model_id,
+                   m.content AS snippet, m.content AS highlighted
+            FROM chat_history AS m
+            WHERE m.content LIKE :pattern ESCAPE '\\'{where}
+            ORDER BY m.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    with engine.connect() as connection:
+        rows = connection.execute(text(sql), params).mappings().all()
+    results = [
+        {
+            "id": row["id"],
+            "conversation_id": row["conversation_id"],
+            "role": row["role"],
+            "content": row["content"],
+            "timestamp": datetime.fromisoformat(str(row["timestamp"])).isoformat(),
+            "model_id": row["model_id"],
+            "snippet": row["snippet"],
+            "highlighted": row["highlighted"],
+        }
+        for row in rows[:page_size]
+    ]
+    return results, len(rows) > page_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the chat history full-text index.")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: (re)index every stored message")
+    parser.parse_args()
+    Base.metadata.create_all(get_engine())
+    rebuild_search_index()
+    print("Chat history search index rebuilt.")
+
+
+if __name__ == "__main__":
+    main()
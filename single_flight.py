@@ -0,0 +1,441 @@
+"""Process-wide single-flight: concurrent identical Groq requests share one outstanding call.
+
+The first caller for a key (the leader) makes the call; callers that arrive while it is in flight wait for it and
+get the same result or exception. A key can be joined for at most its timeout after the call started, after which
+new callers start a fresh call; callers already waiting give up with SingleFlightTimeout once it passes. Streams
+are shared through a buffer of their chunks, so a caller that joins late first replays what it missed.
+"""
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metrics import SINGLE_FLIGHT_CALLS
+
+# Set LLAMABOT_SINGLE_FLIGHT=0 to send every request on its own
+SINGLE_FLIGHT_ENABLED = os.getenv("LLAMABOT_SINGLE_FLIGHT", "1") == "1"
+# How long an in-flight call can be joined, and how long its followers wait (per chunk, for streams)
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("LLAMABOT_SINGLE_FLIGHT_TIMEOUT", "120"))
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Raised to a caller that waited longer than the key's timeout for an identical in-flight request."""
+
+
+class _Abandoned(Exception):
+    """The leader stopped without a result (cancelled or interrupted); followers make the call themselves."""
+
+
+def request_key(operation: str, **request) -> str:
+    """Canonical hash of a request: the same operation and arguments give the same key in any order."""
+    payload = json.dumps({"operation": operation, **request}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def credential_fingerprint(api_key: Optional[str]) -> Optional[str]:
+    """Short hash of an API key, so requests made with different keys are never shared."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if isinstance(api_key, str) else None
+
+
+class _Flight:
+    def __init__(self, timeout: float):
+        self.deadline = time.monotonic() + timeout
+        self.timeout = timeout
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []  # async followers
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def outcome(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Subscription:
+    """One caller's reader of a _Broadcast, counted as a reader once it starts iterating.
+
+    Until then it only holds the stream open, and dropping or closing it unstarted lets the pump stop.
+    """
+
+    def __init__(self, broadcast: "_Broadcast", timeout: float):
+        self._broadcast = broadcast
+        self._timeout = timeout
+        self._chunks: Optional[Iterator[Any]] = None
+        self._released = False
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        if self._chunks is None:
+            if self._released:
+                raise StopIteration
+            self._released = True
+            self._chunks = self._broadcast.start_reading(self._timeout)
+        return next(self._chunks)
+
+    def close(self):
+        if self._chunks is not None:
+            self._chunks.close()
+        elif not self._released:
+            self._released = True
+            self._broadcast.release()
+
+    def __del__(self):
+        self.close()
+
+
+class _Broadcast:
+    """Chunks of one stream, pumped on a background thread and replayed to every subscriber."""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.finished = False
+        self.abandoned = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0  # readers that started iterating
+        self.pending = 0  # subscriptions handed out but not started yet
+        self.condition = threading.Condition()
+
+    def pump(self, open_stream: Callable[[], Iterable], on_done: Callable[[], None]):
+        stream = None
+        try:
+            stream = open_stream()
+            for chunk in stream:
+                with self.condition:
+                    if not self.subscribers and not self.pending:
+                        # Everyone stopped reading; stop paying for the rest of the reply
+                        self.abandoned = True
+                        raise _Abandoned("Every reader of the shared stream stopped.")
+                    self.chunks.append(chunk)
+                    self.condition.notify_all()
+        except BaseException as e:
+            self.error = e
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+            on_done()
+
+    def subscribe(self, timeout: float) -> Optional[_Subscription]:
+        """A new reader, or None once the pump has given up on the stream."""
+        with self.condition:
+            if self.abandoned:
+                return None
+            self.pending += 1
+        return _Subscription(self, timeout)
+
+    def release(self):
+        with self.condition:
+            self.pending -= 1
+
+    def start_reading(self, timeout: float) -> Iterator[Any]:
+        with self.condition:
+            self.pending -= 1
+            self.subscribers += 1
+        return self._read(timeout)
+
+    def _read(self, timeout: float) -> Iterator[Any]:
+        try:
+            position = 0
+            while True:
+                with self.condition:
+                    if position == len(self.chunks) and not self.finished:
+                        if not self.condition.wait_for(lambda: position < len(self.chunks) or self.finished,
+                                                       timeout):
+                            raise SingleFlightTimeout(f"No new chunk from the shared stream in {timeout:.0f}s.")
+                    available = self.chunks[position:]
+                    finished, error = self.finished, self.error
+                for chunk in available:
+                    yield chunk
+                position += len(available)
+                if finished and position == len(self.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+
+class _AsyncSubscription:
+    """Async counterpart of _Subscription."""
+
+    def __init__(self, broadcast: "_AsyncBroadcast", timeout: float):
+        self._broadcast = broadcast
+        self._timeout = timeout
+        self._chunks: Optional[AsyncIterator[Any]] = None
+        self._released = False
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._chunks is None:
+            if self._released:
+                raise StopAsyncIteration
+            self._released = True
+            self._chunks = self._broadcast.start_reading(self._timeout)
+        return await self._chunks.__anext__()
+
+    async def aclose(self):
+        if self._chunks is not None:
+            await self._chunks.aclose()
+        else:
+            self._release()
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._broadcast.pending -= 1
+
+    def __del__(self):
+        self._release()
+
+
+class _AsyncBroadcast:
+    """Async counterpart of _Broadcast, pumped by a task on the leader's event loop."""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.finished = False
+        self.abandoned = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.pending = 0
+        self.changed = asyncio.Event()
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def pump(self, open_stream: Callable[[], Awaitable[Any]], on_done: Callable[[], None]):
+        stream = None
+        try:
+            stream = await open_stream()
+            async for chunk in stream:
+                if not self.subscribers and not self.pending:
+                    self.abandoned = True
+                    raise _Abandoned("Every reader of the shared stream stopped.")
+                self.chunks.append(chunk)
+                self._notify()
+        except BaseException as e:
+            self.error = e
+            close = getattr(stream, "close", None)
+            if close is not None and inspect.isawaitable(closed := close()):
+                await closed
+        finally:
+            self.finished = True
+            self._notify()
+            on_done()
+
+    def subscribe(self, timeout: float) -> Optional[_AsyncSubscription]:
+        if self.abandoned:
+            return None
+        self.pending += 1
+        return _AsyncSubscription(self, timeout)
+
+    def start_reading(self, timeout: float) -> AsyncIterator[Any]:
+        self.pending -= 1
+        self.subscribers += 1
+        return self._read(timeout)
+
+    async def _read(self, timeout: float) -> AsyncIterator[Any]:
+        try:
+            position = 0
+            while True:
+                if position == len(self.chunks) and not self.finished:
+                    try:
+                        await asyncio.wait_for(self.changed.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        raise SingleFlightTimeout(f"No new chunk from the shared stream in {timeout:.0f}s.")
+                    continue
+                while position < len(self.chunks):
+                    position += 1
+                    yield self.chunks[position - 1]
+                if self.finished and position == len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+        finally:
+            self.subscribers -= 1
+
+
+def _iterate(open_stream: Callable[[], Iterable]) -> Iterator[Any]:
+    yield from open_stream()
+
+
+async def _aiterate(open_stream: Callable[[], Awaitable[Any]]) -> AsyncIterator[Any]:
+    async for chunk in await open_stream():
+        yield chunk
+
+
+class SingleFlight:
+    """In-flight calls by request key, shared by every thread and event loop of the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+    def _join(self, key: str, timeout: Optional[float]) -> Tuple[_Flight, bool]:
+        """Returns the key's flight and whether the caller leads it."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.remaining() > 0:
+                return flight, False
+            flight = _Flight(SINGLE_FLIGHT_TIMEOUT if timeout is None else timeout)
+            self._flights[key] = flight
+            return flight, True
+
+    def _finish(self, key: str, flight: _Flight, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if error is not None and not isinstance(error, Exception):
+                error = _Abandoned(f"The shared call was interrupted ({type(error).__name__}).")
+            flight.result, flight.error = result, error
+            flight.done.set()
+            waiters, flight.waiters = flight.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def _forget(self, key: str, flight: _Flight):
+        """Stops new callers joining a stream that was abandoned but has not finished yet."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def do(self, key: str, fn: Callable[[], Any], operation: str = "call",
+           timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Returns (result, leader): the result of `fn()`, or of the identical call already in flight.
+
+        `leader` is False when the result was shared, e.g. so token usage is not counted twice.
+        """
+        if not SINGLE_FLIGHT_ENABLED:
+            return fn(), True
+        while True:
+            flight, leader = self._join(key, timeout)
+            if leader:
+                SINGLE_FLIGHT_CALLS.inc(operation=operation, role="leader")
+                try:
+                    result = fn()
+                except BaseException as e:
+                    self._finish(key, flight, error=e)
+                    raise
+                self._finish(key, flight, result)
+                return result, True
+            SINGLE_FLIGHT_CALLS.inc(operation=operation, role="coalesced")
+            if not flight.done.wait(flight.remaining()):
+                SINGLE_FLIGHT_CALLS.inc(operation=operation, role="timed_out")
+                raise SingleFlightTimeout(f"An identical {operation} request is still running after "
+                                          f"{flight.timeout:.0f}s.")
+            try:
+                return flight.outcome(), False
+            except _Abandoned:
+                continue
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]], operation: str = "call",
+                  timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Async counterpart of `do`; followers wait without holding a thread."""
+        if not SINGLE_FLIGHT_ENABLED:
+            return await fn(), True
+        while True:
+            flight, leader = self._join(key, timeout)
+            if leader:
+                SINGLE_FLIGHT_CALLS.inc(operation=operation, role="leader")
+                try:
+                    result = await fn()
+                except BaseException as e:
+                    self._finish(key, flight, error=e)
+                    raise
+                self._finish(key, flight, result)
+                return result, True
+            SINGLE_FLIGHT_CALLS.inc(operation=operation, role="coalesced")
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with self._lock:
+                if flight.done.is_set():
+                    future.set_result(None)
+                else:
+                    flight.waiters.append((loop, future))
+            try:
+                await asyncio.wait_for(future, flight.remaining())
+            except asyncio.TimeoutError:
+                SINGLE_FLIGHT_CALLS.inc(operation=operation, role="timed_out")
+                raise SingleFlightTimeout(f"An identical {operation} request is still running after "
+                                          f"{flight.timeout:.0f}s.")
+            try:
+                return flight.outcome(), False
+            except _Abandoned:
+                continue
+
+    def stream(self, key: str, open_stream: Callable[[], Iterable], operation: str = "stream",
+               timeout: Optional[float] = None) -> Tuple[Iterator[Any], bool]:
+        """Returns (chunks, leader): the chunks of `open_stream()`, shared with identical concurrent streams.
+
+        The stream is read on a background thread, so it continues while any caller is still reading.
+        """
+        if not SINGLE_FLIGHT_ENABLED:
+            return _iterate(open_stream), True
+        while True:
+            flight, leader = self._join(key, timeout)
+            if leader:
+                broadcast = flight.result = _Broadcast()
+                subscription = broadcast.subscribe(flight.timeout)
+                threading.Thread(target=broadcast.pump,
+                                 args=(open_stream, lambda: self._finish(key, flight, broadcast)), daemon=True).start()
+                SINGLE_FLIGHT_CALLS.inc(operation=operation, role="leader")
+                return subscription, True
+            subscription = flight.result.subscribe(flight.timeout)
+            if subscription is not None:
+                SINGLE_FLIGHT_CALLS.inc(operation=operation, role="coalesced")
+                return subscription, False
+            self._forget(key, flight)
+
+    def astream(self, key: str, open_stream: Callable[[], Awaitable[Any]], operation: str = "stream",
+                timeout: Optional[float] = None) -> Tuple[AsyncIterator[Any], bool]:
+        """Async counterpart of `stream`; only callers on the same event loop share a stream."""
+        if not SINGLE_FLIGHT_ENABLED:
+            return _aiterate(open_stream), True
+        loop = asyncio.get_running_loop()
+        key = f"{key}:{id(loop)}"
+        while True:
+            flight, leader = self._join(key, timeout)
+            if leader:
+                broadcast = flight.result = _AsyncBroadcast()
+                subscription = broadcast.subscribe(flight.timeout)
+                loop.create_task(broadcast.pump(open_stream, lambda: self._finish(key, flight, broadcast)))
+                SINGLE_FLIGHT_CALLS.inc(operation=operation, role="leader")
+                return subscription, True
+            subscription = flight.result.subscribe(flight.timeout)
+            if subscription is not None:
+                SINGLE_FLIGHT_CALLS.inc(operation=operation, role="coalesced")
+                return subscription, False
+            self._forget(key, flight)
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
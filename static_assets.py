@@ -0,0 +1,137 @@
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+LOTTIE_DIR = os.path.join(ASSETS_DIR, "lottie")
+# Set LLAMABOT_ANIMATIONS=0 to skip every Lottie animation
+ANIMATIONS_ENABLED = os.getenv("LLAMABOT_ANIMATIONS", "1") == "1"
+
+# Original sources of the animations. `python static_assets.py fetch-lottie` vendors them into LOTTIE_DIR; any that
+# are not vendored are downloaded there in the background when first requested.
+LOTTIE_SOURCES = {
+    "welcome": "https://lottie.host/6cc5c636-161e-4fe2-a29e-d0a010fb857d/oUxnN8jMLv.json",
+    "loading": "https://lottie.host/6db67e84-29ca-4df7-9aed-e918be35c04f/GUHZd8ZAiP.json",
+    "success": "https://lottie.host/0d17b47d-7e01-4b7d-a8fb-f94b6c69dd48/jycOqQmo4J.json",
+    "error": "https://lottie.host/caa8d9f2-7b02-4462-867d-4a5a1aa1a175/3HRdfJrk9m.json",
+    "no_data": "https://lottie.host/aa234c54-eca8-4b61-a21c-83b5b1e82698/1EEUxyZ91a.json",
+}
+LOTTIE_FETCH_TIMEOUT = float(os.getenv("LLAMABOT_LOTTIE_FETCH_TIMEOUT", "10"))
+# Seconds to wait before downloading an animation again after a failed attempt
+LOTTIE_RETRY_AFTER = 300
+
+_failed_fetches: Dict[str, float] = {}
+_fetching: Dict[str, threading.Thread] = {}
+_fetch_lock = threading.Lock()
+
+
+def cached_by_mtime(fn: Callable) -> Callable:
+    """Caches `fn(path, *args)` for the life of the process, recomputing when the file's mtime changes.
+
+    Missing files are never cached, so the wrapped function's own error handling still runs.
+    """
+    cache: Dict[tuple, tuple] = {}
+    lock = threading.Lock()
+
+    @functools.wraps(fn)
+    def wrapper(path: str, *args):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return fn(path, *args)
+        key = (os.path.abspath(path),) + args
+        with lock:
+            entry = cache.get(key)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        value = fn(path, *args)
+        with lock:
+            cache[key] = (mtime, value)
+        return value
+
+    wrapper.cache_clear = cache.clear
+    return wrapper
+
+
+@cached_by_mtime
+def _read_lottie(path: str) -> Dict:
+    with open(path) as animation_file:
+        return json.load(animation_file)
+
+
+def _fetch_one(name: str, timeout: float) -> Dict:
+    """Downloads animation `name` from its source and saves it into LOTTIE_DIR."""
+    response = requests.get(LOTTIE_SOURCES[name], timeout=timeout)
+    response.raise_for_status()
+    animation = response.json()
+    os.makedirs(LOTTIE_DIR, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(suffix=".tmp", prefix=f"{name}.", dir=LOTTIE_DIR)
+    try:
+        with os.fdopen(descriptor, "w") as animation_file:
+            json.dump(animation, animation_file, separators=(",", ":"))
+        os.replace(temp_path, os.path.join(LOTTIE_DIR, f"{name}.json"))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return animation
+
+
+def _fetch_in_background(name: str):
+    try:
+        _fetch_one(name, LOTTIE_FETCH_TIMEOUT)
+    except (requests.RequestException, OSError, ValueError):
+        with _fetch_lock:
+            _failed_fetches[name] = time.monotonic()
+    finally:
+        with _fetch_lock:
+            _fetching.pop(name, None)
+
+
+def _start_fetch(name: str) -> Optional[threading.Thread]:
+    """Downloads a missing animation on a daemon thread, one at a time per animation and not right after a failure."""
+    with _fetch_lock:
+        failed_at = _failed_fetches.get(name)
+        if name not in LOTTIE_SOURCES or name in _fetching or \
+                (failed_at is not None and time.monotonic() - failed_at < LOTTIE_RETRY_AFTER):
+            return None
+        thread = _fetching[name] = threading.Thread(target=_fetch_in_background, args=(name,), daemon=True)
+    thread.start()
+    return thread
+
+
+def load_lottie(name: str) -> Optional[Dict]:
+    """Returns animation `name`, or None when animations are off or it is not available (yet).
+
+    An animation missing from LOTTIE_DIR is downloaded from LOTTIE_SOURCES in the background, so the page renders
+    without it until the download has finished.
+    """
+    if not ANIMATIONS_ENABLED:
+        return None
+    try:
+        return _read_lottie(os.path.join(LOTTIE_DIR, f"{name}.json"))
+    except FileNotFoundError:
+        _start_fetch(name)
+        return None
+    except (OSError, ValueError):
+        return None
+
+
+def fetch_lottie(timeout: float = 10):
+    """Vendors fresh copies of every animation from its source."""
+    for name in LOTTIE_SOURCES:
+        _fetch_one(name, timeout)
+        print(f"Saved {name}.json")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["fetch-lottie"]:
+        fetch_lottie()
+    else:
+        print("Usage: python static_assets.py fetch-lottie")
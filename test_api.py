@@ -0,0 +1,122 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+
+import api
+import chat_core
+from db_testing import TemporaryDatabaseTestCase
+
+
+class FakeStream:
+    def __init__(self, texts):
+        self.chunks = []
+        for text in texts:
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = text
+            self.chunks.append(chunk)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines.get("event", "message"), json.loads(lines["data"])))
+    return events
+
+
+class TestApi(TemporaryDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.groq = MagicMock()
+        self.groq.close = AsyncMock()
+        self.groq.chat.completions.create = AsyncMock()
+
+    def request(self, *calls):
+        """Runs the requests in order inside the app's lifespan and returns their responses."""
+
+        async def run():
+            with patch('api.resolve_api_key', return_value="key"), \
+                    patch('api.create_async_groq_client', return_value=self.groq), \
+                    patch('api.create_groq_client', return_value=MagicMock()):
+                async with api.lifespan(api.app):
+                    transport = httpx.ASGITransport(app=api.app)
+                    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                        return [await client.request(method, url, **kwargs) for method, url, kwargs in calls]
+
+        return asyncio.run(run())
+
+    def test_streaming_chat_sends_events_and_stores_both_turns(self):
+        self.groq.chat.completions.create.return_value = FakeStream(["Hel", None, "lo"])
+        conversation_id = chat_core.default_conversation("alice")[1]
+
+        chat, history = self.request(
+            ("POST", f"/conversations/{conversation_id}/messages", {"json": {"content": "Hi", "model": "m"}}),
+            ("GET", f"/conversations/{conversation_id}/messages", {}),
+        )
+
+        self.assertEqual(chat.headers["content-type"].split(";")[0], "text/event-stream")
+        events = parse_events(chat.text)
+        self.assertEqual([data["delta"] for event, data in events if event == "message"], ["Hel", "lo"])
+        self.assertEqual(events[-1][0], "done")
+        self.assertEqual(events[-1][1]["content"], "Hello")
+        stored = history.json()["messages"]
+        self.assertEqual([(m["role"], m["content"]) for m in stored], [("user", "Hi"), ("assistant", "Hello")])
+        self.assertEqual(chat_core.get_conversation(conversation_id)["title"], "Hi")
+
+    def test_failed_completion_returns_bad_gateway(self):
+        self.groq.chat.completions.create.side_effect = ValueError("model unavailable")
+        conversation_id = chat_core.default_conversation()[1]
+
+        response, = self.request(("POST", f"/conversations/{conversation_id}/messages",
+                                  {"json": {"content": "Hi", "model": "m", "stream": False}}))
+
+        self.assertEqual(response.status_code, 502)
+        self.assertIn("model unavailable", response.json()["detail"])
+
+    def test_metrics_endpoints(self):
+        self.groq.chat.completions.create.side_effect = ValueError("model unavailable")
+        conversation_id = chat_core.default_conversation()[1]
+
+        _, exposition, latency = self.request(
+            ("POST", f"/conversations/{conversation_id}/messages",
+             {"json": {"content": "Hi", "model": "m", "stream": False}}),
+            ("GET", "/metrics", {}),
+            ("GET", "/metrics/latency", {}),
+        )
+
+        self.assertEqual(exposition.headers["content-type"].split(";")[0], "text/plain")
+        self.assertIn('llamabot_groq_errors_total{model="m",operation="chat",error="ValueError"}', exposition.text)
+        self.assertEqual(latency.json()[0]["model"], "m")
+        self.assertEqual(latency.json()[0]["error_rate"], 1.0)
+
+    def test_feedback_and_unknown_conversation(self):
+        conversation_id = chat_core.default_conversation()[1]
+        message_id = chat_core.add_user_message(conversation_id, "Hi", "m")["id"]
+
+        first, second, missing, missing_search = self.request(
+            ("POST", f"/messages/{message_id}/feedback", {"json": {"is_positive": True}}),
+            ("POST", f"/messages/{message_id}/feedback", {"json": {"is_positive": False, "comment": "meh"}}),
+            ("GET", "/conversations/999/messages", {}),
+            ("GET", "/conversations/999/search", {"params": {"q": "Hi"}}),
+        )
+        unknown_message, = self.request(("POST", "/messages/999/feedback", {"json": {"is_positive": True}}))
+
+        self.assertEqual([first.json()["updated"], second.json()["updated"]], [False, True])
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(missing_search.status_code, 404)
+        self.assertEqual(unknown_message.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
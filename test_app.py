@@ -1,32 +1,31 @@
+import os
+import tempfile
 import unittest
 from datetime import datetime
 from unittest.mock import patch, MagicMock
 from app import (
-    save_message, load_chat_history, clear_chat_history, transcribe_audio,
-    initialize_db, get_groq_models, load_configuration, save_feedback
+    save_message, load_chat_history, load_chat_history_page, clear_chat_history, transcribe_audio,
+    initialize_db, get_groq_models, load_configuration, save_feedback, stream_chat_response
 )
 
 
 class TestAppFunctions(unittest.TestCase):
 
-    @patch('app.sessionmaker')
-    def test_save_message(self, mock_sessionmaker):
-        mock_session = MagicMock()
-        mock_sessionmaker.return_value = mock_session
-        mock_session.return_value = mock_session
+    @patch('chat_core.remember')
+    @patch('database.session_scope')
+    def test_save_message(self, mock_session_scope, mock_remember):
+        mock_session = mock_session_scope.return_value.__enter__.return_value
 
         save_message("user", "Hello", "2024-08-12T21:54:44", {"id": "model-id"})
 
-        mock_session.return_value.add.assert_called()
-        mock_session.return_value.commit.assert_called()
+        mock_session.add.assert_called()
+        mock_session_scope.return_value.__exit__.assert_called()
 
-    @patch('app.sessionmaker')
-    def test_load_chat_history(self, mock_sessionmaker):
-        mock_session = MagicMock()
-        mock_sessionmaker.return_value = mock_session
-        mock_session.return_value = mock_session
+    @patch('chat_core.session_scope')
+    def test_load_chat_history(self, mock_session_scope):
+        mock_session = mock_session_scope.return_value.__enter__.return_value
 
-        mock_session.return_value.query.return_value.order_by.return_value.all.return_value = [
+        mock_session.query.return_value.order_by.return_value.all.return_value = [
             MagicMock(role="user", content="Hello", timestamp=datetime(2024, 8, 12, 21, 54, 44), model_id="model-id")
         ]
 
@@ -35,16 +34,53 @@ class TestAppFunctions(unittest.TestCase):
         self.assertEqual(history[0]["role"], "user")
         self.assertEqual(history[0]["content"], "Hello")
 
-    @patch('app.sessionmaker')
-    def test_clear_chat_history(self, mock_sessionmaker):
-        mock_session = MagicMock()
-        mock_sessionmaker.return_value = mock_session
-        mock_session.return_value = mock_session
-
-        clear_chat_history()
-
-        mock_session.return_value.query.return_value.delete.assert_called()
-        mock_session.return_value.commit.assert_called()
+    @patch('chat_core.session_scope')
+    def test_load_chat_history_page(self, mock_session_scope):
+        mock_session = mock_session_scope.return_value.__enter__.return_value
+        rows = [
+            MagicMock(id=i, role="user", content=f"Message {i}", timestamp=datetime(2024, 8, 12, 21, 54, i),
+                      model_id="model-id")
+            for i in (9, 8, 7)
+        ]
+        mock_query = mock_session.query.return_value.filter.return_value
+        mock_query.order_by.return_value.limit.return_value.all.return_value = rows
+
+        page, has_older = load_chat_history_page(before_id=10, limit=2)
+
+        mock_query.order_by.return_value.limit.assert_called_with(3)
+        self.assertTrue(has_older)
+        self.assertEqual([msg["id"] for msg in page], [8, 9])
+
+    @patch('chat_core.forget_conversation')
+    @patch('chat_core.clear_summary')
+    @patch('chat_core.session_scope')
+    def test_clear_chat_history(self, mock_session_scope, mock_clear_summary, mock_forget_conversation):
+        mock_session = mock_session_scope.return_value.__enter__.return_value
+
+        clear_chat_history(conversation_id=1)
+
+        mock_session.query.return_value.filter.return_value.delete.assert_called()
+        mock_clear_summary.assert_called_with(1)
+        mock_forget_conversation.assert_called_with(1)
+        mock_session_scope.return_value.__exit__.assert_called()
+
+    @patch('chat_core.record_turn')
+    def test_stream_chat_response(self, mock_record_turn):
+        mock_client = MagicMock()
+        chunks = []
+        for text in ["Hel", None, "lo"]:
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = text
+            chunks.append(chunk)
+        mock_client.chat.completions.create.return_value = iter(chunks)
+
+        timings = {}
+        reply = "".join(stream_chat_response(mock_client, [{"role": "user", "content": "Hi"}], "model-id", timings))
+
+        self.assertEqual(reply, "Hello")
+        self.assertTrue(mock_client.chat.completions.create.call_args.kwargs["stream"])
+        self.assertLessEqual(timings["ttft"], timings["total_time"])
+        self.assertTrue(mock_record_turn.call_args.kwargs["streamed"])
 
     @patch('app.Groq')
     def test_transcribe_audio(self, mock_groq):
@@ -54,19 +90,26 @@ class TestAppFunctions(unittest.TestCase):
         transcript = transcribe_audio(mock_client, "uploads/test_audio.mp3")
         self.assertEqual(transcript, "Transcribed text")
 
-    @patch('app.create_engine')
-    def test_initialize_db(self, mock_create_engine):
+    @patch('chat_core.ensure_search_index')
+    @patch('chat_core.Base.metadata.create_all')
+    @patch('chat_core.get_engine')
+    def test_initialize_db(self, mock_get_engine, mock_create_all, mock_ensure_search_index):
         mock_engine = MagicMock()
-        mock_create_engine.return_value = mock_engine
+        mock_get_engine.return_value = mock_engine
 
         initialize_db()
 
-        mock_engine.execute.assert_called()
-        mock_engine.create_all.assert_called()
+        mock_create_all.assert_called_with(mock_engine)
+        mock_ensure_search_index.assert_called_with(mock_engine)
 
-    @patch('app.requests.get')
-    @patch('app.os.getenv')
+    @patch('chat_core.requests.get')
+    @patch('chat_core.os.getenv')
     def test_get_groq_models(self, mock_getenv, mock_requests_get):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        catalog_path = patch('model_catalog.CATALOG_PATH', os.path.join(tmp_dir.name, "model_catalog.json"))
+        catalog_path.start()
+        self.addCleanup(catalog_path.stop)
         mock_getenv.return_value = "fake_api_key"
         mock_response = MagicMock()
         mock_response.ok = True
@@ -83,10 +126,10 @@ class TestAppFunctions(unittest.TestCase):
         self.assertEqual(models[0]["name"], "model-1")
         self.assertEqual(models[1]["name"], "model-2")
 
-    @patch('app.open', new_callable=unittest.mock.mock_open, read_data='{"GROQ_API_KEY": "fake_api_key"}')
-    @patch('app.os.path.join')
-    @patch('app.os.path.dirname')
-    @patch('app.os.path.abspath')
+    @patch('chat_core.open', new_callable=unittest.mock.mock_open, read_data='{"GROQ_API_KEY": "fake_api_key"}')
+    @patch('chat_core.os.path.join')
+    @patch('chat_core.os.path.dirname')
+    @patch('chat_core.os.path.abspath')
     def test_load_configuration(self, mock_abspath, mock_dirname, mock_join, mock_open):
         mock_abspath.return_value = "/fake/path"
         mock_dirname.return_value = "/fake"
@@ -95,16 +138,17 @@ class TestAppFunctions(unittest.TestCase):
         config = load_configuration()
         self.assertEqual(config["GROQ_API_KEY"], "fake_api_key")
 
-    @patch('app.sessionmaker')
-    def test_save_feedback(self, mock_sessionmaker):
-        mock_session = MagicMock()
-        mock_sessionmaker.return_value = mock_session
-        mock_session.return_value = mock_session
+    @patch('database.session_scope')
+    def test_save_feedback(self, mock_session_scope):
+        mock_session = mock_session_scope.return_value.__enter__.return_value
+        mock_session.execute.return_value.scalar.return_value = 0
 
         save_feedback(1, True, "Great response!")
 
-        mock_session.return_value.add.assert_called()
-        mock_session.return_value.commit.assert_called()
+        statement = str(mock_session.execute.call_args.args[0])
+        self.assertIn("ON CONFLICT (chat_message_id) DO UPDATE", statement)
+        mock_session.add.assert_not_called()
+        mock_session_scope.return_value.__exit__.assert_called()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+import io
+import os
+import unittest
+import wave
+from unittest.mock import MagicMock, patch
+
+import audio_pipeline
+from audio_pipeline import cleanup_uploads, save_upload, split_audio, stitch_transcripts, transcribe_file
+from db_testing import TemporaryDatabaseTestCase
+
+
+def write_wav(path, seconds, frame_rate=1000):
+    with wave.open(path, "wb") as target:
+        target.setnchannels(1)
+        target.setsampwidth(2)
+        target.setframerate(frame_rate)
+        target.writeframes(b"\x00\x01" * int(seconds * frame_rate))
+
+
+class TestAudioPipeline(TemporaryDatabaseTestCase):
+
+    def test_save_upload_deduplicates_by_content(self):
+        first_path, first_hash = save_upload(io.BytesIO(b"audio" * 1000), "a.MP3", self.tmp_dir.name)
+        second_path, second_hash = save_upload(io.BytesIO(b"audio" * 1000), "b.mp3", self.tmp_dir.name)
+
+        self.assertEqual(first_path, second_path)
+        self.assertEqual(first_hash, second_hash)
+        self.assertTrue(first_path.endswith(".mp3"))
+        self.assertFalse([name for name in os.listdir(self.tmp_dir.name) if name.endswith(".part")])
+
+    def test_cleanup_uploads_removes_old_files(self):
+        old_path = os.path.join(self.tmp_dir.name, "old.wav")
+        open(old_path, "wb").close()
+        os.utime(old_path, (0, 0))
+
+        self.assertEqual(cleanup_uploads(self.tmp_dir.name, max_age_seconds=60), 1)
+        self.assertFalse(os.path.exists(old_path))
+
+    def test_split_wav_into_overlapping_segments(self):
+        path = os.path.join(self.tmp_dir.name, "long.wav")
+        write_wav(path, 25)
+        out_dir = os.path.join(self.tmp_dir.name, "segments")
+        os.makedirs(out_dir)
+
+        with patch.object(audio_pipeline, "SEGMENT_SECONDS", 10):
+            segments = split_audio(path, out_dir)
+
+        durations = []
+        for segment in segments:
+            with wave.open(segment, "rb") as source:
+                durations.append(source.getnframes() / source.getframerate())
+        self.assertEqual(durations, [10, 12, 7])  # later segments start two seconds early
+
+    def test_stitch_drops_overlapping_words(self):
+        text = stitch_transcripts(["the quick brown fox", "Brown fox jumps over", "over the lazy dog."])
+        self.assertEqual(text, "the quick brown fox jumps over the lazy dog.")
+
+    def test_transcribe_file_runs_segments_and_caches(self):
+        path = os.path.join(self.tmp_dir.name, "long.wav")
+        write_wav(path, 25)
+        client = MagicMock()
+        client.audio.transcriptions.create.side_effect = lambda file, **kwargs: MagicMock(text=file[0])
+
+        with patch.object(audio_pipeline, "SEGMENT_SECONDS", 10):
+            text = transcribe_file(client, path, "whisper-large-v3")
+            cached = transcribe_file(client, path, "whisper-large-v3")
+
+        self.assertEqual(text, "segment_0000.wav segment_0001.wav segment_0002.wav")
+        self.assertEqual(cached, text)
+        self.assertEqual(client.audio.transcriptions.create.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from batch_runner import load_checkpoint, run_batch
+
+
+def reply(text):
+    response = MagicMock()
+    response.choices[0].message.content = text
+    return response
+
+
+class TestBatchRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.tmp_dir.name, "prompts.jsonl")
+        self.output_path = os.path.join(self.tmp_dir.name, "results.jsonl")
+        with open(self.input_path, "w") as f:
+            for i in range(6):
+                f.write(json.dumps({"id": f"q{i}", "prompt": f"question {i}"}) + "\n")
+        record_turn = patch('chat_core.record_turn')
+        record_turn.start()
+        self.addCleanup(record_turn.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_output(self):
+        with open(self.output_path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_runs_every_request_and_reports_percentiles(self):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = lambda model, messages: reply(messages[-1]["content"].upper())
+
+        stats = run_batch(client, self.input_path, self.output_path, model="m", concurrency=3, use_cache=False)
+
+        results = {result["id"]: result for result in self.read_output()}
+        self.assertEqual(results["q4"]["reply"], "QUESTION 4")
+        self.assertEqual((stats["completed"], stats["failed"], stats["skipped"]), (6, 0, 0))
+        self.assertLessEqual(stats["latency_p50"], stats["latency_p99"])
+
+    def test_resume_skips_successes_and_retries_failures(self):
+        with open(self.output_path, "w") as f:
+            f.write(json.dumps({"id": "q0", "reply": "done", "error": None}) + "\n")
+            f.write(json.dumps({"id": "q1", "reply": None, "error": "RateLimitError"}) + "\n")
+            f.write('{"id": "q2", "rep')  # killed mid-write
+        client = MagicMock()
+        client.chat.completions.create.return_value = reply("ok")
+
+        stats = run_batch(client, self.input_path, self.output_path, model="m", use_cache=False)
+
+        self.assertEqual((stats["completed"], stats["skipped"]), (5, 1))
+        self.assertEqual(client.chat.completions.create.call_count, 5)
+        self.assertEqual(load_checkpoint(self.output_path), {f"q{i}" for i in range(6)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from context_window import build_context, estimate_tokens, get_context_limit, load_summary
+from db_testing import TemporaryDatabaseTestCase
+
+
+def make_history(count, words_per_message=200):
+    start = datetime(2024, 8, 12, 21, 54, 44)
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Message {i}. " + "word " * words_per_message,
+            "timestamp": (start + timedelta(seconds=i)).isoformat(),
+            "model_id": "llama3-8b-8192"
+        }
+        for i in range(count)
+    ]
+
+
+class TestContextWindow(TemporaryDatabaseTestCase):
+
+    def test_context_limit_from_models_info(self):
+        self.assertEqual(get_context_limit("llama-3.1-8b-instant"), 131072)
+        self.assertEqual(get_context_limit("llama3-8b-8192"), 8192)
+
+    def test_short_history_is_sent_verbatim(self):
+        history = make_history(4, words_per_message=5)
+        messages = build_context(history, "system", "llama3-8b-8192")
+        self.assertEqual(len(messages), 5)
+        self.assertIsNone(load_summary())
+
+    @patch('context_window.MAX_PROMPT_TOKENS', 2048)
+    def test_long_history_is_bounded_and_summarized(self):
+        history = make_history(200, words_per_message=20)
+        messages = build_context(history, "system", "llama3-8b-8192")
+
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        self.assertLessEqual(prompt_tokens, 2048)
+        self.assertEqual(messages[-1]["content"], history[-1]["content"])
+        self.assertIn("Summary of the earlier conversation", messages[1]["content"])
+
+        # The next turn only folds the newly dropped messages
+        first_summary = load_summary()
+        history.extend(make_history(202, words_per_message=20)[200:])
+        build_context(history, "system", "llama3-8b-8192")
+        self.assertEqual(load_summary().summarized_through, first_summary.summarized_through)
+
+
+if __name__ == '__main__':
+    unittest.main()
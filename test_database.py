@@ -0,0 +1,110 @@
+import os
+import unittest
+from datetime import datetime
+
+from sqlalchemy import inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+import database
+from database import Base, ChatMessage, Conversation, Feedback, WriteBehindQueue, get_engine, session_scope, \
+    migrate_schema
+from db_testing import TemporaryDatabaseTestCase
+from feedback_rollups import ensure_feedback_rollups
+from history_archive import ArchivePartition
+from metrics import WRITE_BEHIND_DROPPED
+from search_index import ensure_search_index, search_messages
+
+
+class TestDatabase(TemporaryDatabaseTestCase):
+
+    def test_engine_is_shared_and_uses_wal(self):
+        self.assertIs(get_engine(), get_engine())
+        with get_engine().connect() as connection:
+            journal_mode = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+        self.assertEqual(journal_mode, "wal")
+
+    def test_write_behind_batches_and_flushes_on_stop(self):
+        write_queue = WriteBehindQueue(flush_interval=0.01)
+        pending = [
+            write_queue.submit(ChatMessage(role="user", content=f"message {i}", timestamp=datetime.now(),
+                                           model_id="model-id"))
+            for i in range(20)
+        ]
+        write_queue.stop()
+
+        ids = [p.result(timeout=1) for p in pending]
+        self.assertEqual(len(set(ids)), 20)
+        with session_scope() as session:
+            self.assertEqual(session.query(ChatMessage).count(), 20)
+
+    def test_failing_row_does_not_drop_the_rest_of_its_batch(self):
+        dropped_before = WRITE_BEHIND_DROPPED.value(table="feedback", error="IntegrityError")
+        write_queue = WriteBehindQueue(flush_interval=0.01)
+        first = write_queue.submit(ChatMessage(role="user", content="kept", timestamp=datetime.now()))
+        orphan = write_queue.submit(Feedback(chat_message_id=12345, is_positive=True))
+        upsert = write_queue.submit(sqlite_insert(ChatMessage).values(role="user", content="also kept")
+                                    .returning(ChatMessage.id))
+        write_queue.stop()
+
+        with self.assertRaises(IntegrityError):
+            orphan.result(timeout=1)
+        self.assertEqual(first.result(timeout=1), 1)
+        self.assertEqual(upsert.result(timeout=1), 2)
+        self.assertEqual(WRITE_BEHIND_DROPPED.value(table="feedback", error="IntegrityError"), dropped_before + 1)
+        with session_scope() as session:
+            self.assertEqual(session.query(ChatMessage).count(), 2)
+
+    def test_migrate_legacy_schema(self):
+        database.dispose_engine()
+        os.remove(database.DB_NAME)
+        with get_engine().begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE chat_history (id INTEGER PRIMARY KEY, role VARCHAR, "
+                                       "content VARCHAR, timestamp DATETIME, model_id VARCHAR)")
+            connection.exec_driver_sql("INSERT INTO chat_history (role, content, timestamp, model_id) "
+                                       "VALUES ('user', 'Hello', '2024-08-12 21:54:44.000000', 'model-id')")
+
+        Base.metadata.create_all(get_engine())
+        migrate_schema()
+        migrate_schema()  # idempotent
+
+        with session_scope() as session:
+            conversation = session.query(Conversation).one()
+            self.assertEqual(session.query(ChatMessage).one().conversation_id, conversation.id)
+        index_names = {index["name"] for index in inspect(get_engine()).get_indexes("chat_history")}
+        self.assertIn("ix_chat_history_conversation_id_id", index_names)
+        self.assertIn("ix_chat_history_model_id_timestamp", index_names)
+
+    def test_migration_switches_message_ids_to_autoincrement(self):
+        database.dispose_engine()
+        os.remove(database.DB_NAME)
+        with get_engine().begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE chat_history (id INTEGER PRIMARY KEY, conversation_id INTEGER, "
+                                       "role VARCHAR, content VARCHAR, timestamp DATETIME, model_id VARCHAR)")
+        Base.metadata.create_all(get_engine())
+        ensure_search_index()
+        ensure_feedback_rollups()
+        with session_scope() as session:
+            session.add(ChatMessage(id=7, role="assistant", content="kept", timestamp=datetime(2024, 8, 12)))
+            session.add(Feedback(chat_message_id=7, is_positive=True))
+            session.add(ArchivePartition(conversation_id=1, month="2024-07", messages=3, oldest_id=1, newest_id=20))
+
+        migrate_schema()
+        migrate_schema()  # idempotent
+        ensure_search_index()
+
+        with session_scope() as session:
+            self.assertEqual(session.query(Feedback).one().chat_message_id, 7)
+            message = ChatMessage(role="user", content="after the migration", timestamp=datetime.now())
+            session.add(message)
+            session.flush()
+            self.assertEqual(message.id, 21)
+        self.assertEqual([result["id"] for result in search_messages("migration")[0]], [21])
+        index_names = {index["name"] for index in inspect(get_engine()).get_indexes("chat_history")}
+        self.assertIn("ix_chat_history_conversation_id_id", index_names)
+        with get_engine().connect() as connection:
+            self.assertEqual(connection.exec_driver_sql("PRAGMA foreign_keys").scalar(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import unittest
+from datetime import date, datetime
+from unittest.mock import patch
+
+import chat_core
+import database
+from database import ChatMessage, Feedback, get_engine, session_scope
+from db_testing import TemporaryDatabaseTestCase
+from feedback_rollups import feedback_by_day, feedback_summary, rebuild_feedback_rollups
+from history_archive import archive_path, run_maintenance
+
+
+class TestFeedbackRollups(TemporaryDatabaseTestCase):
+    app_schema = True
+
+    def setUp(self):
+        super().setUp()
+        self.conversation_id = chat_core.default_conversation("alice")[1]
+
+    def reply(self, model_id, timestamp):
+        return chat_core.save_message("assistant", "reply", timestamp, {"id": model_id}, self.conversation_id)
+
+    def test_upsert_keeps_one_row_per_message(self):
+        message_id = self.reply("m", "2024-08-12T10:00:00")
+
+        self.assertFalse(chat_core.save_feedback(message_id, True, "good"))
+        self.assertTrue(chat_core.save_feedback(message_id, False, "changed my mind"))
+
+        with session_scope() as session:
+            rows = session.query(Feedback).all()
+            self.assertEqual([(row.is_positive, row.comment, row.revision) for row in rows],
+                             [(False, "changed my mind", 1)])
+
+    def test_rollups_follow_inserts_and_changed_votes(self):
+        first = self.reply("fast", "2024-08-12T10:00:00")
+        second = self.reply("fast", "2024-08-12T23:00:00")
+        third = self.reply("fast", "2024-08-13T09:00:00")
+        other = self.reply("slow", "2024-08-13T09:00:00")
+        chat_core.save_feedback(first, True, None)
+        chat_core.save_feedback(second, True, None)
+        chat_core.save_feedback(second, False, None)  # vote changed
+        chat_core.save_feedback(second, False, "still no")  # comment only
+        chat_core.save_feedback(third, True, None)
+        chat_core.save_feedback(other, False, None)
+
+        self.assertEqual(feedback_by_day("fast"), [{"day": "2024-08-12", "positive": 1, "negative": 1},
+                                                   {"day": "2024-08-13", "positive": 1, "negative": 0}])
+        summary = {row["model"]: row for row in feedback_summary()}
+        self.assertEqual((summary["fast"]["positive"], summary["fast"]["negative"]), (2, 1))
+        self.assertEqual(summary["slow"]["approval"], 0.0)
+        self.assertEqual(feedback_summary(start=date(2024, 8, 13), model_id="fast")[0]["positive"], 1)
+
+        rollups = feedback_by_day("fast")
+        rebuild_feedback_rollups()
+        self.assertEqual(feedback_by_day("fast"), rollups)
+
+    @patch('history_archive.RETENTION_MAX_MESSAGES', 1)
+    def test_rebuild_keeps_archived_feedback(self):
+        archived = self.reply("fast", "2024-07-01T10:00:00")
+        live = self.reply("fast", "2024-08-12T10:00:00")
+        chat_core.save_feedback(archived, False, None)
+        chat_core.save_feedback(live, True, None)
+        with patch('history_archive.ARCHIVE_DIR', os.path.join(self.tmp_dir.name, "archive")):
+            run_maintenance(force=True)
+            rollups = feedback_by_day("fast")
+
+            rebuild_feedback_rollups()
+            self.assertEqual(feedback_by_day("fast"), rollups)
+            self.assertEqual(rollups[0], {"day": "2024-07-01", "positive": 0, "negative": 1})
+
+            os.remove(archive_path("2024-07"))
+            with self.assertRaises(FileNotFoundError):
+                rebuild_feedback_rollups()
+            self.assertEqual(feedback_by_day("fast"), rollups)
+
+    @patch('history_archive.RETENTION_MAX_MESSAGES', 1)
+    def test_rebuild_counts_archived_feedback_whose_id_was_reused(self):
+        archived = self.reply("fast", "2024-07-01T10:00:00")
+        self.reply("fast", "2024-08-12T10:00:00")
+        chat_core.save_feedback(archived, False, None)
+        with patch('history_archive.ARCHIVE_DIR', os.path.join(self.tmp_dir.name, "archive")):
+            run_maintenance(force=True)
+            # Databases from before AUTOINCREMENT ids could hand an archived id to a new message
+            with session_scope() as session:
+                session.add(ChatMessage(id=archived, conversation_id=self.conversation_id, role="assistant",
+                                        content="another reply", timestamp=datetime(2024, 8, 13), model_id="fast"))
+            chat_core.save_feedback(archived, True, None)
+
+            rebuild_feedback_rollups()
+
+        self.assertEqual(feedback_by_day("fast"), [{"day": "2024-07-01", "positive": 0, "negative": 1},
+                                                   {"day": "2024-08-13", "positive": 1, "negative": 0}])
+
+    def test_migration_drops_duplicates_before_adding_the_unique_index(self):
+        message_id = self.reply("m", "2024-08-12T10:00:00")
+        with get_engine().begin() as connection:
+            connection.exec_driver_sql("DROP INDEX ix_feedback_chat_message_id")
+            connection.exec_driver_sql("INSERT INTO feedback (chat_message_id, is_positive) VALUES (?, 1)",
+                                       (message_id,))
+            connection.exec_driver_sql("INSERT INTO feedback (chat_message_id, is_positive) VALUES (?, 0)",
+                                       (message_id,))
+
+        database.migrate_schema()
+
+        with session_scope() as session:
+            self.assertEqual([row.is_positive for row in session.query(Feedback)], [False])
+        self.assertTrue(chat_core.save_feedback(message_id, True, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import gzip
+import json
+import os
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import chat_core
+import history_archive
+from database import ChatMessage, Feedback, get_engine, session_scope
+from db_testing import TemporaryDatabaseTestCase
+from history_archive import archive_path, load_archived_page, run_maintenance
+
+
+class TestHistoryArchive(TemporaryDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        archive_dir = patch('history_archive.ARCHIVE_DIR', os.path.join(self.tmp_dir.name, "archive"))
+        archive_dir.start()
+        self.addCleanup(archive_dir.stop)
+        self.conversation_id = chat_core.default_conversation("alice")[1]
+
+    def add_messages(self, start: datetime, count: int, step=timedelta(days=1)):
+        ids = []
+        for i in range(count):
+            timestamp = (start + i * step).isoformat()
+            ids.append(chat_core.save_message("user", f"message {len(ids)} at {timestamp}", timestamp,
+                                              {"id": "m"}, self.conversation_id))
+        return ids
+
+    def live_ids(self):
+        with session_scope() as session:
+            return [row.id for row in session.query(ChatMessage.id).order_by(ChatMessage.id)]
+
+    @patch('history_archive.RETENTION_DAYS', 30)
+    def test_age_policy_archives_messages_and_feedback_by_month(self):
+        old = self.add_messages(datetime(2024, 1, 30), 4)  # Jan 30 .. Feb 2
+        recent = self.add_messages(datetime.now() - timedelta(days=1), 2, step=timedelta(minutes=1))
+        chat_core.save_feedback(old[0], True, "great")
+
+        result = run_maintenance(force=True)
+
+        self.assertEqual(result["archived"], 4)
+        self.assertEqual(self.live_ids(), recent)
+        with session_scope() as session:
+            self.assertEqual(session.query(Feedback).count(), 0)
+        with gzip.open(archive_path("2024-01"), "rt") as archive_file:
+            january = [json.loads(line) for line in archive_file]
+        self.assertEqual([record["id"] for record in january], old[:2])
+        self.assertEqual(january[0]["feedback"], [{"is_positive": True, "comment": "great"}])
+        self.assertTrue(os.path.exists(archive_path("2024-02")))
+
+    @patch('history_archive.RETENTION_MAX_MESSAGES', 3)
+    def test_scrolling_past_the_live_window_reads_the_archive(self):
+        ids = self.add_messages(datetime(2024, 3, 1), 8, step=timedelta(days=10))  # Mar 1 .. May 10
+        run_maintenance(force=True)
+        self.assertEqual(self.live_ids(), ids[-3:])
+
+        first, has_more = chat_core.load_chat_history_page(self.conversation_id, limit=4)
+        self.assertEqual([msg["id"] for msg in first], ids[4:])
+        self.assertTrue(first[0]["archived"])
+        self.assertTrue(has_more)
+        second, has_more = chat_core.load_chat_history_page(self.conversation_id, before_id=first[0]["id"], limit=4)
+        self.assertEqual([msg["id"] for msg in second], ids[:4])
+        self.assertFalse(has_more)
+
+    @patch('history_archive.RETENTION_MAX_MESSAGES', 1)
+    def test_appends_are_read_back_and_cleared_conversations_stay_hidden(self):
+        ids = self.add_messages(datetime(2024, 6, 1), 2, step=timedelta(hours=1))
+        run_maintenance(force=True)
+        self.assertEqual([msg["id"] for msg in load_archived_page(self.conversation_id)[0]], ids[:1])
+
+        ids += self.add_messages(datetime(2024, 6, 2), 1)
+        run_maintenance(force=True)
+        self.assertEqual([msg["id"] for msg in load_archived_page(self.conversation_id)[0]], ids[:2])
+
+        chat_core.clear_conversation(self.conversation_id)
+        self.assertEqual(load_archived_page(self.conversation_id), ([], False))
+
+    @patch('history_archive.RETENTION_MAX_MESSAGES', 1)
+    @patch('history_archive.ARCHIVE_CACHE_FILES', 1)
+    def test_archive_files_are_parsed_once_and_evicted(self):
+        self.add_messages(datetime(2024, 3, 1), 3, step=timedelta(days=31))  # Mar, Apr, May
+        other_conversation = chat_core.default_conversation("bob")[1]
+        run_maintenance(force=True)
+        march, april = archive_path("2024-03"), archive_path("2024-04")
+
+        with patch.dict(history_archive._archive_cache, clear=True), \
+                patch('history_archive._parse_archive', wraps=history_archive._parse_archive) as mock_parse:
+            self.assertEqual(len(history_archive._read_archive(march, self.conversation_id)), 1)
+            self.assertEqual(history_archive._read_archive(march, other_conversation), [])
+            self.assertEqual(mock_parse.call_count, 1)
+
+            history_archive._read_archive(april, self.conversation_id)
+            self.assertEqual(list(history_archive._archive_cache), [os.path.abspath(april)])
+            history_archive._read_archive(march, self.conversation_id)
+            self.assertEqual(mock_parse.call_count, 3)
+
+    @patch('history_archive.RETENTION_MAX_MESSAGES', 1)
+    def test_ids_are_not_reused_once_every_live_message_is_cleared(self):
+        ids = self.add_messages(datetime(2024, 3, 1), 5)
+        other_conversation = chat_core.default_conversation("bob")[1]
+        chat_core.save_message("user", "bob's message", datetime(2024, 3, 9).isoformat(), {"id": "m"},
+                               other_conversation)
+        run_maintenance(force=True)
+        chat_core.clear_conversation(other_conversation)  # leaves no live message at all
+
+        ids.append(chat_core.save_message("user", "new message", datetime(2024, 4, 1).isoformat(), {"id": "m"},
+                                          self.conversation_id))
+
+        page, has_more = chat_core.load_chat_history_page(self.conversation_id, limit=10)
+        self.assertEqual([msg["id"] for msg in page], ids)
+        self.assertFalse(has_more)
+
+    def test_runs_are_spaced_across_processes(self):
+        self.assertIsNotNone(run_maintenance())
+        self.assertIsNone(run_maintenance())
+        with patch('history_archive.MAINTENANCE_INTERVAL', 0):
+            self.assertIsNotNone(run_maintenance())
+
+    def test_new_databases_use_incremental_vacuum(self):
+        with get_engine().connect() as connection:
+            self.assertEqual(connection.exec_driver_sql("PRAGMA auto_vacuum").scalar(), 2)
+        self.assertEqual(history_archive.archive_stats()["live_messages"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import time
+import unittest
+from types import SimpleNamespace
+
+import metrics
+import metrics_store
+from database import session_scope
+from db_testing import TemporaryDatabaseTestCase
+from metrics import Counter, Histogram, Registry, percentile, span
+from metrics_store import RequestMetric, latency_by_model, record_turn
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_exposition_format(self):
+        registry = Registry()
+        requests = registry.counter("requests_total", "Requests.", ("model",))
+        latency = registry.histogram("latency_seconds", "Latency.", ("model",), buckets=(0.1, 1.0))
+        requests.inc(model='say "hi"')
+        latency.observe(0.05, model="a")
+        latency.observe(0.5, model="a")
+        latency.observe(5, model="a")
+
+        text = registry.exposition()
+
+        self.assertIn("# TYPE requests_total counter", text)
+        self.assertIn('requests_total{model="say \\"hi\\""} 1', text)
+        self.assertIn('latency_seconds_bucket{model="a",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{model="a",le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{model="a",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{model="a"} 3', text)
+
+    def test_span_counts_errors_by_class(self):
+        histogram = Histogram("h", "h", ("op",))
+        errors = Counter("e", "e", ("op", "error"))
+
+        with self.assertRaises(KeyError):
+            with span(histogram, errors, op="x"):
+                raise KeyError("missing")
+        with span(histogram, errors, op="x"):
+            pass
+
+        self.assertEqual(histogram.count(op="x"), 2)
+        self.assertEqual(errors.value(op="x", error="KeyError"), 1)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+        self.assertEqual(percentile([], 95), 0.0)
+
+
+class TestRequestMetrics(TemporaryDatabaseTestCase):
+
+    def test_percentiles_by_model_skip_errors_and_cache_hits(self):
+        for latency in (0.1, 0.2, 0.3, 0.4):
+            record_turn("fast", {"total_time": latency, "ttft": latency / 2},
+                        SimpleNamespace(prompt_tokens=10, completion_tokens=5))
+        record_turn("fast", {"total_time": 9.0}, error=TimeoutError())
+        record_turn("fast", {"total_time": 0.001, "cache_hit": True})
+        record_turn("slow", {"total_time": 2.0}, streamed=True)
+
+        summary = {row["model"]: row for row in latency_by_model()}
+
+        self.assertEqual(summary["fast"]["turns"], 6)
+        self.assertEqual((summary["fast"]["p50"], summary["fast"]["p99"]), (0.2, 0.4))
+        self.assertAlmostEqual(summary["fast"]["error_rate"], 1 / 6)
+        self.assertEqual(summary["fast"]["prompt_tokens"], 40)
+        self.assertEqual(summary["slow"]["p95"], 2.0)
+        with session_scope() as session:
+            error = session.query(RequestMetric.error_class).filter(RequestMetric.error_class.isnot(None)).scalar()
+        self.assertEqual(error, "TimeoutError")
+        self.assertEqual(latency_by_model(since=time.time() + 60), [])
+
+    def test_database_statements_are_timed(self):
+        before = metrics.DB_STATEMENT_SECONDS.count(statement="SELECT")
+
+        latency_by_model()
+
+        self.assertGreater(metrics.DB_STATEMENT_SECONDS.count(statement="SELECT"), before)
+
+    def test_disabled_store_still_counts(self):
+        metrics_store.REQUEST_METRICS_ENABLED = False
+        try:
+            record_turn("quiet", {"total_time": 0.1})
+        finally:
+            metrics_store.REQUEST_METRICS_ENABLED = True
+
+        self.assertEqual(latency_by_model(), [])
+        self.assertEqual(metrics.CHAT_TURNS.value(model="quiet", outcome="ok"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
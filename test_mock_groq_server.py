@@ -0,0 +1,47 @@
+import time
+import unittest
+
+import httpx
+from groq import Groq
+
+from mock_groq_server import MockGroqConfig, MockGroqServer
+
+
+class TestMockGroqServer(unittest.TestCase):
+
+    def setUp(self):
+        self.config = MockGroqConfig(completion_tokens=4)
+        self.server = MockGroqServer(self.config).start()
+        self.client = Groq(base_url=self.server.base_url, api_key="mock", max_retries=0, http_client=httpx.Client())
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_chat_completion_with_usage(self):
+        response = self.client.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}])
+
+        self.assertEqual(response.choices[0].message.content, "hi hi hi hi")
+        self.assertEqual(response.usage.completion_tokens, 4)
+
+    def test_streaming_is_paced_by_token_rate(self):
+        self.config.tokens_per_second = 40
+        start = time.perf_counter()
+        stream = self.client.chat.completions.create(model="m", messages=[{"role": "user", "content": "go"}],
+                                                     stream=True)
+        deltas = [chunk.choices[0].delta.content for chunk in stream if chunk.choices[0].delta.content]
+
+        self.assertEqual(deltas, ["go "] * 4)
+        self.assertGreaterEqual(time.perf_counter() - start, 4 / 40)
+
+    def test_models_and_transcriptions(self):
+        models = httpx.get(f"{self.server.base_url}/openai/v1/models").json()["data"]
+        transcript = self.client.audio.transcriptions.create(file=("clip.wav", b"data"), model="whisper-large-v3")
+
+        self.assertIn("llama3-8b-8192", [model["id"] for model in models])
+        self.assertTrue(transcript.text.startswith("Transcribed"))
+        self.assertEqual(self.config.requests, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
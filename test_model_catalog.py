@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from model_catalog import ModelCatalog
+
+MODELS = [{"name": "m1", "id": "m1", "info": ""}, {"name": "m2", "id": "m2", "info": ""}]
+DESCRIPTIONS = {"m1": "- Developer: Meta", "bundled": "- Developer: Groq"}
+
+
+class TestModelCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "model_catalog.json")
+        self.fetch = MagicMock(return_value=MODELS)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def catalog(self, ttl=300):
+        return ModelCatalog(self.fetch, lambda: DESCRIPTIONS, path=self.path, ttl=ttl)
+
+    def wait_for_refresh(self, catalog):
+        for _ in range(100):
+            if not catalog._refreshing.locked():
+                return
+            time.sleep(0.01)
+
+    def test_first_fetch_is_stored_and_shared(self):
+        models = self.catalog().models()
+
+        self.assertEqual(models[0]["description"], "- Developer: Meta")
+        self.assertEqual(models[1]["description"], "")
+        # Another process (a fresh catalog object) reads the stored copy without calling the API
+        self.assertEqual(self.catalog().models(), models)
+        self.fetch.assert_called_once()
+
+    def test_stale_copy_is_served_while_refreshing_in_background(self):
+        catalog = self.catalog(ttl=0)
+        catalog.models()
+        release = threading.Event()
+        self.fetch.side_effect = lambda: release.wait(5) and [{"name": "m3", "id": "m3", "info": ""}]
+
+        self.assertEqual([model["id"] for model in catalog.models()], ["m1", "m2"])
+        release.set()
+        self.wait_for_refresh(catalog)
+
+        catalog._ttl = 300
+        self.assertEqual([model["id"] for model in catalog.models()], ["m3"])
+
+    def test_failed_refresh_keeps_last_good_copy(self):
+        catalog = self.catalog(ttl=0)
+        catalog.models()
+        self.fetch.side_effect = ConnectionError("offline")
+
+        catalog.refresh()
+
+        self.assertEqual([model["id"] for model in catalog.models()], ["m1", "m2"])
+        status = catalog.status()
+        self.assertIn("offline", status["last_error"])
+        with open(self.path) as catalog_file:
+            self.assertEqual(len(json.load(catalog_file)["models"]), 2)
+
+    def test_unreachable_api_without_a_copy_falls_back_to_bundled_models(self):
+        self.fetch.side_effect = ConnectionError("offline")
+        catalog = self.catalog()
+
+        self.assertEqual([model["id"] for model in catalog.models()], ["m1", "bundled"])
+        self.assertEqual([model["id"] for model in catalog.models()], ["m1", "bundled"])
+        # The second call backs off instead of waiting on the API again
+        self.fetch.assert_called_once()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_one_refresher_at_a_time(self):
+        catalog = self.catalog(ttl=0)
+        catalog.models()
+        self.fetch.reset_mock()
+        started, release = threading.Event(), threading.Event()
+        self.fetch.side_effect = lambda: started.set() or release.wait(5) and MODELS
+
+        for _ in range(5):
+            catalog.models()
+        self.assertTrue(started.wait(5))
+        other_process = self.catalog(ttl=0)
+        self.assertIsNone(other_process.refresh(blocking=False))
+        release.set()
+        self.wait_for_refresh(catalog)
+
+        self.fetch.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+
+from model_compare import compare_models, fan_out
+
+
+def make_client(delays, failing=()):
+    active = {"now": 0, "peak": 0}
+
+    async def create(model, messages):
+        active["now"] += 1
+        active["peak"] = max(active["peak"], active["now"])
+        try:
+            await asyncio.sleep(delays[model])
+            if model in failing:
+                raise RuntimeError("rate limited")
+            response = MagicMock()
+            response.choices[0].message.content = f"reply from {model}"
+            return response
+        finally:
+            active["now"] -= 1
+
+    async def close():
+        pass
+
+    client = MagicMock()
+    client.chat.completions.create = create
+    client.close = close
+    return client, active
+
+
+@patch('model_compare.record_turn')
+class TestModelCompare(unittest.TestCase):
+
+    def test_results_arrive_in_completion_order(self, mock_record_turn):
+        client, _ = make_client({"slow": 0.05, "fast": 0.0, "broken": 0.01}, failing={"broken"})
+        seen = []
+
+        results = compare_models([{"role": "user", "content": "Hi"}], ["slow", "fast", "broken"],
+                                 lambda result: seen.append(result["model_id"]), client_factory=lambda: client)
+
+        self.assertEqual(seen, ["fast", "broken", "slow"])
+        self.assertEqual(results[1]["error"], "rate limited")
+        self.assertEqual(results[2]["content"], "reply from slow")
+        recorded = {call.args[0]: call.args[3] for call in mock_record_turn.call_args_list}
+        self.assertIsNone(recorded["fast"])
+        self.assertIsInstance(recorded["broken"], RuntimeError)
+        self.assertEqual(len(recorded), 3)
+
+    def test_concurrency_limit_and_timeout(self, mock_record_turn):
+        client, active = make_client({"a": 0.02, "b": 0.02, "c": 0.02, "d": 5})
+
+        async def run():
+            return [result async for result in fan_out(client, [], ["a", "b", "c", "d"], max_concurrency=2,
+                                                       timeout=0.1)]
+
+        results = {result["model_id"]: result for result in asyncio.run(run())}
+        self.assertEqual(active["peak"], 2)
+        self.assertIn("Timed out", results["d"]["error"])
+        self.assertIsNone(results["a"]["error"])
+
+    @patch('model_compare.resolve_api_key', return_value="key")
+    @patch('model_compare.create_async_groq_client')
+    def test_default_client_is_the_shared_async_client(self, mock_create_client, mock_resolve_api_key,
+                                                       mock_record_turn):
+        client, _ = make_client({"m": 0.0})
+        mock_create_client.return_value = client
+
+        compare_models([], ["m"], lambda result: None)
+
+        mock_create_client.assert_called_once_with("key")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import metrics_store
+import model_router
+from model_router import AUTO_MODEL_ID, model_size, rank_models
+
+HISTORY = [{"role": "user", "content": "Hi"}]
+
+
+def health(latency, error_rate=0.0, turns=10.0):
+    return {"turns": turns, "error_rate": error_rate, "latency": latency, "latency_turns": turns * (1 - error_rate)}
+
+
+class TestRanking(unittest.TestCase):
+
+    def test_model_size(self):
+        self.assertEqual(model_size("llama-3.1-8b-instant"), 8)
+        self.assertEqual(model_size("llama3-groq-70b-8192-tool-use-preview"), 70)
+        self.assertEqual(model_size("mixtral-8x7b-32768"), 56)
+        self.assertEqual(model_size("some-model"), float("inf"))
+
+    def test_policies(self):
+        models = ["llama3-70b-8192", "llama3-8b-8192", "gemma2-9b-it"]
+        recorded = {"llama3-70b-8192": health(0.5), "llama3-8b-8192": health(3.0)}
+
+        # The unseen model is assumed to take PRIOR_LATENCY seconds
+        self.assertEqual(rank_models(models, policy="fastest", health=recorded),
+                         ["llama3-70b-8192", "gemma2-9b-it", "llama3-8b-8192"])
+        self.assertEqual(rank_models(models, policy="cheapest", health=recorded),
+                         ["llama3-8b-8192", "gemma2-9b-it", "llama3-70b-8192"])
+        self.assertEqual(rank_models(models, policy="gemma2-9b-it, llama3-8b-8192, missing", health=recorded),
+                         ["gemma2-9b-it", "llama3-8b-8192"])
+        self.assertEqual(rank_models(models, policy="missing", health=recorded)[0], "llama3-70b-8192")
+
+    def test_failing_and_too_small_models_go_last(self):
+        models = ["fast-but-failing", "small", "steady"]
+        recorded = {"fast-but-failing": health(0.1, error_rate=0.8), "small": health(0.2), "steady": health(1.0)}
+
+        with patch('model_router.get_prompt_budget', side_effect=lambda model_id: 100 if model_id == "small" else 1000):
+            self.assertEqual(rank_models(models, prompt_tokens=500, policy="fastest", health=recorded),
+                             ["steady", "fast-but-failing", "small"])
+            self.assertEqual(rank_models(models, prompt_tokens=50, policy="fastest", health=recorded),
+                             ["small", "steady", "fast-but-failing"])
+
+
+class TestModelHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict(metrics_store._health), metrics_store._health_loaded
+        metrics_store._health.clear()
+        metrics_store._health_loaded = True
+
+    def tearDown(self):
+        metrics_store._health.clear()
+        metrics_store._health.update(self.saved[0])
+        metrics_store._health_loaded = self.saved[1]
+
+    @patch('metrics_store.persist')
+    def test_turns_decay_and_reader_stops_are_ignored(self, mock_persist):
+        metrics_store.record_turn("m", {"total_time": 1.0})
+        metrics_store.record_turn("m", {"total_time": 0.1}, error=ConnectionError())
+        metrics_store.record_turn("m", {"total_time": 0.1}, error=GeneratorExit())
+        metrics_store.record_turn("m", {"total_time": 0.0, "cache_hit": True})
+        metrics_store.record_turn("m", {"total_time": 9.0, "coalesced": True})
+
+        current = metrics_store.model_health()["m"]
+        self.assertAlmostEqual(current["turns"], 2, places=3)
+        self.assertAlmostEqual(current["error_rate"], 0.5, places=3)
+        self.assertAlmostEqual(current["latency"], 1.0, places=3)
+
+        with patch('metrics_store.time.time', return_value=time.time() + metrics_store.HEALTH_HALF_LIFE):
+            later = metrics_store.model_health()["m"]
+        self.assertAlmostEqual(later["turns"], 1, places=2)
+        self.assertAlmostEqual(later["error_rate"], 0.5, places=3)
+
+
+class TestRoutedChat(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        route_patcher = patch('model_router.route', return_value=["slow", "fast"])
+        route_patcher.start()
+        self.addCleanup(route_patcher.stop)
+        self.addCleanup(self.release.set)
+
+    def complete(self, client, history, model_id, timings, use_cache, params):
+        if model_id == "slow":
+            self.release.wait(5)
+        return f"reply from {model_id}"
+
+    @patch('model_router.chat_core.complete_chat')
+    def test_fails_over_to_the_next_model(self, mock_complete):
+        mock_complete.side_effect = [ConnectionError("down"), "Hello"]
+        timings = {}
+
+        reply = model_router.complete_chat(None, HISTORY, AUTO_MODEL_ID, timings, hedge_after=0)
+
+        self.assertEqual(reply, "Hello")
+        self.assertEqual([call.args[2] for call in mock_complete.call_args_list], ["slow", "fast"])
+        self.assertEqual((timings["model_id"], timings["attempts"]), ("fast", 2))
+
+    @patch('model_router.chat_core.complete_chat')
+    def test_every_model_failing_raises_the_last_error(self, mock_complete):
+        mock_complete.side_effect = [ConnectionError("down"), TimeoutError("slow")]
+
+        with self.assertRaises(TimeoutError):
+            model_router.complete_chat(None, HISTORY, AUTO_MODEL_ID, hedge_after=0)
+
+    @patch('model_router.chat_core.complete_chat')
+    def test_slow_request_is_hedged(self, mock_complete):
+        mock_complete.side_effect = self.complete
+        timings = {}
+
+        reply = model_router.complete_chat(None, HISTORY, AUTO_MODEL_ID, timings, hedge_after=0.05)
+
+        self.assertEqual(reply, "reply from fast")
+        self.assertEqual(timings["model_id"], "fast")
+
+    @patch('model_router.chat_core.complete_chat', return_value="Hello")
+    def test_concrete_models_are_not_routed(self, mock_complete):
+        timings = {}
+        self.assertEqual(model_router.complete_chat(None, HISTORY, "model-id", timings), "Hello")
+        self.assertNotIn("model_id", timings)
+        model_router.route.assert_not_called()
+
+    @patch('model_router.chat_core.stream_chat_response')
+    def test_stream_is_hedged_on_the_first_token_and_the_loser_closed(self, mock_stream):
+        closed = threading.Event()
+
+        def stream(client, history, model_id, timings, use_cache, params):
+            try:
+                if model_id == "slow":
+                    self.release.wait(5)
+                yield f"{model_id} "
+                yield "reply"
+            finally:
+                if model_id == "slow":
+                    closed.set()
+
+        mock_stream.side_effect = stream
+        timings = {}
+
+        reply = "".join(model_router.stream_chat_response(None, HISTORY, AUTO_MODEL_ID, timings, hedge_after=0.05))
+        self.release.set()
+
+        self.assertEqual(reply, "fast reply")
+        self.assertEqual(timings["model_id"], "fast")
+        self.assertIn("total_time", timings)
+        self.assertTrue(closed.wait(5))
+
+    @patch('model_router.chat_core.acomplete_chat')
+    def test_async_hedge_cancels_the_loser(self, mock_complete):
+        cancelled = []
+
+        async def complete(client, history, model_id, timings, use_cache, params):
+            try:
+                if model_id == "slow":
+                    await asyncio.sleep(5)
+                return f"reply from {model_id}"
+            except asyncio.CancelledError:
+                cancelled.append(model_id)
+                raise
+
+        mock_complete.side_effect = complete
+        timings = {}
+
+        reply = asyncio.run(model_router.acomplete_chat(None, HISTORY, AUTO_MODEL_ID, timings, hedge_after=0.05))
+
+        self.assertEqual(reply, "reply from fast")
+        self.assertEqual(timings["model_id"], "fast")
+        self.assertEqual(cancelled, ["slow"])
+
+    @patch('model_router.chat_core.astream_chat_response')
+    def test_async_stream_fails_over_before_the_first_token(self, mock_stream):
+        async def stream(client, history, model_id, timings, use_cache, params):
+            if model_id == "slow":
+                raise ConnectionError("down")
+            yield "Hello"
+
+        mock_stream.side_effect = stream
+        timings = {}
+
+        async def collect():
+            return [delta async for delta in model_router.astream_chat_response(None, HISTORY, AUTO_MODEL_ID,
+                                                                                 timings, hedge_after=0)]
+
+        self.assertEqual(asyncio.run(collect()), ["Hello"])
+        self.assertEqual((timings["model_id"], timings["attempts"]), ("fast", 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httpx
+
+from request_scheduler import RequestScheduler, SchedulerQueueFull, SchedulerTimeout, observe_response, \
+    parse_duration
+
+
+def http_error(status, headers=None):
+    error = Exception(f"HTTP {status}")
+    error.response = MagicMock(status_code=status, headers=headers or {})
+    return error
+
+
+class TestRequestScheduler(unittest.TestCase):
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration("2"), 2.0)
+        self.assertAlmostEqual(parse_duration("2m59.5s"), 179.5)
+        self.assertAlmostEqual(parse_duration("120ms"), 0.12)
+        self.assertIsNone(parse_duration(None))
+
+    def test_retries_with_retry_after_then_succeeds(self):
+        sleeps = []
+        scheduler = RequestScheduler(sleep=sleeps.append)
+        fn = MagicMock(side_effect=[http_error(429, {"retry-after": "0"}), http_error(503), "ok"])
+
+        self.assertEqual(scheduler.call(fn, "model-a"), "ok")
+        self.assertEqual(fn.call_count, 3)
+        self.assertEqual(sleeps[0], 0.0)  # Retry-After wins over the computed backoff
+        metrics = scheduler.metrics()
+        self.assertEqual(metrics["retries"], 2)
+        self.assertEqual(metrics["rate_limited"], 1)
+
+    def test_client_errors_are_not_retried(self):
+        scheduler = RequestScheduler(sleep=lambda _: None)
+        fn = MagicMock(side_effect=http_error(400))
+        with self.assertRaises(Exception):
+            scheduler.call(fn, "model-a")
+        self.assertEqual(fn.call_count, 1)
+
+    def test_gives_up_after_max_retries(self):
+        scheduler = RequestScheduler(max_retries=2, sleep=lambda _: None)
+        fn = MagicMock(side_effect=http_error(500))
+        with self.assertRaises(Exception):
+            scheduler.call(fn, "model-a")
+        self.assertEqual(fn.call_count, 3)
+
+    @patch('request_scheduler.RATE_LIMITS', {"tiny": {"rpm": 1}})
+    def test_request_bucket_throttles_and_times_out(self):
+        scheduler = RequestScheduler()
+        scheduler.call(lambda: "first", "tiny")
+        with self.assertRaises(SchedulerTimeout):
+            scheduler.call(lambda: "second", "tiny", max_wait=0.05)
+        # Other models are not held back
+        self.assertEqual(scheduler.call(lambda: "other", "model-b"), "other")
+
+    def test_rate_limit_headers_block_the_model(self):
+        scheduler = RequestScheduler()
+        scheduler.observe_headers("model-a", {"x-ratelimit-remaining-requests": "0",
+                                              "x-ratelimit-reset-requests": "30s"})
+        with self.assertRaises(SchedulerTimeout):
+            scheduler.acquire("model-a", max_wait=0.05)
+
+    def test_successful_responses_update_the_buckets(self):
+        scheduler = RequestScheduler()
+        response = MagicMock(headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "30s"})
+        self.assertIs(scheduler.call(lambda: response, "model-a"), response)
+        with self.assertRaises(SchedulerTimeout):
+            scheduler.acquire("model-a", max_wait=0.05)
+
+    def test_response_hook_reads_the_model_from_the_request(self):
+        scheduler = RequestScheduler()
+        request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions",
+                                json={"model": "model-a", "messages": []})
+        response = httpx.Response(200, request=request, headers={"x-ratelimit-remaining-requests": "0",
+                                                                 "x-ratelimit-reset-requests": "30s"})
+        with patch('request_scheduler.get_scheduler', return_value=scheduler):
+            observe_response(response)
+        with self.assertRaises(SchedulerTimeout):
+            scheduler.acquire("model-a", max_wait=0.05)
+        self.assertEqual(scheduler.call(lambda: "other", "model-b"), "other")
+
+    def test_queue_is_bounded(self):
+        scheduler = RequestScheduler(max_queue=0)
+        with self.assertRaises(SchedulerQueueFull):
+            scheduler.acquire("model-a")
+        self.assertEqual(scheduler.metrics()["rejected"], 1)
+
+    def test_async_call(self):
+        scheduler = RequestScheduler()
+
+        async def create():
+            return "async ok"
+
+        self.assertEqual(asyncio.run(scheduler.acall(create, "model-a")), "async ok")
+
+
+if __name__ == '__main__':
+    unittest.main()
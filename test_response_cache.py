@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+import response_cache
+from app import fetch_chat_response, ERROR_REPLY
+from db_testing import TemporaryDatabaseTestCase
+from response_cache import get_cached_response, store_response, make_cache_key
+
+HISTORY = [{"role": "system", "content": "You are my helpful assistant"}, {"role": "user", "content": "Hi  there "}]
+
+
+class TestResponseCache(TemporaryDatabaseTestCase):
+
+    def test_key_normalizes_whitespace_and_includes_params(self):
+        spaced = [{"role": "user", "content": "Hi\n there"}]
+        self.assertEqual(make_cache_key("m", spaced), make_cache_key("m", [{"role": "user", "content": "Hi there"}]))
+        self.assertNotEqual(make_cache_key("m", spaced), make_cache_key("m", spaced, {"temperature": 0.2}))
+        self.assertNotEqual(make_cache_key("m", spaced), make_cache_key("other", spaced))
+
+    def test_ttl_expiry(self):
+        store_response("m", HISTORY, "Hello!")
+        self.assertEqual(get_cached_response("m", HISTORY), "Hello!")
+        with patch('response_cache.RESPONSE_CACHE_TTL', -1):
+            self.assertIsNone(get_cached_response("m", HISTORY))
+
+    @patch('response_cache.RESPONSE_CACHE_MAX_ENTRIES', 2)
+    def test_lru_eviction(self):
+        histories = [[{"role": "user", "content": f"Prompt {i}"}] for i in range(3)]
+        store_response("m", histories[0], "reply 0")
+        store_response("m", histories[1], "reply 1")
+        get_cached_response("m", histories[0])  # touch so prompt 1 becomes least recently used
+        store_response("m", histories[2], "reply 2")
+
+        self.assertEqual(get_cached_response("m", histories[0]), "reply 0")
+        self.assertIsNone(get_cached_response("m", histories[1]))
+        self.assertEqual(get_cached_response("m", histories[2]), "reply 2")
+
+    @patch('app.st')
+    @patch('chat_core.RESPONSE_CACHE_ENABLED', True)
+    def test_fetch_chat_response_uses_cache_but_never_caches_errors(self, mock_st):
+        failing_client = MagicMock()
+        failing_client.chat.completions.create.side_effect = RuntimeError("boom")
+        self.assertEqual(fetch_chat_response(failing_client, HISTORY, "m"), ERROR_REPLY)
+        self.assertIsNone(get_cached_response("m", HISTORY))
+
+        client = MagicMock()
+        client.chat.completions.create.return_value.choices[0].message.content = "Hello!"
+        self.assertEqual(fetch_chat_response(client, HISTORY, "m"), "Hello!")
+        timings = {}
+        self.assertEqual(fetch_chat_response(client, HISTORY, "m", timings), "Hello!")
+        self.assertTrue(timings["cache_hit"])
+        fetch_chat_response(client, HISTORY, "m", use_cache=False)
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+        self.assertGreaterEqual(response_cache.cache_stats()["hits"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
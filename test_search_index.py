@@ -0,0 +1,67 @@
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from database import ChatMessage, session_scope
+from db_testing import TemporaryDatabaseTestCase
+from search_index import ensure_search_index, rebuild_search_index, search_messages, to_fts_query
+
+
+class TestSearchIndex(TemporaryDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with session_scope() as session:
+            session.add_all([
+                ChatMessage(role="user", content="How do llamas sleep?", timestamp=datetime(2024, 8, 1),
+                            model_id="model-a"),
+                ChatMessage(role="assistant", content="Llamas sleep lying down with their legs folded.",
+                            timestamp=datetime(2024, 8, 2), model_id="model-a"),
+            ])
+
+    def test_to_fts_query_quotes_terms(self):
+        self.assertEqual(to_fts_query('llama "OR sleep'), '"llama" "OR" "sleep"*')
+        self.assertEqual(to_fts_query("  ?! "), "")
+
+    def test_backfill_and_trigger_sync(self):
+        ensure_search_index()  # backfills rows written before the index existed
+        with session_scope() as session:
+            session.add(ChatMessage(role="user", content="Do alpacas sleep too?", timestamp=datetime(2024, 9, 1),
+                                    model_id="model-b"))
+
+        results, has_more = search_messages("sleep")
+        self.assertEqual(len(results), 3)
+        self.assertFalse(has_more)
+        self.assertIn("<mark>sleep</mark>", results[0]["snippet"])
+
+        results, _ = search_messages("sleep", role="assistant")
+        self.assertEqual([result["role"] for result in results], ["assistant"])
+        results, _ = search_messages("sleep", model_id="model-b", start=datetime(2024, 8, 15))
+        self.assertEqual(results[0]["content"], "Do alpacas sleep too?")
+
+        with session_scope() as session:
+            session.query(ChatMessage).delete()
+        self.assertEqual(search_messages("sleep")[0], [])
+
+    def test_pagination(self):
+        rebuild_search_index()
+        first_page, has_more = search_messages("llamas", page_size=1)
+        second_page, has_more_after = search_messages("llamas", page=1, page_size=1)
+        self.assertTrue(has_more)
+        self.assertFalse(has_more_after)
+        self.assertNotEqual(first_page[0]["id"], second_page[0]["id"])
+
+    @patch('search_index.fts_available', return_value=False)
+    def test_like_fallback_matches_wildcards_literally(self, mock_fts_available):
+        with session_scope() as session:
+            session.add(ChatMessage(role="user", content="100% of llama_facts", timestamp=datetime(2024, 9, 1)))
+
+        self.assertEqual(len(search_messages("sleep")[0]), 2)
+        self.assertEqual([result["content"] for result in search_messages("0%")[0]], ["100% of llama_facts"])
+        self.assertEqual(len(search_messages("a_f")[0]), 1)
+        self.assertEqual(search_messages("%")[0][0]["content"], "100% of llama_facts")
+        self.assertEqual(len(search_messages("%")[0]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import chat_core
+from metrics import SINGLE_FLIGHT_CALLS
+from single_flight import SingleFlight, SingleFlightTimeout, request_key
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow_call(self, result="reply"):
+        self.calls += 1
+        self.release.wait(5)
+        return result
+
+    def run_concurrently(self, fn, count=5):
+        with ThreadPoolExecutor(count) as executor:
+            futures = [executor.submit(fn) for _ in range(count)]
+            while self.flight.in_flight() == 0 or SINGLE_FLIGHT_CALLS.value(operation="test", role="coalesced") \
+                    < self.coalesced_before + count - 1:
+                time.sleep(0.01)
+            self.release.set()
+            return [future.result() for future in futures]
+
+    def test_request_key_is_canonical(self):
+        self.assertEqual(request_key("chat", model="m", params={"a": 1, "b": 2}),
+                         request_key("chat", params={"b": 2, "a": 1}, model="m"))
+        self.assertNotEqual(request_key("chat", model="m"), request_key("chat", model="n"))
+
+    def test_concurrent_callers_share_one_call(self):
+        self.coalesced_before = SINGLE_FLIGHT_CALLS.value(operation="test", role="coalesced")
+
+        results = self.run_concurrently(lambda: self.flight.do("key", self.slow_call, operation="test"))
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([result for result, _ in results], ["reply"] * 5)
+        self.assertEqual(sum(leader for _, leader in results), 1)
+        self.assertEqual(self.flight.in_flight(), 0)
+        # The next call is not joined to the finished one
+        self.assertEqual(self.flight.do("key", lambda: "fresh"), ("fresh", True))
+
+    def test_errors_are_shared(self):
+        self.coalesced_before = SINGLE_FLIGHT_CALLS.value(operation="test", role="coalesced")
+
+        def failing_call():
+            self.slow_call()
+            raise ConnectionError("offline")
+
+        def call():
+            try:
+                self.flight.do("key", failing_call, operation="test")
+            except ConnectionError as e:
+                return str(e)
+
+        self.assertEqual(self.run_concurrently(call), ["offline"] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_followers_time_out_and_later_callers_start_a_new_call(self):
+        leader = threading.Thread(target=self.flight.do, args=("key", self.slow_call), kwargs={"timeout": 0.1})
+        leader.start()
+        while not self.flight.in_flight():
+            time.sleep(0.01)
+
+        with self.assertRaises(SingleFlightTimeout):
+            self.flight.do("key", self.slow_call)
+        self.assertEqual(self.flight.do("key", lambda: "new call"), ("new call", True))
+        self.release.set()
+        leader.join()
+
+    def test_followers_retry_when_the_leader_is_interrupted(self):
+        started = threading.Event()
+
+        def interrupted_call():
+            started.set()
+            self.release.wait(5)
+            raise Interrupted()
+
+        def lead():
+            with self.assertRaises(Interrupted):
+                self.flight.do("key", interrupted_call)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait(5)
+        coalesced_before = SINGLE_FLIGHT_CALLS.value(operation="interrupted", role="coalesced")
+        with ThreadPoolExecutor(1) as executor:
+            follower = executor.submit(self.flight.do, "key", lambda: "own call", "interrupted")
+            while SINGLE_FLIGHT_CALLS.value(operation="interrupted", role="coalesced") == coalesced_before:
+                time.sleep(0.01)
+            self.release.set()
+            self.assertEqual(follower.result(timeout=5), ("own call", True))
+        leader.join()
+
+    def test_async_callers_share_one_call(self):
+        async def call():
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            return "reply"
+
+        async def main():
+            return await asyncio.gather(*(self.flight.ado("key", call) for _ in range(3)))
+
+        results = asyncio.run(main())
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(leader for _, leader in results), [False, False, True])
+
+    def test_stream_is_replayed_to_late_joiners(self):
+        chunks = threading.Semaphore(0)
+
+        def open_stream():
+            self.calls += 1
+            for part in ["a", "b", "c"]:
+                chunks.acquire(timeout=5)
+                yield part
+
+        first, leader = self.flight.stream("key", open_stream)
+        chunks.release()
+        self.assertEqual(next(first), "a")
+        second, second_leader = self.flight.stream("key", open_stream)
+        chunks.release()
+        chunks.release()
+
+        self.assertEqual((leader, second_leader), (True, False))
+        self.assertEqual(list(first), ["b", "c"])
+        self.assertEqual(list(second), ["a", "b", "c"])
+        self.assertEqual(self.calls, 1)
+
+    def test_stream_stops_when_every_reader_stops(self):
+        closed = threading.Event()
+
+        def open_stream():
+            try:
+                while True:
+                    time.sleep(0.01)
+                    yield "a"
+            finally:
+                closed.set()
+
+        chunks, _ = self.flight.stream("key", open_stream)
+        next(chunks)
+        chunks.close()
+
+        self.assertTrue(closed.wait(5))
+        for _ in range(100):
+            if self.flight.in_flight() == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.flight.in_flight(), 0)
+
+    def test_unstarted_readers_that_are_dropped_let_the_stream_stop(self):
+        closed = threading.Event()
+
+        def open_stream():
+            try:
+                while True:
+                    time.sleep(0.01)
+                    yield "a"
+            finally:
+                closed.set()
+
+        chunks, _ = self.flight.stream("key", open_stream)
+        follower, _ = self.flight.stream("key", open_stream)
+        del chunks
+        self.assertEqual(next(follower), "a")
+        follower.close()
+
+        self.assertTrue(closed.wait(5))
+
+    def test_callers_joining_an_abandoned_stream_start_a_new_one(self):
+        finishing = threading.Event()
+        finish = self.flight._finish
+
+        def slow_finish(*args, **kwargs):
+            finishing.set()
+            self.release.wait(5)
+            finish(*args, **kwargs)
+
+        def open_stream():
+            self.calls += 1
+            while True:
+                time.sleep(0.01)
+                yield "a"
+
+        with patch.object(self.flight, "_finish", side_effect=slow_finish):
+            chunks, _ = self.flight.stream("key", open_stream)
+            next(chunks)
+            chunks.close()
+            self.assertTrue(finishing.wait(5))  # the pump gave up but the flight is still registered
+
+            retried, leader = self.flight.stream("key", open_stream)
+            self.assertTrue(leader)
+            self.assertEqual(next(retried), "a")
+            retried.close()
+        self.release.set()
+        self.assertEqual(self.calls, 2)
+
+    def test_async_unstarted_readers_that_are_dropped_let_the_stream_stop(self):
+        closed = []
+
+        async def open_stream():
+            async def chunks():
+                try:
+                    while True:
+                        await asyncio.sleep(0.01)
+                        yield "a"
+                finally:
+                    closed.append(True)
+            return chunks()
+
+        async def run():
+            chunks, _ = self.flight.astream("key", open_stream)
+            del chunks
+            for _ in range(100):
+                if self.flight.in_flight() == 0:
+                    break
+                await asyncio.sleep(0.01)
+            return self.flight.in_flight()
+
+        self.assertEqual(asyncio.run(run()), 0)
+        self.assertEqual(closed, [True])
+
+
+class TestChatCoalescing(unittest.TestCase):
+
+    @patch('chat_core.record_turn')
+    def test_duplicate_submits_share_one_completion(self, mock_record_turn):
+        release = threading.Event()
+        client = MagicMock()
+        client.api_key = "key"
+
+        def create(**kwargs):
+            release.wait(5)
+            response = MagicMock()
+            response.choices[0].message.content = "Hello"
+            return response
+
+        client.chat.completions.create.side_effect = create
+        history = [{"role": "user", "content": "Hi"}]
+        timings = [{}, {}]
+        coalesced_before = SINGLE_FLIGHT_CALLS.value(operation="chat", role="coalesced")
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(chat_core.complete_chat, client, history, "model-id", timings[i], False)
+                       for i in range(2)]
+            while SINGLE_FLIGHT_CALLS.value(operation="chat", role="coalesced") == coalesced_before:
+                time.sleep(0.01)
+            release.set()
+            replies = [future.result() for future in futures]
+
+        self.assertEqual(replies, ["Hello", "Hello"])
+        client.chat.completions.create.assert_called_once()
+        self.assertEqual(sum(bool(timing.get("coalesced")) for timing in timings), 1)
+        usages = [call.args[2] for call in mock_record_turn.call_args_list]
+        self.assertEqual(sum(usage is None for usage in usages), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+
+import static_assets
+from static_assets import LOTTIE_SOURCES, cached_by_mtime, load_lottie
+
+
+class TestStaticAssets(unittest.TestCase):
+
+    def test_cached_by_mtime_reloads_when_file_changes(self):
+        loader = MagicMock(side_effect=lambda path: open(path).read())
+        cached_loader = cached_by_mtime(loader)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "config.json")
+            with open(path, "w") as f:
+                f.write("first")
+
+            self.assertEqual(cached_loader(path), "first")
+            self.assertEqual(cached_loader(path), "first")
+            self.assertEqual(loader.call_count, 1)
+
+            with open(path, "w") as f:
+                f.write("second")
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000_000))
+            self.assertEqual(cached_loader(path), "second")
+            self.assertEqual(loader.call_count, 2)
+
+    def test_missing_files_are_not_cached(self):
+        cached_loader = cached_by_mtime(MagicMock(side_effect=FileNotFoundError))
+        with self.assertRaises(FileNotFoundError):
+            cached_loader("/missing/config.json")
+
+    @patch('static_assets.requests.get')
+    def test_missing_animation_is_downloaded_in_the_background(self, mock_get):
+        mock_get.return_value.json.return_value = {"layers": []}
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.object(static_assets, "LOTTIE_DIR", tmp_dir):
+            self.assertIsNone(load_lottie("welcome"))  # rendered without it while it downloads
+            with static_assets._fetch_lock:
+                thread = static_assets._fetching.get("welcome")
+            if thread is not None:
+                thread.join(5)
+
+            self.assertEqual(load_lottie("welcome"), {"layers": []})
+            self.assertEqual(os.listdir(tmp_dir), ["welcome.json"])
+        mock_get.assert_called_once_with(LOTTIE_SOURCES["welcome"], timeout=static_assets.LOTTIE_FETCH_TIMEOUT)
+
+    @patch('static_assets.requests.get', side_effect=requests.ConnectionError)
+    def test_failed_download_is_not_retried_right_away(self, mock_get):
+        with tempfile.TemporaryDirectory() as tmp_dir, patch.object(static_assets, "LOTTIE_DIR", tmp_dir), \
+                patch.dict(static_assets._failed_fetches, clear=True):
+            static_assets._start_fetch("loading").join(5)
+            self.assertIsNone(static_assets._start_fetch("loading"))
+            self.assertIsNone(load_lottie("loading"))
+            self.assertIsNone(static_assets._start_fetch("unknown"))
+        self.assertEqual(mock_get.call_count, 1)
+
+    def test_animations_can_be_disabled(self):
+        with patch.object(static_assets, "ANIMATIONS_ENABLED", False):
+            self.assertIsNone(load_lottie("welcome"))
+
+
+if __name__ == '__main__':
+    unittest.main()
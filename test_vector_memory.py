@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import chat_core
+import database
+from context_window import build_context
+from db_testing import TemporaryDatabaseTestCase
+from vector_memory import embed, get_memory_index, index_new_messages, rebuild_memory, recall_messages
+
+MODEL = {"id": "llama3-8b-8192"}
+
+
+class TestVectorMemory(TemporaryDatabaseTestCase):
+    app_schema = True
+
+    def setUp(self):
+        super().setUp()
+        user_id = chat_core.get_or_create_user("alice")
+        self.conversation_id = chat_core.create_conversation(user_id)
+        self.other_conversation_id = chat_core.create_conversation(chat_core.get_or_create_user("bob"))
+
+    def save(self, content, conversation_id=None, role="user"):
+        return chat_core.save_message(role, content, "2024-08-12T21:54:44", MODEL,
+                                      conversation_id or self.conversation_id)
+
+    def test_embeddings_are_unit_length_and_similar_for_related_text(self):
+        first = embed("My cat is called Whiskers")
+        related = embed("what is my cat called?")
+        unrelated = embed("Deploy the kubernetes cluster tonight")
+
+        self.assertAlmostEqual(float(np.linalg.norm(first)), 1.0, places=5)
+        self.assertGreater(float(first @ related), float(first @ unrelated))
+        self.assertFalse(embed("").any())
+
+    def test_saved_messages_are_indexed_incrementally(self):
+        first_id = self.save("My cat is called Whiskers")
+        self.assertEqual(len(get_memory_index()), 1)
+        second_id = self.save("The build runs on Python 3.11")
+
+        self.assertEqual(get_memory_index().last_message_id(), second_id)
+        self.assertEqual(index_new_messages(), 0)
+        self.assertEqual(recall_messages("What is my cat called?", self.conversation_id)[0]["id"], first_id)
+
+    def test_recall_is_scoped_to_the_user_and_skips_excluded_and_deleted_messages(self):
+        cat_id = self.save("My cat is called Whiskers")
+        self.save("My cat is called Felix", self.other_conversation_id)
+        dog_id = self.save("My dog is called Rex and my cat is called Whiskers")
+
+        recalled = recall_messages("what is my cat called", self.conversation_id, exclude_ids={dog_id})
+        self.assertEqual([memory["id"] for memory in recalled], [cat_id])
+
+        with database.session_scope() as session:
+            session.query(database.ChatMessage).filter_by(id=cat_id).delete()
+        self.assertEqual(recall_messages("what is my cat called", self.conversation_id, exclude_ids={dog_id}), [])
+
+    def test_ids_of_deleted_newest_messages_are_not_reused(self):
+        self.save("Remember the parking spot is B12")
+        deleted_id = self.save("The wifi password is llama")
+        with database.session_scope() as session:
+            session.query(database.ChatMessage).filter_by(id=deleted_id).delete()
+
+        new_id = self.save("Tomorrow's meeting moved to 3pm")
+
+        self.assertGreater(new_id, deleted_id)
+        self.assertEqual(recall_messages("wifi password", self.conversation_id), [])
+        self.assertEqual(rebuild_memory(), 2)
+        self.assertEqual(recall_messages("meeting tomorrow", self.conversation_id)[0]["id"], new_id)
+
+    def test_recalled_messages_are_injected_within_the_budget(self):
+        self.save("My cat is called Whiskers. " + "She sleeps all day in the sun by the window. " * 3)
+        latest = {"role": "user", "content": "What was my cat called again?", "timestamp": "2024-08-13T10:00:00"}
+
+        with patch('context_window.MEMORY_MAX_TOKENS', 40):
+            messages = build_context([latest], "system", "llama3-8b-8192", conversation_id=self.conversation_id)
+
+        self.assertEqual(len(messages), 3)
+        self.assertIn("My cat is called Whiskers", messages[1]["content"])
+        self.assertLessEqual(len(messages[1]["content"]), 40 * 4)
+        self.assertTrue(messages[1]["content"].endswith("…"))
+        self.assertEqual(messages[-1]["content"], latest["content"])
+
+        with patch('context_window.MEMORY_TOP_K', 0):
+            self.assertEqual(len(build_context([latest], "system", "llama3-8b-8192",
+                                               conversation_id=self.conversation_id)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,346 @@
+"""Long-term memory: every stored message embedded locally and searched by cosine similarity.
+
+Messages are embedded with signed feature hashing of words and character trigrams, so no model or extra
+dependency is needed. The vectors live in append-only files next to the database that are memory-mapped for
+search, together with the message id, conversation id and content checksum of each row. Each saved message is
+appended as it is written, and the index catches up by id on rows saved elsewhere (other processes, the
+write-behind queue). Rows whose message was deleted or archived are skipped at recall time and dropped by
+`python vector_memory.py rebuild`.
+"""
+import argparse
+import os
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.exc import SQLAlchemyError
+
+import database
+from database import Base, ChatMessage, Conversation, get_engine, session_scope
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within a process
+    fcntl = None
+
+# Earlier messages recalled into each prompt; 0 turns recall off
+MEMORY_TOP_K = int(os.getenv("LLAMABOT_MEMORY_TOP_K", "4"))
+# Upper bound on the prompt tokens spent on recalled messages
+MEMORY_MAX_TOKENS = int(os.getenv("LLAMABOT_MEMORY_MAX_TOKENS", "512"))
+# Messages less similar than this to the latest turn are never recalled
+MEMORY_MIN_SIMILARITY = float(os.getenv("LLAMABOT_MEMORY_MIN_SIMILARITY", "0.25"))
+# Defaults to "<database name>_memory/" next to the database
+MEMORY_DIR = os.getenv("LLAMABOT_MEMORY_DIR")
+
+EMBEDDING_DIM = 512  # a power of two, so a feature's slot is the low bits of its hash
+SIGN_BIT = 1 << 31
+WORD_WEIGHT = 2.0  # relative to each of the word's trigrams
+# Too common to say anything about what a message is about
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do for from has have how i in is it me my of on or so that the this to was "
+    "we what when where which who why will with you your".split()
+)
+SEARCH_CHUNK_ROWS = 65536  # bounds the scores held in memory at once
+SYNC_BATCH_SIZE = 1000
+CANDIDATE_FACTOR = 4  # over-fetch, since some candidates may have been deleted from the database
+TAIL_CHECK_ROWS = 16
+
+
+def memory_dir() -> str:
+    return MEMORY_DIR or os.path.splitext(database.DB_NAME)[0] + "_memory"
+
+
+@lru_cache(maxsize=65536)
+def _word_features(word: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(slots, signed weights) of a word and its character trigrams, which match inflections and typos."""
+    padded = f"<{word}>"
+    features = [word] + ["#" + padded[i:i + 3] for i in range(len(padded) - 2)]
+    hashes = np.array([zlib.crc32(feature.encode()) for feature in features], dtype=np.uint32)
+    weights = np.ones(len(features))
+    weights[0] = WORD_WEIGHT
+    return (hashes & (EMBEDDING_DIM - 1)).astype(np.intp), np.where(hashes & SIGN_BIT, -weights, weights)
+
+
+def embed(text: str) -> np.ndarray:
+    """Unit-length float32 vector of the text's hashed word and character-trigram counts."""
+    words = [word for word in re.findall(r"\w+", text.lower(), flags=re.UNICODE) if word not in STOPWORDS]
+    if not words:
+        return np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    features = [_word_features(word) for word in words]
+    vector = np.bincount(np.concatenate([slots for slots, _ in features]),
+                         weights=np.concatenate([weights for _, weights in features]), minlength=EMBEDDING_DIM)
+    # Sublinear counts, so one repeated word does not dominate a message
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).astype(np.float32)
+
+
+class MemoryIndex:
+    """Append-only vectors with their (message id, conversation id, content checksum) rows, by message id."""
+
+    ROW_IDS = 3  # message id, conversation id (-1 when the message has none), CRC-32 of the content
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, f"vectors-{EMBEDDING_DIM}.f32")
+        self.ids_path = os.path.join(directory, "ids.i64")
+        self._lock = threading.Lock()
+        self._mapped = None  # (row count, vectors, ids) of the last mapping
+
+    def _row_count(self) -> int:
+        try:
+            vector_rows = os.path.getsize(self.vectors_path) // (EMBEDDING_DIM * 4)
+            id_rows = os.path.getsize(self.ids_path) // (self.ROW_IDS * 8)
+        except FileNotFoundError:
+            return 0
+        # A write interrupted between the two files leaves a partial row, which is ignored
+        return min(vector_rows, id_rows)
+
+    def _map(self):
+        rows = self._row_count()
+        if self._mapped is None or self._mapped[0] != rows:
+            if rows == 0:
+                self._mapped = (0, np.zeros((0, EMBEDDING_DIM), np.float32), np.zeros((0, self.ROW_IDS), np.int64))
+            else:
+                self._mapped = (rows, np.memmap(self.vectors_path, np.float32, "r", shape=(rows, EMBEDDING_DIM)),
+                                np.memmap(self.ids_path, np.int64, "r", shape=(rows, self.ROW_IDS)))
+        return self._mapped
+
+    def __len__(self) -> int:
+        return self._map()[0]
+
+    def last_message_id(self) -> int:
+        rows = self._row_count()
+        if not rows:
+            return 0
+        # Read directly rather than through a fresh mapping, as this runs for every saved message
+        with open(self.ids_path, "rb") as ids_file:
+            ids_file.seek((rows - 1) * self.ROW_IDS * 8)
+            return int(np.frombuffer(ids_file.read(8), dtype=np.int64)[0])
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Serializes writers across threads and processes, and trims partial rows left by a crash."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, "lock"), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.truncate(self._row_count())
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def truncate(self, rows: int):
+        """Trims bytes past `rows`; only ever unmapped bytes, since readers map whole rows up to the shorter file."""
+        self._mapped = None
+        for path, row_bytes in ((self.vectors_path, EMBEDDING_DIM * 4), (self.ids_path, self.ROW_IDS * 8)):
+            if os.path.exists(path) and os.path.getsize(path) > rows * row_bytes:
+                os.truncate(path, rows * row_bytes)
+
+    def keep(self, rows: int):
+        """Shortens the index to its first `rows` rows.
+
+        The files are replaced rather than truncated, so other processes keep a valid mapping of the old ones.
+        """
+        _, vectors, ids = self._map()
+        for path, data in ((self.vectors_path, vectors[:rows]), (self.ids_path, ids[:rows])):
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as temp_file:
+                temp_file.write(np.ascontiguousarray(data).tobytes())
+            os.replace(temp_path, path)
+        self._mapped = None
+
+    def id_rows(self, start: int, end: int) -> np.ndarray:
+        """(message id, conversation id, checksum) of rows `start` to `end`."""
+        return np.array(self._map()[2][start:end])
+
+    def append(self, message_ids: List[int], conversation_ids: List[Optional[int]], contents: List[str],
+               vectors: np.ndarray):
+        ids = np.array([[message_id, -1 if conversation_id is None else conversation_id, checksum(content)]
+                        for message_id, conversation_id, content in zip(message_ids, conversation_ids, contents)],
+                       dtype=np.int64)
+        with open(self.vectors_path, "ab") as vectors_file:
+            vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.ids_path, "ab") as ids_file:
+            ids_file.write(ids.tobytes())
+        self._mapped = None
+
+    def search(self, query: np.ndarray, k: int, min_similarity: Optional[float] = None,
+               exclude_ids: Iterable[int] = (), conversation_ids: Optional[Iterable[int]] = None) -> List[tuple]:
+        """The `k` best (message id, similarity, checksum) rows, best first, by cosine similarity to `query`."""
+        rows, vectors, ids = self._map()
+        min_similarity = MEMORY_MIN_SIMILARITY if min_similarity is None else min_similarity
+        exclude = np.fromiter(exclude_ids, dtype=np.int64)
+        scope = None if conversation_ids is None else np.fromiter(conversation_ids, dtype=np.int64)
+        best_rows, best_scores = np.zeros((0, self.ROW_IDS), np.int64), np.zeros(0, np.float32)
+        for start in range(0, rows, SEARCH_CHUNK_ROWS):
+            # Vectors are unit length, so the dot product is the cosine similarity
+            scores = vectors[start:start + SEARCH_CHUNK_ROWS] @ query
+            chunk_ids = ids[start:start + SEARCH_CHUNK_ROWS]
+            keep = scores >= min_similarity
+            if exclude.size:
+                keep &= ~np.isin(chunk_ids[:, 0], exclude)
+            if scope is not None:
+                keep &= np.isin(chunk_ids[:, 1], scope)
+            best_rows = np.concatenate([best_rows, chunk_ids[keep]])
+            best_scores = np.concatenate([best_scores, scores[keep]])
+            if best_scores.size > k:
+                top = np.argpartition(-best_scores, k)[:k]
+                best_rows, best_scores = best_rows[top], best_scores[top]
+        order = np.argsort(-best_scores, kind="stable")
+        return [(int(best_rows[i, 0]), float(best_scores[i]), int(best_rows[i, 2])) for i in order]
+
+
+def checksum(content: Optional[str]) -> int:
+    return zlib.crc32((content or "").encode())
+
+
+_indexes: Dict[str, MemoryIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_memory_index() -> MemoryIndex:
+    directory = memory_dir()
+    with _indexes_lock:
+        if directory not in _indexes:
+            _indexes[directory] = MemoryIndex(directory)
+        return _indexes[directory]
+
+
+def _drop_reused_rows(index: MemoryIndex):
+    """Forgets the newest rows whose message was deleted or replaced.
+
+    A replaced database file hands out ids the index already holds, so a row can describe another message's
+    content.
+    """
+    kept, checked = len(index), TAIL_CHECK_ROWS
+    while kept:
+        rows = index.id_rows(max(0, kept - checked), kept)
+        with session_scope() as session:
+            stored = dict(session.query(ChatMessage.id, ChatMessage.content).filter(
+                ChatMessage.id.in_([int(message_id) for message_id in rows[:, 0]])))
+        matches = [int(row[0]) in stored and checksum(stored[int(row[0])]) == row[2] for row in rows]
+        if any(matches):
+            kept -= matches[::-1].index(True)
+            break
+        kept -= len(rows)
+        checked *= 2  # a replaced database is walked back in a few queries
+    if kept < len(index):
+        index.keep(kept)
+
+
+def index_new_messages() -> int:
+    """Embeds the stored messages the index has not seen yet; returns how many were added.
+
+    The first call on an existing database backfills the index. A failure only delays indexing until the next
+    call.
+    """
+    index = get_memory_index()
+    added = 0
+    try:
+        with index.writing():
+            _drop_reused_rows(index)
+            while True:
+                with session_scope() as session:
+                    rows = session.query(ChatMessage.id, ChatMessage.conversation_id, ChatMessage.content).filter(
+                        ChatMessage.id > index.last_message_id()
+                    ).order_by(ChatMessage.id).limit(SYNC_BATCH_SIZE).all()
+                if rows:
+                    index.append([row.id for row in rows], [row.conversation_id for row in rows],
+                                 [row.content for row in rows], np.stack([embed(row.content or "") for row in rows]))
+                    added += len(rows)
+                if len(rows) < SYNC_BATCH_SIZE:
+                    return added
+    except (OSError, SQLAlchemyError):
+        return added
+
+
+def remember(message_id: int, conversation_id: Optional[int], content: str):
+    """Indexes a message this process just saved.
+
+    When it directly follows the newest indexed row, it is appended without reading the database; otherwise
+    the index catches up on every row it is missing.
+    """
+    index = get_memory_index()
+    try:
+        with index.writing():
+            if index.last_message_id() == message_id - 1:
+                index.append([message_id], [conversation_id], [content], embed(content)[np.newaxis])
+                return
+    except OSError:
+        return
+    index_new_messages()
+
+
+def rebuild_memory() -> int:
+    """Re-embeds every stored message, dropping rows of deleted or archived messages."""
+    index = get_memory_index()
+    with index.writing():
+        index.keep(0)
+    return index_new_messages()
+
+
+def _user_conversations(conversation_id: Optional[int]) -> Optional[List[int]]:
+    """Conversations of the same user as `conversation_id`, so one user never recalls another's messages."""
+    if conversation_id is None:
+        return None
+    with session_scope() as session:
+        owner = session.query(Conversation.user_id).filter_by(id=conversation_id).scalar_subquery()
+        return [row.id for row in session.query(Conversation.id).filter(Conversation.user_id == owner)]
+
+
+def recall_messages(query: str, conversation_id: Optional[int] = None, exclude_ids: Iterable[int] = (),
+                    k: int = MEMORY_TOP_K) -> List[Dict]:
+    """The `k` stored messages most similar to `query`, best first, each with its `similarity`.
+
+    Only messages from the same user's conversations are searched; `exclude_ids` are messages already in the
+    prompt.
+    """
+    if k <= 0 or not query.strip():
+        return []
+    index_new_messages()
+    query_vector = embed(query)
+    if not query_vector.any():
+        return []
+    hits = get_memory_index().search(query_vector, k * CANDIDATE_FACTOR, exclude_ids=set(exclude_ids),
+                                     conversation_ids=_user_conversations(conversation_id))
+    if not hits:
+        return []
+    with session_scope() as session:
+        rows = {row.id: row for row in session.query(ChatMessage).filter(
+            ChatMessage.id.in_([hit[0] for hit in hits]))}
+        recalled = [
+            {"id": message_id, "role": rows[message_id].role, "content": rows[message_id].content,
+             "timestamp": rows[message_id].timestamp.isoformat(), "similarity": similarity}
+            for message_id, similarity, expected in hits
+            if message_id in rows and checksum(rows[message_id].content) == expected
+        ]
+    return recalled[:k]
+
+
+def memory_stats() -> Dict:
+    index = get_memory_index()
+    return {"directory": index.directory, "vectors": len(index), "last_message_id": index.last_message_id()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the long-term memory index of the chat history.")
+    parser.add_argument("command", choices=["rebuild", "stats"],
+                        help="rebuild: re-embed every stored message; stats: show the index size")
+    args = parser.parse_args()
+    Base.metadata.create_all(get_engine())
+    if args.command == "rebuild":
+        print(f"Indexed {rebuild_memory()} messages.")
+    else:
+        print(memory_stats())
+
+
+if __name__ == "__main__":
+    main()